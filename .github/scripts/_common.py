@@ -2,29 +2,192 @@
 """sync-*.py 共用工具（仅标准库）。
 
 抽取三个同步脚本中重复的文件写入与 URL 下载逻辑：
-- write_if_changed: 内容无变化时不写盘
+- write_if_changed: 内容无变化时不写盘（支持行迭代器流式写入，原子替换）
+- open_if_changed:  推式流写入版 write_if_changed（多个输出可在同一趟循环中交替写）
+- sha256_file:      文件内容 sha256（分块读取），文件不存在返回 None
 - encode_url:       对 URL path 做百分号编码
-- fetch_url:        单个 URL 下载（可选编码）
-- prefetch_urls:    线程池并发下载，返回 {原始 url: text_or_None}
+- fetch_text:       单个 URL 下载（条件请求 + 磁盘缓存 + 退避重试），失败抛异常
+- fetch_url:        同上，失败打印并返回 None
+- FETCH_BUDGET:     本次运行的重试策略与失败记录（区分确定 404 与瞬时失败）
+- prefetch_urls:    并发下载（asyncio keep-alive 连接池），返回 {原始 url: text_or_None}
+- RUN_STATS:        本进程的 I/O 计量（写入字节 / 文件数、各 URL 下载字节与耗时），供运行报告
+
+下载缓存：每个 URL 在 FETCH_CACHE_DIR 下存 body 与 ETag / Last-Modified，再次下载
+时带 If-None-Match / If-Modified-Since，上游返回 304 即直接用缓存 body。
+目录可用环境变量 SYNC_FETCH_CACHE 覆盖，设为空串则关闭缓存。
 """
 
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import ssl
+import stat
 import sys
+import tempfile
+import threading
+import time
+import urllib.error
 import urllib.request
 import urllib.parse
+from collections.abc import Iterable
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # URL path 百分号编码时保留的安全字符
 _URL_SAFE = "/-_.~!$&'()*+,;=:@%"
 
+# write_if_changed：分块比较的块大小 / 行迭代写入时每批编码的行数
+_CHUNK_SIZE = 1 << 16
+_LINE_BATCH = 4096
 
-def write_if_changed(path: Path, content: str) -> bool:
-    """内容与现有文件一致时跳过写入；写入返回 True，跳过返回 False。"""
-    path.parent.mkdir(parents=True, exist_ok=True)
-    if path.exists() and path.read_text(encoding="utf-8") == content:
+# 新建文件的权限（mkstemp 固定 0600，rename 前需改回）。不读进程 umask：os.umask 只能
+# 「设置并返回旧值」，读一次就要改写两次，多线程写文件时并不安全
+_NEW_FILE_MODE = 0o644
+
+
+def _default_cache_dir() -> Path | None:
+    """SYNC_FETCH_CACHE 未设置 → 脚本目录下 .fetch-cache；设为空串 → 关闭缓存。"""
+    env = os.environ.get("SYNC_FETCH_CACHE")
+    if env is None:
+        return Path(__file__).resolve().parent / ".fetch-cache"
+    return Path(env) if env else None
+
+
+# 条件请求缓存目录（.gitignore 已忽略；CI 由 actions/cache 跨运行保留）
+FETCH_CACHE_DIR = _default_cache_dir()
+
+
+class RunStats:
+    """本进程的 I/O 计量：实际落盘的字节 / 文件数，及各 URL 的下载字节、耗时、
+    是否命中缓存（304）、尝试次数。线程安全（prefetch 线程池会并发记录）。"""
+
+    __slots__ = ("lock", "bytes_written", "files_written", "downloads")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.bytes_written = 0
+        self.files_written = 0
+        self.downloads: dict[str, dict] = {}
+
+    def wrote(self, nbytes: int) -> None:
+        self.add_written(nbytes, 1)
+
+    def add_written(self, nbytes: int, nfiles: int) -> None:
+        with self.lock:
+            self.bytes_written += nbytes
+            self.files_written += nfiles
+
+    def downloaded(self, url: str, *, nbytes: int, seconds: float, cached: bool,
+                   attempts: int, ok: bool) -> None:
+        with self.lock:
+            self.downloads[url] = {"bytes": nbytes, "seconds": round(seconds, 4),
+                                   "cached": cached, "attempts": attempts, "ok": ok}
+
+    @property
+    def bytes_downloaded(self) -> int:
+        with self.lock:
+            return sum(d["bytes"] for d in self.downloads.values())
+
+
+RUN_STATS = RunStats()
+
+
+def _same_bytes(path: Path, data: bytes) -> bool:
+    """path 现有内容是否恰为 data：先比 stat 大小，再分块逐段比较（不整文件读入）。"""
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        view = memoryview(data)
+        offset = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(_CHUNK_SIZE):
+                if view[offset:offset + len(chunk)] != chunk:
+                    return False
+                offset += len(chunk)
+        return offset == len(data)
+    except FileNotFoundError:
         return False
-    path.write_text(content, encoding="utf-8")
-    return True
+
+
+class ChangeWriter:
+    """open_if_changed 产出的推式写入器：write(line) 逐行写入（自动补 '\\n'），
+    按批编码并累计大小与 sha256；退出 with 后 changed 表示是否替换了目标文件。"""
+
+    __slots__ = ("_f", "_digest", "_batch", "size", "changed")
+
+    def __init__(self, f) -> None:
+        self._f = f
+        self._digest = hashlib.sha256()
+        self._batch: list[str] = []
+        self.size = 0
+        self.changed = False
+
+    def write(self, line: str) -> None:
+        batch = self._batch
+        batch.append(line)
+        if len(batch) >= _LINE_BATCH:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._batch:
+            data = ("\n".join(self._batch) + "\n").encode("utf-8")
+            self._digest.update(data)
+            self._f.write(data)
+            self.size += len(data)
+            self._batch.clear()
+
+
+@contextlib.contextmanager
+def open_if_changed(path: Path):
+    """流式版 write_if_changed：yield ChangeWriter，调用方边生成边 write(line)，
+    无需拼出整段输出。退出时与现有文件比较（先比大小，再比分块 sha256），
+    不同才原子替换；结果见 writer.changed。with 块内异常则目标文件不受影响。"""
+    with _atomic_tmp(path) as (f, commit):
+        w = ChangeWriter(f)
+        yield w
+        w._flush()
+        f.flush()
+        try:
+            same = (path.stat().st_size == w.size
+                    and sha256_file(path) == w._digest.hexdigest())
+        except FileNotFoundError:
+            same = False
+        if not same:
+            commit()
+            w.changed = True
+
+
+def write_if_changed(path: Path, content: str | bytes | Iterable[str]) -> bool:
+    """内容与现有文件一致时跳过写入；写入返回 True，跳过返回 False。
+
+    content 为 str 时原样写入（bytes 同理，用于 .srs 等二进制产物）；为可迭代对象时
+    视作行序列（每行补 '\\n'），经
+    open_if_changed 边生成边写入，调用方无需拼出整段输出字符串。
+    比较先看 stat 大小，大小相同再比内容；写入一律走临时文件 + rename（原子替换）。
+    """
+    if isinstance(content, (str, bytes)):
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        if _same_bytes(path, data):
+            return False
+        _atomic_write_bytes(path, data)
+        return True
+
+    with open_if_changed(path) as w:
+        for line in content:
+            w.write(line)
+    return w.changed
+
+
+def sha256_file(path: Path) -> str | None:
+    """返回文件内容的 sha256 十六进制摘要（分块读取，不整文件入内存）；不存在返回 None。"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
 
 
 def encode_url(url: str) -> str:
@@ -34,29 +197,484 @@ def encode_url(url: str) -> str:
     return urllib.parse.urlunparse(parsed._replace(path=encoded_path))
 
 
-def fetch_url(url: str, ua: str, *, encode: bool = False, timeout: int = 30) -> str | None:
-    """下载 url，返回文本；失败返回 None。encode=True 时先对 path 百分号编码。"""
-    target = encode_url(url) if encode else url
+@contextlib.contextmanager
+def _atomic_tmp(path: Path):
+    """在 path 同目录开临时文件，yield (文件对象, commit)。
+
+    commit() 标记需要替换：退出时 rename 覆盖 path（沿用原文件权限，新文件为
+    _NEW_FILE_MODE）；未 commit 或中途异常则删除临时文件，path 不受影响。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    committed = False
+
+    def commit() -> None:
+        nonlocal committed
+        committed = True
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f, commit
+        if committed:
+            try:
+                mode = stat.S_IMODE(path.stat().st_mode)
+            except FileNotFoundError:
+                mode = _NEW_FILE_MODE
+            os.chmod(tmp, mode)
+            size = os.stat(tmp).st_size
+            os.replace(tmp, path)
+            RUN_STATS.wrote(size)
+    finally:
+        Path(tmp).unlink(missing_ok=True)  # rename 成功后已不存在
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """写临时文件后 rename，中途失败不留半截文件。"""
+    with _atomic_tmp(path) as (f, commit):
+        f.write(data)
+        commit()
+
+
+def _cache_paths(url: str) -> tuple[Path, Path] | None:
+    """url → (元数据 .json, body) 缓存路径；缓存关闭时返回 None。"""
+    if FETCH_CACHE_DIR is None:
+        return None
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return FETCH_CACHE_DIR / f"{key}.json", FETCH_CACHE_DIR / f"{key}.body"
+
+
+def _load_cache(url: str) -> tuple[dict, bytes] | None:
+    """读取 url 的缓存 (元数据, body)；缺失或损坏返回 None。"""
+    paths = _cache_paths(url)
+    if paths is None:
+        return None
+    meta_path, body_path = paths
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("url") != url:
+            return None
+        return meta, body_path.read_bytes()
+    except (OSError, ValueError):
+        return None
+
+
+def _store_cache(url: str, body: bytes, etag: str | None, last_modified: str | None) -> None:
+    """200 响应落缓存：仅当上游给了 ETag 或 Last-Modified（否则无法做条件请求）。"""
+    paths = _cache_paths(url)
+    if paths is None or (not etag and not last_modified):
+        return
+    meta_path, body_path = paths
+    meta = {"url": url, "etag": etag, "last_modified": last_modified}
+    try:
+        # body 先落盘、元数据后落盘：元数据存在即保证 body 完整
+        _atomic_write_bytes(body_path, body)
+        _atomic_write_bytes(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+    except OSError as e:
+        print(f"  [WARN] 缓存写入失败: {url} ({e})", file=sys.stderr)
+
+
+def _conditional_headers(cached: tuple[dict, bytes] | None) -> dict[str, str]:
+    """由缓存元数据构造条件请求头。"""
+    headers: dict[str, str] = {}
+    if cached is not None:
+        meta, _ = cached
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+# ─── 重试与失败预算 ────────────────────────────────────────────────────
+# 404 / 410 是确定的「上游已删除」，不重试；5xx / 408 / 429 / 超时视为瞬时故障，按
+# 带抖动的指数退避重试；其余失败（403 / 451、解码错误、DNS 解析失败等死链）既非
+# 删除也不会自愈，不重试。整次运行共享一个失败预算：瞬时失败的 URL 数达到上限后
+# 不再重试（CDN 整体故障时不至于逐个 URL 叠加超时）。调用方据 FETCH_BUDGET 区分
+# 三类失败：确定 404 才标记上游删除，瞬时与其余失败都保留现有文件。
+
+def _is_not_found(e: BaseException) -> bool:
+    return isinstance(e, urllib.error.HTTPError) and e.code in (404, 410)
+
+
+def _is_transient(e: BaseException) -> bool:
+    """是否值得重试：5xx / 408 / 429、超时（urllib 把连接阶段的超时包在 URLError 里）。"""
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code >= 500 or e.code in (408, 429)
+    if isinstance(e, urllib.error.URLError):
+        e = e.reason
+    return isinstance(e, (TimeoutError, asyncio.TimeoutError))
+
+
+class FetchBudget:
+    """一次运行的下载重试策略与失败记录。
+
+    retries 次重试，第 n 次前等待 [0, min(max_backoff, backoff·2^n)] 内随机时长
+    （full jitter）；瞬时失败的 URL 数达到 max_failures 后 exhausted，此后不再重试。
+    按调用方传入的原始 url 记录最终失败：not_found（404 / 410）、failed（瞬时）、
+    errors（其余，重试也无用）。
+    """
+
+    def __init__(self, *, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0,
+                 max_failures: int = 5) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.not_found: set[str] = set()
+        self.failed: dict[str, str] = {}  # url -> 错误描述（瞬时失败）
+        self.errors: dict[str, str] = {}  # url -> 错误描述（其余非 404 失败）
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return len(self.failed) >= self.max_failures
+
+    def should_retry(self, e: BaseException, attempt: int) -> bool:
+        return _is_transient(e) and attempt < self.retries and not self.exhausted
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def record(self, url: str, e: BaseException) -> None:
+        with self._lock:
+            if _is_not_found(e):
+                self.not_found.add(url)
+            elif _is_transient(e):
+                self.failed[url] = str(e) or type(e).__name__
+            else:
+                self.errors[url] = str(e) or type(e).__name__
+
+
+# 三个同步脚本各自一次运行 = 一个进程，共用模块级预算
+FETCH_BUDGET = FetchBudget()
+
+
+def _fetch_once(target: str, ua: str, timeout: float) -> tuple[str, int, bool]:
+    """单次下载 target（已编码），带条件请求缓存；返回 (文本, 网络 body 字节数, 是否 304
+    命中缓存)，失败抛异常。"""
+    cached = _load_cache(target)
+    headers = {"User-Agent": ua, **_conditional_headers(cached)}
+    req = urllib.request.Request(target, headers=headers)
     try:
-        req = urllib.request.Request(target, headers={"User-Agent": ua})
         with urllib.request.urlopen(req, timeout=timeout) as resp:
-            return resp.read().decode("utf-8")
+            body = resp.read()
+            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            return cached[1].decode("utf-8"), 0, True
+        raise
+    text = body.decode("utf-8")
+    _store_cache(target, body, etag, last_modified)
+    return text, len(body), False
+
+
+def fetch_text(url: str, ua: str, *, encode: bool = False, timeout: float = 30,
+               budget: FetchBudget | None = None) -> str:
+    """下载 url，返回文本；最终失败抛出最后一次异常。encode=True 时先对 path 百分号编码。
+
+    有缓存时发条件请求（If-None-Match / If-Modified-Since），304 直接返回缓存 body。
+    瞬时失败按 budget（默认 FETCH_BUDGET）重试；最终失败记入 budget。
+    """
+    budget = budget or FETCH_BUDGET
+    target = encode_url(url) if encode else url
+    attempt = 0
+    t0 = time.perf_counter()
+    while True:
+        try:
+            text, nbytes, cached = _fetch_once(target, ua, timeout)
+            RUN_STATS.downloaded(url, nbytes=nbytes, seconds=time.perf_counter() - t0,
+                                 cached=cached, attempts=attempt + 1, ok=True)
+            return text
+        except Exception as e:
+            if not budget.should_retry(e, attempt):
+                budget.record(url, e)
+                RUN_STATS.downloaded(url, nbytes=0, seconds=time.perf_counter() - t0,
+                                     cached=False, attempts=attempt + 1, ok=False)
+                raise
+        time.sleep(budget.delay(attempt))
+        attempt += 1
+
+
+def fetch_url(url: str, ua: str, *, encode: bool = False, timeout: float = 30,
+              budget: FetchBudget | None = None) -> str | None:
+    """下载 url，返回文本；失败返回 None（失败类型见 budget.not_found / failed / errors）。"""
+    try:
+        return fetch_text(url, ua, encode=encode, timeout=timeout, budget=budget)
     except Exception as e:
         print(f"  [ERR] 下载失败: {url} ({e})", file=sys.stderr)
         return None
 
 
-def prefetch_urls(
-    urls: list[str], ua: str, *, encode: bool = False, max_workers: int = 8
+# ─── asyncio HTTP/1.1 keep-alive 下载器（prefetch_urls 默认实现）────────────
+# 上游几乎全在 raw.githubusercontent.com：线程池里每个 urlopen 都新建连接、重做
+# TLS 握手；这里按 (scheme, host, port) 维护连接池，同 host 请求复用连接。
+# 只实现拉取规则所需的子集：GET、Content-Length / chunked / 读到 EOF 三种 body、
+# 3xx 重定向、identity 编码（不发 Accept-Encoding）。
+
+_REDIRECT_CODES = frozenset({301, 302, 303, 307, 308})
+_MAX_REDIRECTS = 5
+
+
+class _Conn:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class _HostPool:
+    """单个 (scheme, host, port) 的 keep-alive 连接池，并发连接数受 per_host 限制。"""
+
+    __slots__ = ("host", "port", "tls", "idle", "sem")
+
+    def __init__(self, host: str, port: int, tls: bool, per_host: int) -> None:
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.idle: list[_Conn] = []
+        self.sem = asyncio.Semaphore(per_host)
+
+    async def acquire(self, ssl_ctx: ssl.SSLContext, fresh: bool,
+                      timeout: float) -> tuple[_Conn, bool]:
+        """取一条连接，返回 (连接, 是否复用)。fresh=True 时跳过空闲连接；
+        新建连接（含 TLS 握手）超过 timeout 秒视为超时。"""
+        while self.idle and not fresh:
+            conn = self.idle.pop()
+            if conn.usable():
+                return conn, True
+            conn.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            self.host, self.port,
+            ssl=ssl_ctx if self.tls else None,
+            server_hostname=self.host if self.tls else None,
+        ), timeout)
+        return _Conn(reader, writer), False
+
+    def close_all(self) -> None:
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+class _TimedReader:
+    """给 StreamReader 的每次读取加超时（与 urllib 的 socket 超时同义：单次读取
+    timeout 秒无数据才算超时，慢而持续的大文件不受总时长限制）。"""
+
+    __slots__ = ("reader", "timeout")
+
+    def __init__(self, reader: asyncio.StreamReader, timeout: float) -> None:
+        self.reader = reader
+        self.timeout = timeout
+
+    async def readline(self) -> bytes:
+        return await asyncio.wait_for(self.reader.readline(), self.timeout)
+
+    async def readexactly(self, n: int) -> bytes:
+        parts: list[bytes] = []
+        remaining = n
+        while remaining > 0:
+            part = await asyncio.wait_for(self.reader.read(min(remaining, _CHUNK_SIZE)), self.timeout)
+            if not part:
+                raise asyncio.IncompleteReadError(b"".join(parts), n)
+            parts.append(part)
+            remaining -= len(part)
+        return b"".join(parts)
+
+    async def read(self) -> bytes:
+        """读到 EOF。"""
+        parts: list[bytes] = []
+        while part := await asyncio.wait_for(self.reader.read(_CHUNK_SIZE), self.timeout):
+            parts.append(part)
+        return b"".join(parts)
+
+
+async def _read_response(reader: _TimedReader) -> tuple[int, str, dict[str, str], bytes, bool]:
+    """读一个 HTTP/1.x 响应，返回 (状态码, reason, 小写键 headers, body, 连接可复用)。"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("连接已被对端关闭")
+    version, _, rest = status_line.decode("latin-1").strip().partition(" ")
+    code, _, reason = rest.partition(" ")
+    status = int(code)
+    headers: dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if status in (204, 304) or 100 <= status < 200:
+        body = b""
+    elif "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks: list[bytes] = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass  # trailers
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)  # 块尾 CRLF
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return status, reason, headers, body, keep_alive
+
+
+class _AsyncFetcher:
+    """一次 prefetch 的共享状态：各 host 连接池、全局并发上限、TLS 上下文。"""
+
+    def __init__(self, ua: str, *, concurrency: int, per_host: int, timeout: float,
+                 budget: FetchBudget) -> None:
+        self.ua = ua
+        self.per_host = per_host
+        self.timeout = timeout
+        self.budget = budget
+        self.sem = asyncio.Semaphore(concurrency)
+        self.pools: dict[tuple[str, str, int], _HostPool] = {}
+        self.ssl_ctx = ssl.create_default_context()
+
+    async def _request(self, url: str, extra_headers: dict[str, str]):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"不支持的 URL: {url}")
+        tls = parsed.scheme == "https"
+        port = parsed.port or (443 if tls else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = _HostPool(parsed.hostname, port, tls, self.per_host)
+
+        host = parsed.hostname if parsed.port is None else f"{parsed.hostname}:{parsed.port}"
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        lines = [f"GET {path} HTTP/1.1", f"Host: {host}", f"User-Agent: {self.ua}",
+                 "Accept-Encoding: identity", "Connection: keep-alive"]
+        lines += [f"{k}: {v}" for k, v in extra_headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("ascii")
+
+        # 超时只计连接与每次读写，排队等 host 名额的时间不算
+        async with pool.sem:
+            # 复用的空闲连接可能已被服务端关闭：首次失败且为复用连接时换新连接重发一次
+            for fresh in (False, True):
+                conn, reused = await pool.acquire(self.ssl_ctx, fresh, self.timeout)
+                try:
+                    conn.writer.write(request)
+                    await asyncio.wait_for(conn.writer.drain(), self.timeout)
+                    status, reason, headers, body, keep_alive = await _read_response(
+                        _TimedReader(conn.reader, self.timeout))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    conn.close()  # 含超时取消：半读的连接不可再用
+                    raise
+                if keep_alive:
+                    pool.idle.append(conn)
+                else:
+                    conn.close()
+                return status, reason, headers, body
+        raise ConnectionResetError("连接已被对端关闭")
+
+    async def _get_text(self, target: str) -> tuple[str, int, bool]:
+        cached = _load_cache(target)
+        conditional = _conditional_headers(cached)
+        url = target
+        for _ in range(_MAX_REDIRECTS + 1):
+            status, reason, headers, body = await self._request(url, conditional)
+            if status in _REDIRECT_CODES and "location" in headers:
+                url = urllib.parse.urljoin(url, headers["location"])
+                continue
+            break
+        if status == 304 and cached is not None:
+            return cached[1].decode("utf-8"), 0, True
+        if not 200 <= status < 300:
+            raise urllib.error.HTTPError(target, status, reason, None, None)
+        text = body.decode("utf-8")
+        _store_cache(target, body, headers.get("etag"), headers.get("last-modified"))
+        return text, len(body), False
+
+    async def fetch(self, url: str, encode: bool) -> str | None:
+        """下载单个 url：瞬时失败按 budget 退避重试（退避期间不占并发名额），
+        最终失败记入 budget 并返回 None。"""
+        target = encode_url(url) if encode else url
+        attempt = 0
+        t0 = time.perf_counter()
+        while True:
+            try:
+                async with self.sem:
+                    text, nbytes, cached = await self._get_text(target)
+                RUN_STATS.downloaded(url, nbytes=nbytes, seconds=time.perf_counter() - t0,
+                                     cached=cached, attempts=attempt + 1, ok=True)
+                return text
+            except Exception as e:
+                if not self.budget.should_retry(e, attempt):
+                    self.budget.record(url, e)
+                    RUN_STATS.downloaded(url, nbytes=0, seconds=time.perf_counter() - t0,
+                                         cached=False, attempts=attempt + 1, ok=False)
+                    print(f"  [ERR] 下载失败: {url} ({str(e) or type(e).__name__})",
+                          file=sys.stderr)
+                    return None
+            await asyncio.sleep(self.budget.delay(attempt))
+            attempt += 1
+
+    async def fetch_all(self, urls: list[str], encode: bool) -> dict[str, str | None]:
+        try:
+            texts = await asyncio.gather(*(self.fetch(u, encode) for u in urls))
+        finally:
+            for pool in self.pools.values():
+                pool.close_all()
+        return dict(zip(urls, texts))
+
+
+def _prefetch_threaded(
+    urls: list[str], ua: str, *, encode: bool, max_workers: int,
+    timeout: float = 30, budget: FetchBudget | None = None,
 ) -> dict[str, str | None]:
-    """并发下载 urls，返回 {原始 url: text_or_None}（按原始 url 键，顺序无关）。"""
+    """线程池 + urllib 版 prefetch（配置了 HTTP(S) 代理时使用，urllib 会走代理）。"""
     results: dict[str, str | None] = {}
-    if not urls:
-        return results
     with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
         future_to_url = {
-            pool.submit(fetch_url, u, ua, encode=encode): u for u in urls
+            pool.submit(fetch_url, u, ua, encode=encode, timeout=timeout, budget=budget): u
+            for u in urls
         }
         for future in as_completed(future_to_url):
             results[future_to_url[future]] = future.result()
     return results
+
+
+def prefetch_urls(
+    urls: list[str], ua: str, *, encode: bool = False, max_workers: int = 8,
+    per_host: int = 6, timeout: float = 30, budget: FetchBudget | None = None,
+) -> dict[str, str | None]:
+    """并发下载 urls，返回 {原始 url: text_or_None}（按原始 url 键，顺序无关）。
+
+    默认走 asyncio keep-alive 下载器：全局最多 max_workers 个请求并发、每个 host
+    最多 per_host 条连接并复用；建连与每次读写各自超时 timeout 秒（与 urllib 同义，
+    排队等待名额不计时），重试与失败记录按 budget（默认 FETCH_BUDGET）。环境里配置了
+    HTTP(S) 代理时回退到线程池 + urllib。
+    """
+    if not urls:
+        return {}
+    urls = list(dict.fromkeys(urls))
+    budget = budget or FETCH_BUDGET
+    proxies = urllib.request.getproxies()
+    if "http" in proxies or "https" in proxies:
+        return _prefetch_threaded(urls, ua, encode=encode, max_workers=max_workers,
+                                  timeout=timeout, budget=budget)
+    fetcher = _AsyncFetcher(ua, concurrency=max_workers, per_host=per_host,
+                            timeout=timeout, budget=budget)
+    return asyncio.run(fetcher.fetch_all(urls, encode))
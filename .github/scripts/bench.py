@@ -0,0 +1,731 @@
+#!/usr/bin/env python3
+"""
+同步脚本性能基准（仅标准库，不联网）
+
+子命令：
+  fetch     prefetch_urls：asyncio keep-alive 下载器 vs 线程池 + urllib，
+            对本地 HTTP 替身服务器计时（每条新连接注入 --handshake-ms 延迟，模拟 TLS 握手）
+  pipeline  sync-rules 转换流水线各阶段（normalize_surge_rules / convert_qx / convert_clash /
+            convert_classical_payload_to_singbox / _build_removals）在 1k–1M 行合成规则上的
+            吞吐、峰值 RSS 增量与分配峰值；--save 存 JSON 基线，--baseline 对比回归
+  classify  逐行分类：预编译正则 + startswith 快速路径（section_header / top_section_name /
+            parse_and_rule / _tokenize_surge）vs 逐行 re.match 字符串正则的旧写法
+  srs       sing-box/source/*.json → .srs 编码耗时，并把解压后的载荷与 sing-box CLI
+            产物逐字节比对（默认比对仓库里已有的 .srs；--sing-box 指定 CLI 则现编现比）
+  modules   sync-modules 在 --modules 个合成去广告模块上的各阶段耗时：域名别名替换与
+            {{{key}}} 占位符改名（逐行现编正则 + 逐键 str.replace 的旧写法 vs 每模块
+            预编译、整段一趟改写）与完整 aggregate()（无缓存 / 拼音与模块解析缓存全命中 /
+            仅 1 个模块变动，需 pypinyin）
+  mrs       Clash/RuleSet 下已有 .mrs 的同名 payload → .mrs 编码耗时，解压后与现有 .mrs
+            （或 --mihomo 指定内核 convert-ruleset 现编产物）逐字节比对
+
+用法：
+  python .github/scripts/bench.py fetch [--urls 120] [--handshake-ms 40] [--latency-ms 10]
+  python .github/scripts/bench.py pipeline [--sizes 1000,10000,100000,1000000]
+                                           [--save base.json] [--baseline base.json]
+  python .github/scripts/bench.py classify [--lines 147000] [--repeat 5]
+  python .github/scripts/bench.py srs [--sing-box /path/to/sing-box]
+  python .github/scripts/bench.py mrs [--mihomo /path/to/mihomo]
+  python .github/scripts/bench.py modules [--modules 50] [--repeat 5]
+"""
+
+import argparse
+import contextlib
+import http.server
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+
+# 基准不应读写真实下载缓存
+os.environ["SYNC_FETCH_CACHE"] = ""
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import _common  # noqa: E402
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+
+def _load_script(stem: str):
+    """按文件名加载带连字符的同步脚本（如 sync-rules.py），不执行其 main()。"""
+    name = stem.replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS_DIR / f"{stem}.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  本地 HTTP 替身
+# ═══════════════════════════════════════════════════════════════════════
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive 替身：新连接先睡 handshake 秒，每个请求再睡 latency 秒，
+    返回 size 行规则文本。"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        time.sleep(self.server.handshake)
+        with self.server.lock:
+            self.server.connections += 1
+        super().setup()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        stem = self.path.rsplit("/", 1)[-1]
+        body = "".join(f"DOMAIN-SUFFIX,{stem}-{i}.example.com\n"
+                       for i in range(self.server.size)).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve(handshake: float, latency: float, size: int) -> http.server.ThreadingHTTPServer:
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    srv.daemon_threads = True
+    srv.handshake, srv.latency, srv.size = handshake, latency, size
+    srv.lock, srv.connections = threading.Lock(), 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  fetch
+# ═══════════════════════════════════════════════════════════════════════
+
+def bench_fetch(args: argparse.Namespace) -> None:
+    srv = _serve(args.handshake_ms / 1000, args.latency_ms / 1000, args.lines)
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    urls = [f"{base}/list/{i}.list" for i in range(args.urls)]
+    runners = {
+        "threaded": lambda: _common._prefetch_threaded(urls, "bench", encode=False,
+                                                       max_workers=args.workers),
+        "async":    lambda: _common.prefetch_urls(urls, "bench", max_workers=args.workers,
+                                                  per_host=args.per_host),
+    }
+    print(f"fetch: {args.urls} URL × {args.lines} 行，握手 {args.handshake_ms}ms，"
+          f"延迟 {args.latency_ms}ms，并发 {args.workers}（async 每 host {args.per_host}）")
+    for name, run in runners.items():
+        times = []
+        for _ in range(args.repeat):
+            srv.connections = 0
+            t0 = time.perf_counter()
+            result = run()
+            times.append(time.perf_counter() - t0)
+            assert all(result.values()), f"{name}: 有 URL 下载失败"
+        print(f"  {name:<9} median {statistics.median(times):7.3f}s  "
+              f"min {min(times):7.3f}s  连接数 {srv.connections}")
+    srv.shutdown()
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  pipeline
+# ═══════════════════════════════════════════════════════════════════════
+
+# 合成规则的类型配比（权重），大致贴近仓库现有 RULE-SET 的构成
+_RULE_MIX = [
+    ("DOMAIN-SUFFIX", 45), ("DOMAIN", 22), ("DOMAIN-KEYWORD", 5),
+    ("IP-CIDR", 8), ("IP-CIDR6", 2), ("USER-AGENT", 2), ("PROCESS-NAME", 1),
+    ("URL-REGEX", 1), ("IP-ASN", 1), ("AND", 3),
+    ("#", 4), ("//", 2), ("", 2), ("inline", 2),
+]
+_TLDS = ["com", "net", "org", "io", "cn", "jp", "tv", "co.uk"]
+
+
+def synth_surge_lines(n: int, seed: int = 0) -> list[str]:
+    """生成 n 行 Surge RULE-SET：按 _RULE_MIX 混合各规则类型、AND 规则、
+    # / // 注释、空行与行内注释，每约 500 行一个 '# > Section'。"""
+    rng = random.Random(seed)
+    kinds = [k for k, _ in _RULE_MIX]
+    weights = [w for _, w in _RULE_MIX]
+    out: list[str] = []
+    for i in range(n):
+        if i % 500 == 0:
+            out.append(f"# > Section {i // 500}")
+            continue
+        kind = rng.choices(kinds, weights)[0]
+        host = f"h{rng.randrange(1 << 24):x}.example{rng.randrange(1000)}.{rng.choice(_TLDS)}"
+        if kind in ("DOMAIN-SUFFIX", "DOMAIN", "inline"):
+            t = "DOMAIN" if kind == "DOMAIN" else "DOMAIN-SUFFIX"
+            out.append(f"{t},{host}" + (" // synthetic" if kind == "inline" else ""))
+        elif kind == "DOMAIN-KEYWORD":
+            out.append(f"DOMAIN-KEYWORD,kw{rng.randrange(1 << 20):x}")
+        elif kind == "IP-CIDR":
+            ip = ".".join(str(rng.randrange(256)) for _ in range(4))
+            out.append(f"IP-CIDR,{ip}/32,no-resolve")
+        elif kind == "IP-CIDR6":
+            out.append(f"IP-CIDR6,2001:db8:{rng.randrange(1 << 16):x}::/48,no-resolve")
+        elif kind == "USER-AGENT":
+            out.append(f"USER-AGENT,App{rng.randrange(1000)}*")
+        elif kind == "PROCESS-NAME":
+            out.append(f"PROCESS-NAME,proc{rng.randrange(1000)}")
+        elif kind == "URL-REGEX":
+            out.append(f"URL-REGEX,^https?://{host}/ads")
+        elif kind == "IP-ASN":
+            out.append(f"IP-ASN,{rng.randrange(1, 65535)},no-resolve")
+        elif kind == "AND":
+            out.append(f"AND,((DOMAIN-SUFFIX,{host}),(PROCESS-NAME,proc{rng.randrange(100)}))")
+        elif kind == "#":
+            out.append(f"# note {i}")
+        elif kind == "//":
+            out.append(f"// upstream note {i}")
+        else:
+            out.append("")
+    return out
+
+
+def _synth_removal_entries(n: int, seed: int = 0) -> list:
+    """生成总计约 n 个 #!remove 域名的 sync-rules.txt 条目（每条 10 个）。"""
+    sr = _load_script("sync-rules")
+    rng = random.Random(seed)
+    entries = []
+    for i in range(max(1, n // 10)):
+        domains = ",".join(f".d{rng.randrange(1 << 24):x}.example.com" for _ in range(10))
+        entries.append(sr.SyncRuleEntry(f"https://example.com/{i}.list", f"Name{i % 50}",
+                                        {"remove": domains}, False))
+    return entries
+
+
+def _pipeline_inputs(n: int) -> dict:
+    sr = _load_script("sync-rules")
+    lines = synth_surge_lines(n)
+    return {
+        "lines": lines,
+        "text": "\n".join(lines) + "\n",
+        "clash": sr.convert_clash(lines),
+        "entries": _synth_removal_entries(n),
+    }
+
+
+def _pipeline_stages() -> dict:
+    sr = _load_script("sync-rules")
+    return {
+        "normalize_surge_rules": lambda d: sr.normalize_surge_rules(d["text"]),
+        "convert_qx": lambda d: sr.convert_qx(d["lines"], "Bench"),
+        "convert_clash": lambda d: sr.convert_clash(d["lines"]),
+        "convert_classical_payload_to_singbox":
+            lambda d: sr.convert_classical_payload_to_singbox(d["clash"], "bench.json"),
+        "_build_removals": lambda d: sr._build_removals(d["entries"]),
+    }
+
+
+def _current_rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * (os.sysconf("SC_PAGE_SIZE") // 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+_INPUTS: dict = {}  # fork 前由父进程填好，子进程直接继承（不计入阶段耗时 / RSS）
+
+
+def _measure_stage(stage: str, repeat: int, alloc: bool, conn) -> None:
+    """fork 出的子进程：计时 repeat 次，峰值 RSS 取 ru_maxrss 减阶段前 RSS，
+    再在 tracemalloc 下单跑一次记录分配峰值。"""
+    fn = _pipeline_stages()[stage]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        rss0 = _current_rss_kb()
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn(_INPUTS)
+            times.append(time.perf_counter() - t0)
+        rss_delta = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0)
+        alloc_peak = None
+        if alloc:
+            tracemalloc.start()
+            fn(_INPUTS)
+            alloc_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    conn.send({"seconds": statistics.median(times), "min_seconds": min(times),
+               "rss_delta_kb": rss_delta, "alloc_peak_bytes": alloc_peak})
+    conn.close()
+
+
+def bench_pipeline(args: argparse.Namespace) -> None:
+    ctx = multiprocessing.get_context("fork")
+    stages = list(_pipeline_stages())
+    if args.stages:
+        stages = [s for s in stages if s in args.stages.split(",")]
+    sizes = [int(x) for x in args.sizes.split(",")]
+    baseline = {}
+    if args.baseline:
+        doc = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        baseline = {(r["stage"], r["lines"]): r for r in doc["results"]}
+
+    results = []
+    print(f"{'stage':<38}{'lines':>9}{'median s':>10}{'lines/s':>12}"
+          f"{'RSS Δ MB':>10}{'alloc MB':>10}" + ("   vs base" if baseline else ""))
+    for n in sizes:
+        _INPUTS.clear()
+        _INPUTS.update(_pipeline_inputs(n))
+        for stage in stages:
+            recv, send = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_measure_stage, args=(stage, args.repeat, args.alloc, send))
+            proc.start()
+            r = recv.recv()
+            proc.join()
+            r.update(stage=stage, lines=n, lines_per_s=n / r["seconds"] if r["seconds"] else None)
+            results.append(r)
+            alloc = (f"{r['alloc_peak_bytes'] / 2**20:10.1f}"
+                     if r["alloc_peak_bytes"] is not None else f"{'-':>10}")
+            line = (f"{stage:<38}{n:>9}{r['seconds']:>10.4f}{r['lines_per_s']:>12,.0f}"
+                    f"{r['rss_delta_kb'] / 1024:>10.1f}{alloc}")
+            base = baseline.get((stage, n))
+            if base:
+                ratio = r["seconds"] / base["seconds"]
+                flag = "  REGRESSION" if ratio > 1 + args.tolerance else ""
+                line += f"   ×{ratio:.2f}{flag}"
+            print(line)
+
+    if args.save:
+        doc = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        Path(args.save).write_text(json.dumps(doc, indent=1) + "\n", encoding="utf-8")
+        print(f"基线已保存: {args.save}")
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  classify
+# ═══════════════════════════════════════════════════════════════════════
+# 旧写法：每行以字符串正则调用 re.match（走 re 模块缓存查找），规则行也要过正则。
+
+def _legacy_parse_sections(text: str) -> dict:
+    sections: dict = {}
+    current = None
+    buf: list[str] = []
+    for line in text.splitlines():
+        m = re.match(r"^#\s*>\s*(.+)$", line.strip())
+        if m:
+            if current is not None:
+                while buf and not buf[-1].strip():
+                    buf.pop()
+                sections[current] = buf
+            current = m.group(1).strip()
+            buf = [line]
+        elif current is not None:
+            buf.append(line)
+    if current is not None:
+        while buf and not buf[-1].strip():
+            buf.pop()
+        sections[current] = buf
+    return sections
+
+
+def _legacy_normalize(text: str) -> str | None:
+    out = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("//"):
+            out.append(f"# {stripped[2:].strip()}")
+            continue
+        if stripped.startswith("#"):
+            if re.match(r"^#\s*>(?!>)\s*\S", stripped):
+                out.append(stripped)
+            continue
+        out.append(stripped)
+    return ("\n".join(out) + "\n") if out else None
+
+
+def _legacy_section_names(text: str) -> list[str]:
+    """fetch_external_rules 合并时收集节名的旧循环。"""
+    names = []
+    for line in text.splitlines():
+        if re.match(r"^#\s*>(?!>)\s*\S", line):
+            names.append(re.sub(r"^#\s*>\s*", "", line).strip())
+    return names
+
+
+def _legacy_and_rules(lines: list[str]) -> int:
+    n = 0
+    for raw in lines:
+        m = re.match(r"AND,\(\((.+)\)\)$", raw.strip())
+        if m and re.split(r"\),\s*\(", m.group(1)):
+            n += 1
+    return n
+
+
+def _legacy_placeholders(lines: list[str]) -> int:
+    """_tokenize_surge 旧顺序：每条规则行都先过占位符正则。"""
+    pattern = r"^###\s+Streaming(?:\s+([A-Z]+))?\s*$"
+    return sum(1 for l in lines if re.match(pattern, l.strip()))
+
+
+def _classify_cases(sr) -> list[tuple[str, Callable, Callable]]:
+    def names(text: str) -> list[str]:
+        return [n for l in text.splitlines() if (n := sr.top_section_name(l)) is not None]
+
+    return [
+        ("parse_sections", lambda d: _legacy_parse_sections(d["text"]),
+         lambda d: sr.parse_sections(d["text"])),
+        ("normalize_surge_rules", lambda d: _legacy_normalize(d["text"]),
+         lambda d: sr.normalize_surge_rules(d["text"])),
+        ("fetch section names", lambda d: _legacy_section_names(d["normalized"]),
+         lambda d: names(d["normalized"])),
+        ("parse_and_rule", lambda d: _legacy_and_rules(d["lines"]),
+         lambda d: sum(1 for l in d["lines"] if sr.parse_and_rule(l))),
+        ("is_streaming_placeholder", lambda d: _legacy_placeholders(d["lines"]),
+         lambda d: sum(1 for l in d["lines"] if sr.is_streaming_placeholder(l.strip()))),
+    ]
+
+
+def bench_classify(args: argparse.Namespace) -> None:
+    sr = _load_script("sync-rules")
+    lines = synth_surge_lines(args.lines)
+    text = "\n".join(lines) + "\n"
+    data = {"lines": lines, "text": text, "normalized": sr.normalize_surge_rules(text)}
+
+    print(f"{args.lines} 行合成规则，各取 {args.repeat} 次中位数")
+    print(f"{'case':<26}{'re.match s':>12}{'fast path s':>13}{'speedup':>9}")
+    for name, legacy, fast in _classify_cases(sr):
+        assert legacy(data) == fast(data), f"{name}: 新旧实现结果不一致"
+        times = {}
+        for label, fn in (("legacy", legacy), ("fast", fast)):
+            samples = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                fn(data)
+                samples.append(time.perf_counter() - t0)
+            times[label] = statistics.median(samples)
+        print(f"{name:<26}{times['legacy']:>12.4f}{times['fast']:>13.4f}"
+              f"{times['legacy'] / times['fast']:>8.1f}×")
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  srs
+# ═══════════════════════════════════════════════════════════════════════
+
+def _cli_srs(cli: str, source: Path, out_dir: Path) -> bytes:
+    out = out_dir / f"{source.stem}.srs"
+    subprocess.run([cli, "rule-set", "compile", "--output", str(out), str(source)],
+                   check=True, capture_output=True)
+    return out.read_bytes()
+
+
+def bench_srs(args: argparse.Namespace) -> None:
+    sr = _load_script("sync-rules")
+    sources = sorted(sr.SINGBOX_DIR.glob("*.json"))
+    identical = missing = 0
+    mismatched: list[str] = []
+    encode_s = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for src in sources:
+            rules = json.loads(src.read_text(encoding="utf-8"))["rules"]
+            t0 = time.perf_counter()
+            payload = sr.encode_srs_payload(rules)
+            encode_s += time.perf_counter() - t0
+            if args.sing_box:
+                ref = _cli_srs(args.sing_box, src, Path(tmp))
+            else:
+                path = sr.SINGBOX_SRS_DIR / f"{src.stem}.srs"
+                if not path.exists():
+                    missing += 1
+                    continue
+                ref = path.read_bytes()
+            if ref[:4] == b"SRS\x02" and zlib.decompress(ref[4:]) == payload:
+                identical += 1
+            else:
+                mismatched.append(src.stem)
+
+    ref_label = args.sing_box or f"{sr.SINGBOX_SRS_DIR.relative_to(sr.REPO_ROOT)}/*.srs"
+    print(f"{len(sources)} 个 source JSON，编码共 {encode_s:.3f}s")
+    print(f"与 {ref_label} 载荷逐字节一致: {identical}，不一致: {len(mismatched)}"
+          + (f"，无对照产物: {missing}" if missing else ""))
+    for stem in mismatched:
+        print(f"  ✗ {stem}")
+    if mismatched:
+        sys.exit(1)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  mrs
+# ═══════════════════════════════════════════════════════════════════════
+
+def _zstd_decompress(sr, data: bytes) -> bytes:
+    """优先用 sync-rules 选定的 zstd 模块；无模块时借 zstd CLI。"""
+    codec = sr._zstd()
+    if codec:
+        return codec[1](data)
+    cli = shutil.which("zstd")
+    if cli is None:
+        sys.exit("无 zstd 模块（pip install zstandard）也无 zstd CLI，无法比对 .mrs")
+    return subprocess.run([cli, "-dcq"], input=data, capture_output=True, check=True).stdout
+
+
+def bench_mrs(args: argparse.Namespace) -> None:
+    sr = _load_script("sync-rules")
+    identical = 0
+    mismatched: list[str] = []
+    encode_s = 0.0
+    samples = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in sorted(sr.CLASH_DIR.glob("*.mrs")):
+            src = next((p for p in (path.with_suffix(".yaml"), path.with_suffix(".txt"))
+                        if p.exists()), None)
+            if src is None:
+                continue
+            ref = _zstd_decompress(sr, path.read_bytes())
+            behavior = "ipcidr" if ref[4] == sr.MRS_BEHAVIORS["ipcidr"] else "domain"
+            rules = list(sr._iter_clash_payload_rules(src.read_text(encoding="utf-8")))
+            samples += 1
+            t0 = time.perf_counter()
+            payload = sr.encode_mrs_payload(behavior, rules)
+            encode_s += time.perf_counter() - t0
+            if args.mihomo:
+                out = Path(tmp) / path.name
+                subprocess.run([args.mihomo, "convert-ruleset", behavior, "yaml", str(src), str(out)],
+                               check=True, capture_output=True)
+                ref = _zstd_decompress(sr, out.read_bytes())
+            if payload == ref:
+                identical += 1
+            else:
+                mismatched.append(f"{path.stem} ({behavior})")
+
+    ref_label = args.mihomo or f"{sr.CLASH_DIR.relative_to(sr.REPO_ROOT)}/*.mrs"
+    print(f"{samples} 个 payload，编码共 {encode_s:.3f}s")
+    print(f"与 {ref_label} 载荷逐字节一致: {identical}，不一致: {len(mismatched)}")
+    for stem in mismatched:
+        print(f"  ✗ {stem}")
+    if mismatched:
+        sys.exit(1)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  modules
+# ═══════════════════════════════════════════════════════════════════════
+
+_MODULE_SECTIONS = {"Rule": 12, "Map Local": 14, "URL Rewrite": 10, "Body Rewrite": 6, "Script": 8}
+
+
+def synth_sgmodules(n: int, seed: int = 0) -> list[tuple[str, str, str]]:
+    """生成 n 个合成去广告 sgmodule → [(url, alias, 模块文本)]。各模块的 MITM hostname、
+    规则、Map Local / Rewrite 正则与脚本里混有自身 alias 关键字（域名标签、候选组、
+    转义点号、脚本路径），每 4 个模块带 #!arguments 与 {{{key}}} 占位符。"""
+    rng = random.Random(seed)
+    modules = []
+    for i in range(n):
+        alias = f"app{i}kw"
+        name = f"App{i}去广告" if i % 3 else f"应用{i}去广告"
+        keys = [f"opt{k}" for k in range(3)] if i % 4 == 0 else []
+        hosts = [f"api{k}.{alias}.com" for k in range(6)] + [f"*.{alias}cdn.net", f"ad.{alias}.cn"]
+        out = [f"#!name={name}", f"#!desc=合成模块 {i}", "#!date=2026-01-01 00:00:00"]
+        if keys:
+            out.append("#!arguments=" + ",".join(f"{k}:true" for k in keys))
+            out.append("#!arguments-desc=" + "\\n".join(f"{k}: 开关 {k}" for k in keys))
+        out += ["", "[MITM]", f"hostname = %APPEND% {', '.join(hosts)}"]
+        for sec, count in _MODULE_SECTIONS.items():
+            out += ["", f"[{sec}]"]
+            for k in range(count):
+                host = f"{rng.choice(('api', 'ad', 'cdn'))}{k}.{alias}.com"
+                host_re = host.replace(".", "\\.")
+                if sec == "Rule":
+                    out.append(f"DOMAIN,{host},REJECT")
+                elif sec == "Map Local":
+                    out.append(f"^https:\\/\\/{host_re}\\/v{k}\\/ad "
+                               'data-type=text data="{}" status-code=200')
+                elif sec == "URL Rewrite":
+                    out.append(f"^https?:\\/\\/(api|m)\\.({alias}|other{i})\\.com\\/splash{k} - reject")
+                elif sec == "Body Rewrite":
+                    out.append(f"http-response ^https:\\/\\/{host}\\/feed "
+                               f'\'"ad":\\d+\' \'"ad":0\'')
+                else:
+                    arg = f", argument={{{{{{{keys[k % 3]}}}}}}}" if keys else ""
+                    out.append(f"{alias}_{k} = type=http-response, pattern=^https:\\/\\/{host}\\/"
+                               f", script-path=https://example.com/{alias}/{alias}_{k}.js{arg}")
+        modules.append((f"https://example.com/{i}.sgmodule", alias, "\n".join(out) + "\n"))
+    return modules
+
+
+def _legacy_sub_alias(text: str, keyword: str, display: str) -> str:
+    """旧写法：每次调用都拼模式串并 re.compile（走 re 模块缓存查找）。"""
+    esc = re.escape(keyword)
+    repl = "{{{" + display + "}}}"
+    return re.compile(rf"(?<=\.){esc}|{esc}(?=\\?\.|[|)])").sub(lambda _m: repl, text)
+
+
+def _legacy_apply_key_renames(text: str, renames: dict[str, str]) -> str:
+    """旧写法：每个改名键一次 str.replace。"""
+    for old_key, new_key in renames.items():
+        text = text.replace("{{{" + old_key + "}}}", "{{{" + new_key + "}}}")
+    return text
+
+
+def _module_alias_cases(sm, modules: list[tuple[str, str, str]]) -> list[tuple[str, Callable, Callable]]:
+    blocks = []  # (alias, display, renames, 各 section 行列表)
+    for _, alias, text in modules:
+        parsed = sm.parse_sgmodule(text)
+        display = parsed["meta"]["name"].replace("去广告", "")
+        keys = [e.split(":")[0] for e in parsed["meta"].get("arguments", "").split(",") if e]
+        renames = {k: f"{display}-{k}" for k in keys}
+        blocks.append((alias, display, renames,
+                       [l for sec, l in parsed["sections"].items() if sec != "MITM"]))
+
+    def legacy(with_renames: bool) -> Callable:
+        def run() -> list:
+            out = []
+            for alias, display, renames, sections in blocks:
+                for lines in sections:
+                    lines = [_legacy_sub_alias(line, alias, display) for line in lines]
+                    if with_renames and renames:
+                        lines = [_legacy_apply_key_renames(line, renames) for line in lines]
+                    out.append(lines)
+            return out
+        return run
+
+    def engine(with_renames: bool) -> Callable:
+        def run() -> list:
+            out = []
+            for alias, display, renames, sections in blocks:
+                rewriter = sm._ModuleRewriter(alias, display, renames if with_renames else None)
+                out += [rewriter.rewrite_lines(lines) for lines in sections]
+            return out
+        return run
+
+    return [("alias substitution", legacy(False), engine(False)),
+            ("alias + key renames", legacy(True), engine(True))]
+
+
+def _run_aggregate(sm, modules: list[tuple[str, str, str]], output: Path) -> None:
+    """以合成模块替换下载、输出指向临时文件，跑一次完整 aggregate()。"""
+    texts = {url: text for url, _, text in modules}
+    sm.load_urls = lambda: [(url, alias) for url, alias, _ in modules]
+    sm.prefetch_urls = lambda urls, ua, encode=False: {u: texts[u] for u in urls}
+    sm.OUTPUT_FILE = output
+    sm.REPO_ROOT = output.parent
+    sm.SORT_KEY_CACHE = output.parent / ".sort-key-cache.json"
+    sm.MODULE_CACHE = output.parent / ".module-cache.json"
+    with contextlib.redirect_stdout(io.StringIO()):
+        sm.aggregate()
+
+
+def bench_modules(args: argparse.Namespace) -> None:
+    sm = _load_script("sync-modules")
+    modules = synth_sgmodules(args.modules)
+
+    def median(fn: Callable) -> float:
+        samples = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - t0)
+        return statistics.median(samples)
+
+    print(f"{args.modules} 个合成模块，各取 {args.repeat} 次中位数")
+    print(f"{'case':<22}{'legacy s':>12}{'engine s':>12}{'speedup':>9}")
+    for name, legacy, engine in _module_alias_cases(sm, modules):
+        assert legacy() == engine(), f"{name}: 新旧实现结果不一致"
+        t_legacy, t_engine = median(legacy), median(engine)
+        print(f"{name:<22}{t_legacy:>12.4f}{t_engine:>12.4f}{t_legacy / t_engine:>8.1f}×")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / "BlockAds.sgmodule"
+        caches = [Path(tmp) / ".sort-key-cache.json", Path(tmp) / ".module-cache.json"]
+
+        def run(mods: list, *, cold: bool) -> None:
+            output.unlink(missing_ok=True)
+            if cold:
+                for c in caches:
+                    c.unlink(missing_ok=True)
+            _run_aggregate(sm, mods, output)
+
+        # 冷：无拼音 / 模块解析缓存，全部重新解析、调用 pypinyin（导入只在首次发生）；
+        # 热：模块全部命中缓存；变动 1 个：仅该模块 body 变化（每轮换一次内容，必然未命中）
+        t_cold = median(lambda: run(modules, cold=True))
+        lines = output.read_text(encoding="utf-8").count("\n")
+        t_warm = median(lambda: run(modules, cold=False))
+        rounds = iter(range(args.repeat + 1))
+        url, alias, text = modules[0]
+        t_one = median(lambda: run([(url, alias, f"{text}# rev {next(rounds)}\n"), *modules[1:]],
+                                   cold=False))
+    print(f"{'aggregate() 冷缓存':<22}{'':>12}{t_cold:>12.4f}  （输出 {lines} 行）")
+    for label, t in (("aggregate() 热缓存", t_warm), ("aggregate() 变动 1 个", t_one)):
+        print(f"{label:<22}{'':>12}{t:>12.4f}{t_cold / t:>8.1f}×")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="同步脚本性能基准")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("fetch", help="prefetch_urls：async keep-alive vs 线程池")
+    p.add_argument("--urls", type=int, default=120)
+    p.add_argument("--lines", type=int, default=2000, help="每个响应的规则行数")
+    p.add_argument("--handshake-ms", type=float, default=40, help="每条新连接的模拟握手耗时")
+    p.add_argument("--latency-ms", type=float, default=10, help="每个请求的模拟服务端耗时")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--per-host", type=int, default=6)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("pipeline", help="sync-rules 转换流水线各阶段吞吐 / 内存")
+    p.add_argument("--sizes", default="1000,10000,100000,1000000", help="逗号分隔的合成行数")
+    p.add_argument("--stages", default="", help="只跑指定阶段（逗号分隔，默认全部）")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--no-alloc", dest="alloc", action="store_false",
+                   help="跳过 tracemalloc 分配统计（大规模时较慢）")
+    p.add_argument("--save", metavar="FILE", help="结果写入 JSON 基线")
+    p.add_argument("--baseline", metavar="FILE", help="与已存基线对比耗时")
+    p.add_argument("--tolerance", type=float, default=0.15,
+                   help="比基线慢超过该比例标记 REGRESSION（默认 0.15）")
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("classify", help="逐行分类：预编译 + startswith vs 逐行 re.match")
+    p.add_argument("--lines", type=int, default=147_000, help="合成规则行数（默认约 Phishing.list 量级）")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_classify)
+
+    p = sub.add_parser("srs", help="原生 .srs 编码耗时 + 与 sing-box CLI 产物逐字节比对")
+    p.add_argument("--sing-box", dest="sing_box", metavar="PATH",
+                   help="sing-box 可执行文件：逐文件 rule-set compile 作为对照（默认比对仓库现有 .srs）")
+    p.set_defaults(func=bench_srs)
+
+    p = sub.add_parser("modules", help="sync-modules 聚合：别名替换旧写法 vs 预编译引擎、aggregate 总耗时")
+    p.add_argument("--modules", type=int, default=50, help="合成模块数")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_modules)
+
+    p = sub.add_parser("mrs", help="原生 .mrs 编码耗时 + 与 mihomo convert-ruleset 产物逐字节比对")
+    p.add_argument("--mihomo", metavar="PATH",
+                   help="mihomo 可执行文件：逐文件 convert-ruleset 作为对照（默认比对仓库现有 .mrs）")
+    p.set_defaults(func=bench_mrs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
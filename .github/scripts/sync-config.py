@@ -14,14 +14,13 @@ sync-config.txt 格式（平台块 + 子分区）：
 import copy
 import json
 import re
-import urllib.request
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from urllib.parse import quote, unquote
 
 import yaml
 
-from _common import write_if_changed as _write_if_changed
+from _common import fetch_text, write_if_changed as _write_if_changed
 
 # ---------------------------------------------------------------------------
 # 路径配置
@@ -29,6 +28,7 @@ from _common import write_if_changed as _write_if_changed
 
 REPO_ROOT = Path(__file__).resolve().parent.parent.parent
 SYNC_CONFIG_TXT = REPO_ROOT / ".github" / "scripts" / "sync-config.txt"
+_UA = "sync-config/1.0"
 
 HOTKIDS_SURGE_PREFIX = "https://raw.githubusercontent.com/HotKids/Rules/master/Surge/RULE-SET/"
 HOTKIDS_CLASH_PREFIX = "https://raw.githubusercontent.com/HotKids/Rules/master/Clash/RuleSet/"
@@ -641,8 +641,7 @@ def _fetch_remote_section(url: str, section: str) -> list[str]:
     """获取远程 URL，提取指定 [section] 段落的内容行（不含段落标题行）。"""
     if url not in _url_cache:
         try:
-            with urllib.request.urlopen(url, timeout=15) as resp:  # noqa: S310
-                _url_cache[url] = resp.read().decode("utf-8")
+            _url_cache[url] = fetch_text(url, _UA, timeout=15)
         except Exception as e:
             # 拉取失败若继续，会生成并提交缺失整段（如 QX 的 [dns] 块）的配置。
             # 直接中止让 workflow 失败，避免把残缺配置 push 到 master。
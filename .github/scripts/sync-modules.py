@@ -4,22 +4,28 @@ Surge sgmodule 聚合脚本
 
 读取 sync-modules.txt 中的 URL 列表，拉取并合并为单个 sgmodule。
 每个来源模块以 # > NAME 分组，按名称首字符排序：数字 → 英文 → 汉字拼音。
+汉字名的拼音缓存在 SORT_KEY_CACHE，模块名不变的运行不导入 pypinyin；各模块的解析
+与改写结果按 body hash 缓存在 MODULE_CACHE，只有变动的上游才重新解析。
 """
 
+import hashlib
+import json
 import re
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from collections import defaultdict
 
-from pypinyin import lazy_pinyin
-
-from _common import prefetch_urls
+from _common import FETCH_BUDGET, prefetch_urls, sha256_file, write_if_changed
 
 _UA = "sync-modules/1.0"
 
 REPO_ROOT = Path(__file__).resolve().parent.parent.parent
 SYNC_TXT = Path(__file__).resolve().parent / "sync-modules.txt"
 OUTPUT_FILE = REPO_ROOT / "Surge" / "Module" / "BlockAds.sgmodule"
+# 汉字模块名 → 拼音的持久缓存（gitignore，CI 随下载缓存一并保存 / 恢复）
+SORT_KEY_CACHE = Path(__file__).resolve().parent / ".sort-key-cache.json"
+# 各上游模块的解析 / 改写记录，按 (alias, body) hash 索引（gitignore，同上随 CI 缓存保存）
+MODULE_CACHE = Path(__file__).resolve().parent / ".module-cache.json"
 
 _SECTION_RE = re.compile(r"^\[(.+)\]$")
 _META_FIELD_RE = re.compile(r"^#!([\w-]+)=(.*)$")
@@ -60,8 +66,17 @@ _ARGS_DESC_GENERAL = (
 )
 
 
-def _sort_key(name: str) -> str:
-    """数字 → 英文字母 → 汉字拼音 排序键。"""
+def _pinyin(name: str) -> str:
+    # 惰性导入：pypinyin 加载时读入整套词典，仅在缓存未命中时才付出这笔开销
+    from pypinyin import lazy_pinyin
+    return " ".join(lazy_pinyin(name))
+
+
+def _sort_key(name: str, pinyin_cache: dict[str, str]) -> str:
+    """数字 → 英文字母 → 汉字拼音 排序键。
+
+    pinyin_cache（name → 拼音）命中则不调用 pypinyin，未命中时计算并回填。
+    """
     if not name:
         return "~"
     first = name[0]
@@ -69,7 +84,25 @@ def _sort_key(name: str) -> str:
         return "0" + name
     if first.isascii() and first.isalpha():
         return "1" + name.lower()
-    return "2" + " ".join(lazy_pinyin(name))
+    key = pinyin_cache.get(name)
+    if key is None:
+        key = pinyin_cache[name] = _pinyin(name)
+    return "2" + key
+
+
+def load_sort_key_cache() -> dict[str, str]:
+    """读取 SORT_KEY_CACHE；缺失或损坏时返回空表（本次全部重算）。"""
+    try:
+        doc = json.loads(SORT_KEY_CACHE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return {k: v for k, v in doc.items() if isinstance(v, str)} if isinstance(doc, dict) else {}
+
+
+def save_sort_key_cache(cache: dict[str, str], names: list[str]) -> None:
+    """只保留本次仍在使用的模块名，内容不变时不写盘。"""
+    kept = {n: cache[n] for n in sorted(names) if n in cache}
+    write_if_changed(SORT_KEY_CACHE, json.dumps(kept, ensure_ascii=False, indent=1) + "\n")
 
 
 def parse_sgmodule(text: str) -> dict:
@@ -96,16 +129,10 @@ def parse_sgmodule(text: str) -> dict:
     return {"meta": meta, "sections": sections}
 
 
-def _apply_key_renames(text: str, renames: dict[str, str]) -> str:
-    """将 text 中 {{{old_key}}} 占位符替换为 {{{new_key}}}（upstream args 前缀重命名）。"""
-    for old_key, new_key in renames.items():
-        text = text.replace("{{{" + old_key + "}}}", "{{{" + new_key + "}}}")
-    return text
-
-
-def _sub_alias(text: str, keyword: str, display: str) -> str:
-    """将 text 中作为域名标签出现的 keyword 替换为占位符 {{{display}}}。
+class _ModuleRewriter:
+    """单个带 alias 模块的内容改写：域名别名替换 + {{{key}}} 占位符改名，一趟完成。
 
+    别名替换：将作为域名标签出现的 keyword 替换为占位符 {{{display}}}。
     keyword 为域名关键字（如 ithome），display 为参数键名（如 IT之家）。
     替换条件（任一即可）：
       - 紧跟在点号后（`.` 或转义的 `\\.`），命中域名前/中段标签；
@@ -114,28 +141,73 @@ def _sub_alias(text: str, keyword: str, display: str) -> str:
     由此命中域名部分（napi.ithome.com → napi.{{{IT之家}}}.com），而不会误伤
     脚本名（移除12306开屏广告）、script-path 路径（.../12306/12306_remove.js）
     或路径候选组（(caixinapp|...) 里的 caixin 因前面是 `(` 而不会被替换）。
+
+    占位符改名：upstream args 加前缀后（renames: old_key → new_key），内容中的
+    {{{old_key}}} 同步改为 {{{new_key}}}。两者合成一个模式、每模块只编译一次，
+    扫描一遍即按 renames 查表替换所有占位符；不含 keyword 与占位符的文本原样返回。
     """
-    esc = re.escape(keyword)
-    repl = "{{{" + display + "}}}"
-    return re.compile(rf"(?<=\.){esc}|{esc}(?=\\?\.|[|)])").sub(lambda _m: repl, text)
+
+    __slots__ = ("keyword", "renames", "_alias_sub", "_alias_repl", "_alias_tmpl", "_sub")
+
+    def __init__(self, keyword: str, display: str, renames: dict[str, str] | None = None) -> None:
+        esc = re.escape(keyword)
+        alias = rf"(?<=\.){esc}|{esc}(?=\\?\.|[|)])"
+        self.keyword = keyword
+        self.renames = renames or {}
+        self._alias_sub = re.compile(alias).sub
+        # 别名产出的 {{{display}}} 同样经过改名表（与先别名、后改名的顺序一致）
+        self._alias_repl = "{{{" + self.renames.get(display, display) + "}}}"
+        self._alias_tmpl = self._alias_repl.replace("\\", "\\\\")  # re 模板，按字面替换
+        self._sub = re.compile(r"\{\{\{([^{}]*)\}\}\}|" + alias).sub
+
+    def _replace(self, m: re.Match) -> str:
+        key = m.group(1)
+        if key is None:
+            return self._alias_repl
+        return "{{{" + self.renames.get(key, key) + "}}}"
+
+    def alias(self, text: str) -> str:
+        """仅做域名别名替换（MITM hostname 与 # hostname 提示行）。"""
+        if self.keyword not in text:
+            return text
+        return self._alias_sub(self._alias_tmpl, text)
+
+    def rewrite_lines(self, lines: list[str]) -> list[str]:
+        """整段一次改写：以换行拼接后 sub 一次再拆回。keyword / 占位符均不含换行，
+        前后断言也不跨越换行成立，结果与逐行改写一致。"""
+        joined = "\n".join(lines)
+        if not self.renames:
+            if self.keyword not in joined:
+                return lines
+            return self._alias_sub(self._alias_tmpl, joined).split("\n")
+        if self.keyword not in joined and "{{{" not in joined:
+            return lines
+        return self._sub(self._replace, joined).split("\n")
+
+
+def _iter_mitm_hosts(line: str):
+    """[MITM] 的 hostname 行 → 逐个 yield 其中的 hostname（去掉 %APPEND%）。"""
+    val = re.sub(r"^%APPEND%\s*", "", line.partition("=")[2].strip())
+    for h in val.split(","):
+        h = h.strip()
+        if h:
+            yield h
 
 
 def _merge_mitm(
     entries: list[tuple[str, list[str]]],
-    name_to_alias: dict[str, str],
-    name_to_display: dict[str, str],
+    host_aliases: dict[str, dict[str, str]],
 ) -> list[str]:
     """合并多个来源的 [MITM] 块：hostname 去重合并，布尔键取 true 优先。
 
-    每条 hostname 按其所属模块的 alias 做域名替换。
+    每条 hostname 按其所属模块记录里的 mitm_hosts（原 hostname → 别名替换后）改写。
     """
     host_map: dict[str, str] = {}  # 原始 hostname -> 替换后 hostname（按原始去重/排序）
     bool_flags: dict[str, str] = {}
     other: list[str] = []
 
     for name, lines in entries:
-        alias = name_to_alias.get(name)
-        display = name_to_display.get(name, alias or "")
+        aliased = host_aliases.get(name, {})
         for line in lines:
             if not line.strip():
                 continue
@@ -147,11 +219,9 @@ def _merge_mitm(
             val = val.strip()
 
             if key == "hostname":
-                val = re.sub(r"^%APPEND%\s*", "", val)
-                for h in val.split(","):
-                    h = h.strip()
-                    if h and h not in host_map:
-                        host_map[h] = _sub_alias(h, alias, display) if alias else h
+                for h in _iter_mitm_hosts(line):
+                    if h not in host_map:
+                        host_map[h] = aliased.get(h, h)
             elif key in _MITM_BOOL_KEYS:
                 if bool_flags.get(key) != "true":
                     bool_flags[key] = val
@@ -167,6 +237,116 @@ def _merge_mitm(
     return result
 
 
+def _module_record(text: str, url: str, alias: str) -> dict:
+    """解析单个上游模块，并完成与其他模块无关的全部加工：display、arguments 加前缀、
+    各 section 的别名 / 占位符改写、自身 hostname 提示行。返回可 JSON 序列化的记录，
+    由 aggregate 合并，并按 body hash 缓存到 MODULE_CACHE。MITM 行保持原样（跨模块合并）。"""
+    parsed = parse_sgmodule(text)
+    meta = parsed["meta"]
+    name = meta.get("name", url)
+    # display = 参数键名（模块名去掉”去广告”）
+    display = (name.replace("去广告", "").strip() or alias) if alias else ""
+    # 该模块自带 arguments（保序），输出时紧跟在该模块的域名开关之后
+    args: list[tuple[str, str]] = []
+    for arg_entry in meta.get("arguments", "").split(","):
+        arg_entry = arg_entry.strip()
+        if not arg_entry:
+            continue
+        key = arg_entry.split(":")[0].strip()
+        if key:
+            args.append((key, arg_entry))
+    renames: dict[str, str] = {}
+    if args and alias:
+        # 有 alias 的模块：给每个 upstream arg key 加上 "{display}-" 前缀，
+        # 并记录 old_key -> new_key 映射，以便替换内容中的 {{{key}}} 占位符
+        prefix = display + "-"
+        renames = {key: prefix + key for key, _ in args}
+        args = [(prefix + k, prefix + entry) for k, entry in args]
+    rewriter = _ModuleRewriter(alias, display, renames) if alias else None
+
+    args_desc: list[tuple[str, str]] = []
+    for desc_entry in meta.get("arguments-desc", "").split("\n"):
+        desc_entry = desc_entry.strip()
+        if not desc_entry:
+            continue
+        key = desc_entry.split(":")[0].strip()
+        if key:
+            args_desc.append((key, desc_entry))
+    # 该模块自身的 hostname（Script 段 # hostname = ... 提示行）
+    hostname = ""
+    for line in parsed["sections"].get("MITM", []):
+        if "=" in line:
+            k, _, v = line.partition("=")
+            if k.strip() == "hostname":
+                hostname = re.sub(r"^%APPEND%\s*", "", v.strip())
+                if hostname and rewriter:
+                    hostname = rewriter.alias(hostname)
+                break
+    # MITM hostname 的别名替换结果（仅记有变化者），供 _merge_mitm 跨模块合并时查表
+    mitm_hosts: dict[str, str] = {}
+    if rewriter:
+        for line in parsed["sections"].get("MITM", []):
+            if line.partition("=")[0].strip() == "hostname":
+                for h in _iter_mitm_hosts(line):
+                    if (aliased := rewriter.alias(h)) != h:
+                        mitm_hosts[h] = aliased
+    sections: dict[str, list[str]] = {}
+    for section, lines in parsed["sections"].items():
+        non_empty = [l for l in lines if l.strip()]
+        if non_empty:
+            if rewriter and section != "MITM":
+                non_empty = rewriter.rewrite_lines(non_empty)
+            sections[section] = non_empty
+    raw_date = meta.get("date", "")
+    return {
+        "name": name,
+        "display": display,
+        "date": raw_date.split()[0] if raw_date else "",  # 只保留年月日
+        "desc": meta.get("desc", ""),
+        "args": args,
+        "args_desc": args_desc,
+        "hostname": hostname,
+        "mitm_hosts": mitm_hosts,
+        "sections": sections,
+    }
+
+
+def _module_cache_key(text: str, url: str, alias: str) -> str:
+    # url 也入键：无 #!name 时模块名回退为 url（见 _module_record）
+    return hashlib.sha256(f"{url}\n{alias}\n{text}".encode("utf-8")).hexdigest()
+
+
+def _module_source(url: str, alias: str) -> str:
+    # 与 sync-modules.txt 的行格式一致
+    return f"{url},{alias}"
+
+
+def _module_cache_version() -> str:
+    """本脚本与 _common.py 的 hash：两者任一改动，缓存的解析 / 改写结果即整体失效。"""
+    here = Path(__file__).resolve()
+    return "+".join(sha256_file(p) or "" for p in (here, here.with_name("_common.py")))
+
+
+def load_module_cache() -> tuple[dict[str, dict], dict[str, str]]:
+    """读取 MODULE_CACHE，返回 (记录表, 上游 -> 上次记录的键)；脚本改动（版本 hash
+    不符）、缺失或损坏时返回空表。"""
+    try:
+        doc = json.loads(MODULE_CACHE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}, {}
+    if not isinstance(doc, dict) or doc.get("version") != _module_cache_version():
+        return {}, {}
+    return doc.get("modules", {}), doc.get("sources", {})
+
+
+def save_module_cache(records: dict[str, dict], sources: dict[str, str]) -> None:
+    """只保留本次用到的记录（下线 / 已变动的上游随之淘汰），内容不变时不写盘。
+    sources 记下各上游最近一次的记录键，下载瞬时失败时据此沿用上次结果。"""
+    doc = {"version": _module_cache_version(), "modules": dict(sorted(records.items())),
+           "sources": sources}
+    write_if_changed(MODULE_CACHE, json.dumps(doc, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
 def load_urls() -> list[tuple[str, str]]:
     """返回 (url, alias) 列表；alias 为空字符串表示无别名。"""
     result: list[tuple[str, str]] = []
@@ -206,6 +386,17 @@ def aggregate():
     print(f"并发拉取 {len(url_list)} 个 sgmodule …")
     results = prefetch_urls(url_list, _UA, encode=True)
 
+    # 各模块记录：body 未变（同一 url / alias）则直接复用上次的解析 / 改写结果；
+    # 瞬时失败的模块沿用上次的记录，没有可沿用的记录时保留现有产物，等下次运行再聚合
+    cached, cached_sources = load_module_cache()
+    missing = [url for url, alias in url_alias_list
+               if url in FETCH_BUDGET.failed and cached_sources.get(_module_source(url, alias)) not in cached]
+    if missing:
+        print(f"[WARN] {len(missing)} 个模块下载失败（瞬时）且无缓存记录，保留现有 {OUTPUT_FILE.name}")
+        for url in missing:
+            print(f"  {url} ({FETCH_BUDGET.failed[url]})")
+        return
+
     # {section: [(name, [lines]), ...]}  按原顺序收集
     section_entries: dict[str, list[tuple[str, list[str]]]] = defaultdict(list)
     # name -> hostname 注释字符串（用于各 section 内的 # hostname = ... 提示行）
@@ -220,79 +411,65 @@ def aggregate():
     ordered_modules: list[str] = []
     # 合并后的 upstream arguments-desc：key -> desc（保序去重）
     merged_args_desc: dict[str, str] = {}
-    # 模块名 -> alias（域名关键字），用于在各 section 内做域名替换
+    # 模块名 -> alias（域名关键字）
     name_to_alias: dict[str, str] = {}
     # 模块名 -> display（参数键名 = 模块名去掉”去广告”）
     name_to_display: dict[str, str] = {}
-    # 模块名 -> {原始 key -> 带前缀 key}，用于将上游 {{{key}}} 占位符同步改名
-    module_arg_key_renames: dict[str, dict[str, str]] = {}
+    # 模块名 -> {原 MITM hostname -> 别名替换后}（其余 section 已在记录中改写）
+    host_aliases: dict[str, dict[str, str]] = {}
 
+    records: dict[str, dict] = {}
+    sources: dict[str, str] = {}
+    reparsed = 0
     for url, alias in url_alias_list:
+        source = _module_source(url, alias)
         text = results.get(url)
-        if not text:
+        if text:
+            key = _module_cache_key(text, url, alias)
+            rec = cached.get(key)
+            if rec is None:
+                rec = _module_record(text, url, alias)
+                reparsed += 1
+        elif url in FETCH_BUDGET.failed:
+            key = cached_sources[source]
+            rec = cached[key]
+            print(f"  [WARN] {url} 下载失败（{FETCH_BUDGET.failed[url]}），沿用上次的记录")
+        else:
             continue
-        parsed = parse_sgmodule(text)
-        name = parsed["meta"].get("name", url)
+        records[key] = rec
+        sources[source] = key
+        name = rec["name"]
         if name not in ordered_modules:
             ordered_modules.append(name)
         if alias:
-            display = name.replace("去广告", "").strip() or alias
             name_to_alias[name] = alias
-            name_to_display[name] = display
-        # 提取上游 date（只保留年月日）
-        raw_date = parsed["meta"].get("date", "")
-        if raw_date:
-            module_dates[name] = raw_date.split()[0]
-        # 提取上游 desc
-        desc = parsed["meta"].get("desc", "")
-        if desc:
-            module_descs[name] = desc
-        # 收集该模块自带 arguments（保序），输出时紧跟在该模块的域名开关之后
-        mod_arg_list: list[tuple[str, str]] = []
-        for arg_entry in parsed["meta"].get("arguments", "").split(","):
-            arg_entry = arg_entry.strip()
-            if not arg_entry:
-                continue
-            key = arg_entry.split(":")[0].strip()
-            if key:
-                mod_arg_list.append((key, arg_entry))
-        if mod_arg_list:
-            if alias:
-                # 有 alias 的模块：给每个 upstream arg key 加上 "{display}-" 前缀，
-                # 并记录 old_key -> new_key 映射，以便后续替换内容中的 {{{key}}} 占位符
-                disp = name_to_display.get(name, alias)
-                prefix = disp + "-"
-                renames = {key: prefix + key for key, _ in mod_arg_list}
-                module_arg_key_renames[name] = renames
-                mod_arg_list = [(prefix + k, prefix + entry) for k, entry in mod_arg_list]
-            module_args[name] = mod_arg_list
-        for desc_entry in parsed["meta"].get("arguments-desc", "").split("\n"):
-            desc_entry = desc_entry.strip()
-            if not desc_entry:
-                continue
-            key = desc_entry.split(":")[0].strip()
-            if key and key not in merged_args_desc:
+            name_to_display[name] = rec["display"]
+            host_aliases[name] = rec["mitm_hosts"]
+        if rec["date"]:
+            module_dates[name] = rec["date"]
+        if rec["desc"]:
+            module_descs[name] = rec["desc"]
+        if rec["args"]:
+            module_args[name] = [tuple(a) for a in rec["args"]]
+        for key, desc_entry in rec["args_desc"]:
+            if key not in merged_args_desc:
                 merged_args_desc[key] = desc_entry
-        # 提取该模块自身的 hostname
-        mitm_lines = parsed["sections"].get("MITM", [])
-        for line in mitm_lines:
-            if "=" in line:
-                k, _, v = line.partition("=")
-                if k.strip() == "hostname":
-                    v = re.sub(r"^%APPEND%\s*", "", v.strip())
-                    if v:
-                        module_hostnames[name] = v
-                    break
-        for section, lines in parsed["sections"].items():
-            non_empty = [l for l in lines if l.strip()]
-            if non_empty:
-                section_entries[section].append((name, non_empty))
+        if rec["hostname"]:
+            module_hostnames[name] = rec["hostname"]
+        for section, lines in rec["sections"].items():
+            section_entries[section].append((name, lines))
         print(f"  ✓ {name}")
-
-    # 对每个 section 内的条目按名称排序（MITM 单独处理）
+    if reparsed or records.keys() != cached.keys() or sources != cached_sources:
+        save_module_cache(records, sources)
+    print(f"  解析 {reparsed} 个模块，{len(records) - reparsed} 个复用缓存（{MODULE_CACHE.name}）")
+
+    # 对每个 section 内的条目按名称排序（MITM 单独处理）；每个名称只算一次排序键
+    pinyin_cache = load_sort_key_cache()
+    sort_keys = {name: _sort_key(name, pinyin_cache) for name in ordered_modules}
+    save_sort_key_cache(pinyin_cache, ordered_modules)
     for sec in section_entries:
         if sec != "MITM":
-            section_entries[sec].sort(key=lambda x: _sort_key(x[0]))
+            section_entries[sec].sort(key=lambda x: sort_keys[x[0]])
 
     # 构建输出（name/desc/category/remark 保留手动维护值，date 取当前同步时间）
     now = datetime.now(tz=timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
@@ -329,30 +506,19 @@ def aggregate():
             return
         out.append(f"[{sec}]")
         if sec == "MITM":
-            out.extend(_merge_mitm(entries, name_to_alias, name_to_display))
+            out.extend(_merge_mitm(entries, host_aliases))
         else:
             first = True
             for name, lines in entries:
                 if not first:
                     out.append("")
-                alias = name_to_alias.get(name)
-                display = name_to_display.get(name, alias or "")
                 date_suffix = f" · {module_dates[name]}" if name in module_dates else ""
                 out.append(f"# > {name}{date_suffix}")
                 if name in module_descs:
                     out.append(f"# desc = {module_descs[name]}")
                 if sec == "Script" and name in module_hostnames:
-                    hint = module_hostnames[name]
-                    if alias:
-                        hint = _sub_alias(hint, alias, display)
-                    out.append(f"# hostname = {hint}")
-                renames = module_arg_key_renames.get(name, {})
-                for line in lines:
-                    if alias:
-                        line = _sub_alias(line, alias, display)
-                    if renames:
-                        line = _apply_key_renames(line, renames)
-                    out.append(line)
+                    out.append(f"# hostname = {module_hostnames[name]}")
+                out.extend(lines)
                 first = False
         out.append("")
         written_sections.add(sec)
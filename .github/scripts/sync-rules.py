@@ -10,14 +10,28 @@ Surge RULE-SET 同步脚本
 5. 清理已删除的规则文件
 """
 
+import argparse
+import bisect
+import contextlib
+import hashlib
+import io
+import ipaddress
 import json
+import os
 import re
 import subprocess
+import sys
+import time
+import urllib.parse
+import zlib
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from _common import write_if_changed, prefetch_urls
+from _common import (FETCH_BUDGET, RUN_STATS, write_if_changed, open_if_changed, prefetch_urls,
+                     sha256_file)
 
 # ─── 目录配置 ─────────────────────────────────────────────────────────
 REPO_ROOT = Path(__file__).resolve().parent.parent.parent
@@ -25,18 +39,30 @@ SURGE_DIR = REPO_ROOT / "Surge" / "RULE-SET"
 QX_DIR = REPO_ROOT / "Quantumult" / "X" / "Filter"
 CLASH_DIR = REPO_ROOT / "Clash" / "RuleSet"
 SINGBOX_DIR = REPO_ROOT / "sing-box" / "source"
+SINGBOX_SRS_DIR = REPO_ROOT / "sing-box" / "rule-set"
 SYNC_RULES_TXT = REPO_ROOT / ".github" / "scripts" / "sync-rules.txt"
+# Step 4 转换清单：源文件 → (源 hash, 转换器版本, 模式) → 产物 hash（.gitignore 已忽略，
+# CI 由 actions/cache 跨运行保留；丢失只会导致一次全量转换）
+CONVERT_MANIFEST = REPO_ROOT / ".github" / "scripts" / ".convert-manifest.json"
+# Step 2/3 合集状态：各合集文件 hash + 成员 (stem, 成员文件 hash, 段行数)，用于只替换
+# 变动成员的段；另有各文件 hash 快照及其 (mtime, size)，stamp 未变即沿用 hash 不重读
+# （.gitignore 已忽略，CI 随下载缓存保留；丢失或与合集内容不符时整文件重建）
+STREAMING_STATE = REPO_ROOT / ".github" / "scripts" / ".streaming-state.json"
+# 运行报告默认路径（--report 可改；.gitignore 已忽略，CI 作为 artifact 上传）
+RUN_REPORT = REPO_ROOT / ".github" / "scripts" / ".run-report.json"
 _UA = "sync-rules/1.0"
 
 
-def _recently_changed_files() -> set[str]:
-    """Return repo-relative paths of recently changed files.
+# 显式变更清单（换行分隔的仓库相对路径），优先于快照 / git 检测；CLI --changed 同义
+CHANGED_FILES_ENV = "SYNC_CHANGED_FILES"
 
-    Checks both the HEAD commit (via ``git diff-tree HEAD`` — needs HEAD's parent,
-    so CI must clone with depth ≥ 2; a depth-1 shallow clone treats HEAD as a root
-    commit and this yields nothing) and the working tree (``git diff HEAD`` for
-    local runs with uncommitted edits), so direction detection works in both
-    environments.
+
+def _git_changed_files() -> set[str]:
+    """Return repo-relative paths changed in the HEAD commit and the working tree.
+
+    ``git diff-tree HEAD`` needs HEAD's parent (a depth-1 shallow clone treats HEAD
+    as a root commit and yields nothing); ``git diff HEAD`` covers uncommitted
+    local edits. Only used when neither an explicit list nor a snapshot exists.
     """
     result: set[str] = set()
     try:
@@ -53,6 +79,48 @@ def _recently_changed_files() -> set[str]:
         pass
     return result
 
+
+def _normalize_changed(paths: Iterable[str]) -> set[str]:
+    """显式清单 → 仓库相对 posix 路径（接受绝对路径；空行忽略）。"""
+    result: set[str] = set()
+    for raw in paths:
+        raw = raw.strip()
+        if not raw:
+            continue
+        p = Path(raw)
+        if p.is_absolute():
+            try:
+                p = p.resolve().relative_to(REPO_ROOT)
+            except ValueError:
+                continue
+        result.add(p.as_posix())
+    return result
+
+
+def _recently_changed_files(explicit: Iterable[str] | None = None,
+                            snapshot: dict[str, str] | None = None,
+                            current: dict[str, str] | None = None) -> tuple[set[str], str]:
+    """近期有改动的文件（仓库相对路径），返回 (路径集合, 来源)。
+
+    检测：上次运行结束时的内容 hash 快照 snapshot 与当前 hash current 的差异（cron /
+    本地重复运行，不起 git 子进程）；无快照（首次运行 / 缓存丢失）时回退 git diff。
+    explicit（CLI --changed）或环境变量 SYNC_CHANGED_FILES（CI push 事件由 workflow
+    从事件 payload 给出）并入检测结果而不取代它：push 清单不含 Step 1 刚在工作区
+    改写的文件，GitHub 还会把 payload 的 commits 截断在 20 个。
+    """
+    if explicit is None and os.environ.get(CHANGED_FILES_ENV):
+        explicit = os.environ[CHANGED_FILES_ENV].splitlines()
+    if snapshot is not None and current is not None:
+        changed = {p for p, h in current.items() if snapshot.get(p) != h}
+        changed.update(p for p in snapshot if p not in current)
+        source = "快照"
+    else:
+        changed, source = _git_changed_files(), "git"
+    if explicit is not None:
+        changed |= _normalize_changed(explicit)
+        source = f"显式清单 + {source}"
+    return changed, source
+
 # ─── QX 不支持的规则类型 ──────────────────────────────────────────────
 QX_SKIP = {"URL-REGEX", "AND", "OR", "NOT", "PROCESS-NAME", "PROCESS-NAME-REGEX"}
 
@@ -89,28 +157,150 @@ CLASH_CIDR_COMPANION = {"LAN": "lancidr.txt"}
 STREAMING_PLACEHOLDER_RE = re.compile(r"^###\s+Streaming(?:\s+([A-Z]+))?\s*$")
 
 
+# 行分类正则（预编译；调用方先以 startswith 过滤，规则行不进正则，见 section_header）
+SECTION_HEADER_RE = re.compile(r"^#\s*>\s*(.+)$")           # '# > Name'（含 '# >> Sub'）
+TOP_SECTION_RE = re.compile(r"^#\s*>(?!>)\s*(\S.*)$")        # 仅 '# > Name'，排除 '# >>'
+AND_RULE_RE = re.compile(r"AND,\(\((.+)\)\)$")
+AND_SPLIT_RE = re.compile(r"\),\s*\(")
+
+
+# ─── RULE-SET 文件元数据索引 ─────────────────────────────────────────
+# 占位符 / '# >' 节名 / '### fork from' 头由 Step 2（合并组、地区成员）与 Step 5
+# （外部拉取文件识别）共用：按需探测、按 (mtime, size) 失效，导入本模块不做任何 I/O。
+
+# 头部探测的字节上限：头部区域（首条规则行之前的注释 / 空行 / 占位符）超过此值即停读
+RULE_PROBE_BUDGET = 64 * 1024
+
+
+class RuleFileMeta:
+    """单个 Surge RULE-SET .list 的元数据。
+
+    fork_from   首行 '### fork from ' 之后的来源串（非外部拉取文件为 None）
+    placeholder 头部区域内首个 '### Streaming [REGION]' 占位符的 REGION
+                （仅总表为 ""，无占位符为 None）
+    sections    已读部分中各 '# > Name' 行的 Name（按出现顺序）；complete=False 时
+                只覆盖头部区域
+    complete    是否读完整个文件（含占位符的 streaming 服务文件总是读完）
+    sha256      内容 hash，首次访问时才计算
+    """
+
+    __slots__ = ("path", "stamp", "fork_from", "placeholder", "sections", "complete", "_sha256")
+
+    def __init__(self, path: Path, stamp: tuple[int, int], fork_from: str | None,
+                 placeholder: str | None, sections: list[str], complete: bool) -> None:
+        self.path = path
+        self.stamp = stamp  # (mtime_ns, size)
+        self.fork_from = fork_from
+        self.placeholder = placeholder
+        self.sections = sections
+        self.complete = complete
+        self._sha256: str | None = None
+
+    @property
+    def size(self) -> int:
+        return self.stamp[1]
+
+    @property
+    def sha256(self) -> str | None:
+        if self._sha256 is None:
+            self._sha256 = sha256_file(self.path)
+        return self._sha256
+
+
+def _probe_rule_file(path: Path, stamp: tuple[int, int],
+                     budget: int = RULE_PROBE_BUDGET) -> RuleFileMeta:
+    """有界读取：只读到头部区域结束（首条规则行）或读满 budget 字节即停，
+    Phishing.list 这类大文件只花几行的 I/O。
+
+    占位符按约定紧跟首个 '# > Name'（见 _inject_placeholder），必在头部区域内；
+    头部有占位符的 streaming 服务文件（体量很小）继续读完，以收集全部节名
+    （合并组判定要用）。
+    """
+    fork_from = placeholder = None
+    sections: list[str] = []
+    complete = True
+    in_header, consumed = True, 0
+    with open(path, "rb") as f:
+        for i, raw in enumerate(f):
+            stripped = raw.decode("utf-8").strip()
+            if in_header:
+                consumed += len(raw)
+                if stripped and not stripped.startswith(("#", "//")):
+                    in_header = False
+                    if placeholder is None:
+                        complete = False
+                        break
+                elif consumed > budget:
+                    complete = False
+                    break
+                elif i == 0 and stripped.startswith("### fork from "):
+                    fork_from = stripped[len("### fork from "):]
+                elif placeholder is None and stripped.startswith("###") and (
+                        m := STREAMING_PLACEHOLDER_RE.match(stripped)):
+                    placeholder = m.group(1) or ""
+            if (name := section_header(stripped)) is not None:
+                sections.append(name)
+    return RuleFileMeta(path, stamp, fork_from, placeholder, sections, complete)
+
+
+class RuleSetIndex:
+    """目录下各 .list 的 RuleFileMeta 缓存：首次访问时探测，之后每次访问只 stat，
+    文件被改写（mtime / size 变化）才重新探测，故 Step 1 / Step 2 写入后仍准确。
+
+    remember() 记下已知的 (stamp, sha256)（上次运行的快照、刚写出的内容）：stamp
+    相符的文件直接沿用该 hash，不再整文件读取。"""
+
+    __slots__ = ("root", "budget", "_entries", "_hashes")
+
+    def __init__(self, root: Path, budget: int = RULE_PROBE_BUDGET) -> None:
+        self.root = root
+        self.budget = budget
+        self._entries: dict[Path, RuleFileMeta] = {}
+        self._hashes: dict[Path, tuple[tuple[int, int], str]] = {}
+
+    def remember(self, path: Path, stamp: tuple[int, int], sha256: str) -> None:
+        self._hashes[path] = (stamp, sha256)
+        meta = self._entries.get(path)
+        if meta is not None and meta.stamp == stamp:
+            meta._sha256 = sha256
+
+    def get(self, path: Path) -> RuleFileMeta | None:
+        try:
+            st = path.stat()
+        except OSError:
+            self._entries.pop(path, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        meta = self._entries.get(path)
+        if meta is None or meta.stamp != stamp:
+            meta = self._entries[path] = _probe_rule_file(path, stamp, self.budget)
+            known = self._hashes.get(path)
+            if known is not None and known[0] == stamp:
+                meta._sha256 = known[1]
+        return meta
+
+    def files(self, recursive: bool = False) -> list[RuleFileMeta]:
+        """根目录（recursive=True 时含子目录）下全部 .list 的元数据，按路径排序。"""
+        paths = sorted(self.root.rglob("*.list") if recursive else self.root.glob("*.list"))
+        return [meta for p in paths if (meta := self.get(p)) is not None]
+
+
+RULE_INDEX = RuleSetIndex(SURGE_DIR)
+
+
 # 合并组：含 ### Streaming 占位符且含多个 '# > Name' 节的文件视为合并组
 # 只扫描 streaming 服务文件，排除 Block.list / Unbreak.list 等多节非 streaming 文件
 def _build_merge_maps() -> dict[str, str]:
-    """扫描根目录各 streaming .list 文件，将含多个 '# > Name' 节的 section 名映射到其文件 stem。"""
+    """各 streaming .list 中含多个 '# > Name' 节的：section 名 → 文件 stem。"""
     reverse: dict[str, str] = {}
-    for p in sorted(SURGE_DIR.glob("*.list")):
-        if p.stem.startswith("Streaming"):
-            continue
-        text = p.read_text(encoding="utf-8")
-        lines = text.splitlines()
-        if not any(STREAMING_PLACEHOLDER_RE.match(line.strip()) for line in lines):
-            continue  # 非 streaming 服务文件，跳过
-        secs = [m.group(1).strip()
-                for line in lines
-                if (m := re.match(r"^#\s*>\s*(.+)$", line.strip()))]
-        if len(secs) > 1:
-            for s in secs:
-                reverse[s] = p.stem
+    for meta in RULE_INDEX.files():
+        if meta.path.stem.startswith("Streaming") or meta.placeholder is None:
+            continue  # 聚合文件 / 非 streaming 服务文件，跳过
+        if len(meta.sections) > 1:
+            for s in meta.sections:
+                reverse[s] = meta.path.stem
     return reverse
 
-MERGE_SECTION_TO_FILE = _build_merge_maps()
-
 
 # ═══════════════════════════════════════════════════════════════════════
 #  通用工具
@@ -139,8 +329,7 @@ def _mark_upstream_deleted(filepath: Path) -> None:
 
 def strip_streaming_placeholders(text: str) -> str:
     """从文件内容中去除 ### Streaming * 占位符行。"""
-    lines = [l for l in text.splitlines()
-             if not STREAMING_PLACEHOLDER_RE.match(l.strip())]
+    lines = [l for l in text.splitlines() if not is_streaming_placeholder(l.strip())]
     return "\n".join(lines)
 
 
@@ -151,18 +340,90 @@ def scan_streaming_placeholders() -> dict[str, list[str]]:
     聚合文件（Streaming*.list）跳过。
     """
     result: dict[str, list[str]] = {}
-    for p in sorted(SURGE_DIR.glob("*.list")):
-        if p.stem.startswith("Streaming"):
+    for meta in RULE_INDEX.files():
+        if meta.path.stem.startswith("Streaming") or meta.placeholder is None:
             continue
-        for line in p.read_text(encoding="utf-8").splitlines():
-            m = STREAMING_PLACEHOLDER_RE.match(line.strip())
-            if m:
-                region = m.group(1) or ""
-                result.setdefault(region, []).append(p.stem)
-                break
+        result.setdefault(meta.placeholder, []).append(meta.path.stem)
     return result
 
 
+# ═══════════════════════════════════════════════════════════════════════
+#  运行报告
+# ═══════════════════════════════════════════════════════════════════════
+
+class RunReport:
+    """一次运行的结构化计量，main() 结束时写为 JSON（见 RUN_REPORT）：
+
+    - steps:   各 Step 耗时、下载 / 写入字节与写入文件数（取自 _common.RUN_STATS 差值）
+    - files:   Step 4 逐文件耗时、规则进 / 出条数（QX / Clash / sing-box）、写入字节
+    - dropped: sing-box 无对应类型而丢弃的规则，{产物名: {类型: 条数}}
+    - downloads: 各 URL 下载字节、耗时、是否 304 命中缓存、尝试次数
+
+    跨日 cron 对比即可定位变慢的上游与转换器。"""
+
+    __slots__ = ("started", "steps", "files", "dropped")
+
+    def __init__(self) -> None:
+        self.started = datetime.now(timezone.utc)
+        self.steps: list[dict] = []
+        self.files: list[dict] = []
+        self.dropped: dict[str, dict[str, int]] = {}
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        """计量一个 Step：with REPORT.step("…"): …"""
+        t0 = time.perf_counter()
+        w0, f0 = RUN_STATS.bytes_written, RUN_STATS.files_written
+        d0 = RUN_STATS.bytes_downloaded
+        try:
+            yield
+        finally:
+            self.steps.append({
+                "name": name,
+                "seconds": round(time.perf_counter() - t0, 4),
+                "bytes_downloaded": RUN_STATS.bytes_downloaded - d0,
+                "bytes_written": RUN_STATS.bytes_written - w0,
+                "files_written": RUN_STATS.files_written - f0,
+            })
+
+    def note_dropped(self, name: str, dropped: dict[str, int]) -> None:
+        if dropped:
+            self.dropped[name or "?"] = dict(sorted(dropped.items()))
+
+    def absorb(self, part: dict) -> None:
+        """并入进程池 worker 的计量（process_file 在子进程内记录，见 _convert_one）。"""
+        self.files.extend(part["files"])
+        self.dropped.update(part["dropped"])
+        for rec in part["files"]:
+            RUN_STATS.add_written(rec["bytes_written"], rec["files_written"])
+
+    def to_dict(self) -> dict:
+        with RUN_STATS.lock:
+            downloads = dict(RUN_STATS.downloads)
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": round(sum(s["seconds"] for s in self.steps), 4),
+            "bytes_downloaded": sum(d["bytes"] for d in downloads.values()),
+            "bytes_written": RUN_STATS.bytes_written,
+            "files_written": RUN_STATS.files_written,
+            "steps": self.steps,
+            "files": sorted(self.files, key=lambda r: -r["seconds"]),
+            "dropped": dict(sorted(self.dropped.items())),
+            "downloads": dict(sorted(downloads.items(), key=lambda kv: -kv[1]["seconds"])),
+            "fetch_failed": dict(FETCH_BUDGET.failed),
+            "fetch_errors": dict(FETCH_BUDGET.errors),
+            "fetch_not_found": sorted(FETCH_BUDGET.not_found),
+        }
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=1, ensure_ascii=False) + "\n",
+                        encoding="utf-8")
+
+
+REPORT = RunReport()
+
+
 # ═══════════════════════════════════════════════════════════════════════
 #  Step 1 & 2: Streaming 双向同步
 # ═══════════════════════════════════════════════════════════════════════
@@ -173,13 +434,13 @@ def parse_sections(text: str) -> dict:
     current = None
     buf = []
     for line in text.splitlines():
-        m = re.match(r"^#\s*>\s*(.+)$", line.strip())
-        if m:
+        name = section_header(line.strip())
+        if name is not None:
             if current is not None:
                 while buf and not buf[-1].strip():
                     buf.pop()
                 sections[current] = buf
-            current = m.group(1).strip()
+            current = name
             buf = [line]
         elif current is not None:
             buf.append(line)
@@ -190,10 +451,11 @@ def parse_sections(text: str) -> dict:
     return sections
 
 
-def section_name_to_file(name: str) -> str:
-    """section 名 → 文件名 stem。空格与下划线等价（先查显式映射，再尝试空格→下划线）。"""
-    if name in MERGE_SECTION_TO_FILE:
-        return MERGE_SECTION_TO_FILE[name]
+def section_name_to_file(name: str, merge_map: dict[str, str]) -> str:
+    """section 名 → 文件名 stem。空格与下划线等价（先查合并组映射 merge_map，见
+    _build_merge_maps，再尝试空格→下划线）。"""
+    if name in merge_map:
+        return merge_map[name]
     normalized = name.replace(" ", "_")
     if (SURGE_DIR / f"{normalized}.list").exists():
         return normalized
@@ -208,8 +470,10 @@ def read_standalone(stem: str) -> str | None:
     return None
 
 
-def _extract_streaming(streaming_path: Path, placeholders: dict[str, list[str]]) -> None:
-    """总合集 → 独立子项（保留各文件的 ### Streaming 占位符）。"""
+def _extract_streaming(streaming_path: Path, placeholders: dict[str, list[str]],
+                       merge_map: dict[str, str]) -> list[tuple[str, str]]:
+    """总合集 → 独立子项（保留各文件的 ### Streaming 占位符）。返回实际改写的 [(section, stem)]。"""
+    moved: list[tuple[str, str]] = []
     text = streaming_path.read_text(encoding="utf-8")
     sections = parse_sections(text)
     stem_to_region = {
@@ -218,7 +482,7 @@ def _extract_streaming(streaming_path: Path, placeholders: dict[str, list[str]])
         for stem in stems
     }
     for sec_name, lines in sections.items():
-        stem = section_name_to_file(sec_name)
+        stem = section_name_to_file(sec_name, merge_map)
         if stem not in stem_to_region:
             print(f"  [SKIP] 无法确定 region，跳过: {sec_name}")
             continue
@@ -226,26 +490,48 @@ def _extract_streaming(streaming_path: Path, placeholders: dict[str, list[str]])
         out_lines = _inject_placeholder(lines, region) if region else lines
         if write_if_changed(SURGE_DIR / f"{stem}.list", "\n".join(out_lines) + "\n"):
             print(f"  ✓ Streaming.list → {stem}.list")
+            moved.append((sec_name, stem))
+    return moved
 
 
-def sync_streaming() -> None:
+def sync_streaming(changed_files: Iterable[str] | None = None) -> list[tuple[str, str, str]]:
     """Streaming 三层双向同步：总合集 ↔ 地区合集 ↔ 独立子项，以独立子项为枢纽。
 
-    同步方向由近期有改动的文件决定（HEAD commit + 工作区未提交改动）：
+    同步方向由近期有改动的文件决定（见 _recently_changed_files：与上次运行的快照比对，
+    并入显式清单 changed_files / SYNC_CHANGED_FILES）：
     - 仅总合集有改动       → 提取到独立子项，再重建各地区合集和总合集
     - 仅某地区合集有改动   → 提取到对应独立子项，再重建所有合集
     - 独立子项有改动       → 直接重建各地区合集和总合集
     - 无改动（cron/首次）  → 从独立子项重建所有合集（或从地区合集提取首次建档）
+
+    重建合集时按 STREAMING_STATE 只替换变动成员的段（见 _rebuild_aggregate）。
+    返回本次移动的 [(section, 来源文件, 目标文件)]，并打印汇总。
     """
     print("\n── Step 2/3: Streaming 三层同步 ──")
 
-    changed = _recently_changed_files()
+    state, snapshot = _load_streaming_state()
+    changed, source = _recently_changed_files(
+        changed_files, snapshot, _streaming_snapshot() if snapshot is not None else None)
+    print(f"  [改动检测] {source}：{len(changed)} 个文件")
     placeholders = scan_streaming_placeholders()
+    # 合并组映射每次运行只建一次：提取只改写成员文件内容，不改变哪些 section 属于同一文件
+    merge_map = _build_merge_maps()
     streaming_path = SURGE_DIR / "Streaming.list"
+    part_cache: dict[str, list[str] | None] = {}
+    moves: list[tuple[str, str, str]] = []
 
     def rel(p: Path) -> str:
         return p.relative_to(REPO_ROOT).as_posix()
 
+    def record_down(src: Path, moved: list[tuple[str, str]]) -> None:
+        moves.extend((sec, src.name, f"{stem}.list") for sec, stem in moved)
+
+    def record_up(dst: Path, stems: list[str]) -> None:
+        for stem in stems:
+            meta = RULE_INDEX.get(SURGE_DIR / f"{stem}.list")
+            for sec in (meta.sections if meta else []) or [stem]:
+                moves.append((sec, f"{stem}.list", dst.name))
+
     all_stems = sorted(set().union(*placeholders.values()))
 
     # 各地区合集元信息
@@ -265,7 +551,7 @@ def sync_streaming() -> None:
     # ── 阶段一：将"被直接编辑的上层合集"落实到独立子项 ──────────────────
     if streaming_changed and not member_changed and not any_reg_changed:
         print("  [方向] 总合集 → 独立子项")
-        _extract_streaming(streaming_path, placeholders)
+        record_down(streaming_path, _extract_streaming(streaming_path, placeholders, merge_map))
     else:
         for name, (path, stems, region) in regionals.items():
             existing = [s for s in stems if (SURGE_DIR / f"{s}.list").exists()]
@@ -274,75 +560,81 @@ def sync_streaming() -> None:
             if not existing:
                 # 首次运行：从地区合集提取独立子项
                 print(f"  [首次] {name} → 独立子项")
-                _extract_regional(path, name, stems, region)
+                record_down(path, _extract_regional(path, name, stems, region, merge_map))
             elif regional_changed and not this_member_changed:
                 print(f"  [方向] {name} → 独立子项")
-                _extract_regional(path, name, existing, region)
+                record_down(path, _extract_regional(path, name, existing, region, merge_map))
 
     # ── 阶段二：从独立子项重建所有地区合集 ──────────────────────────────
     for name, (path, stems, _region) in regionals.items():
         existing = [s for s in stems if (SURGE_DIR / f"{s}.list").exists()]
         if existing:
-            _rebuild_regional(path, name, existing)
+            record_up(path, _rebuild_regional(path, name, existing, state, part_cache))
 
     # ── 阶段三：从独立子项重建总合集 ────────────────────────────────────
-    parts = []
-    for stem in all_stems:
-        content = read_standalone(stem)
-        if content is None:
-            continue
-        text = strip_streaming_placeholders(content).strip()
-        if text:
-            parts.append(text)
-    if not parts:
+    updated, stems_changed = _rebuild_aggregate(streaming_path, all_stems, state, part_cache)
+    if updated is None:
         print("  [WARN] 无成员文件，跳过总合集重建")
-        return
-    result = "\n\n".join(parts) + "\n"
-    if write_if_changed(streaming_path, result):
+    elif updated:
         print("  ✓ Streaming.list 已重建")
+        record_up(streaming_path, stems_changed)
     else:
         print("  ✓ Streaming.list 无变化")
 
+    files = _streaming_files()
+    state_text = json.dumps({"aggregates": dict(sorted(state.items())),
+                             "snapshot": {rel(m.path): m.sha256 for m in files},
+                             "stamps": {rel(m.path): list(m.stamp) for m in files}},
+                            indent=1, ensure_ascii=False) + "\n"
+    write_if_changed(STREAMING_STATE, state_text)
+    _print_streaming_report(moves)
+    return moves
+
 
 def _inject_placeholder(lines: list[str], region: str) -> list[str]:
     """在 lines 的第一个 '# > Name' 行之后插入 '### Streaming REGION'（若尚不存在）。"""
     placeholder = f"### Streaming {region}"
-    if any(STREAMING_PLACEHOLDER_RE.match(l.strip()) for l in lines):
+    if any(is_streaming_placeholder(l.strip()) for l in lines):
         return lines
     result = []
     inserted = False
     for line in lines:
         result.append(line)
-        if not inserted and re.match(r"^#\s*>\s*(.+)$", line.strip()):
+        if not inserted and section_header(line.strip()) is not None:
             result.append(placeholder)
             inserted = True
     return result
 
 
-def _extract_regional(regional_path: Path, regional_name: str, members: list[str], region: str):
-    """地区合集 → 独立子项。"""
+def _extract_regional(regional_path: Path, regional_name: str, members: list[str],
+                      region: str, merge_map: dict[str, str]) -> list[tuple[str, str]]:
+    """地区合集 → 独立子项。返回实际改写的 [(section, stem)]。"""
     text = regional_path.read_text(encoding="utf-8")
     sections = parse_sections(text)
 
     # 收集每个成员文件应得的 sections
     file_contents: dict[str, list[str]] = {}
+    file_sections: dict[str, list[str]] = defaultdict(list)
     found_files: set[str] = set()
 
     for sec_name, lines in sections.items():
-        stem = section_name_to_file(sec_name)
+        stem = section_name_to_file(sec_name, merge_map)
         found_files.add(stem)
+        file_sections[stem].append(sec_name)
         if stem not in file_contents:
             file_contents[stem] = []
         else:
             file_contents[stem].append("")  # 合并组之间空行
         file_contents[stem].extend(lines)
 
+    moved: list[tuple[str, str]] = []
     for stem, lines in file_contents.items():
         lines = _inject_placeholder(lines, region)
         content = "\n".join(lines) + "\n"
         path = SURGE_DIR / f"{stem}.list"
         if write_if_changed(path, content):
             print(f"  ✓ {regional_name} → {stem}.list")
+            moved.extend((sec, stem) for sec in file_sections[stem])
 
     # 删除不再存在的成员
     for m in members:
@@ -351,35 +643,156 @@ def _extract_regional(regional_path: Path, regional_name: str, members: list[str
             if mp.exists():
                 mp.unlink()
                 print(f"  ✗ 删除 {m}.list（已从 {regional_name} 移除）")
+    return moved
 
 
-def _rebuild_regional(regional_path: Path, regional_name: str, members: list[str]):
-    """独立子项 → 重建地区合集。"""
-    parts = []
-    for m in members:
-        content = read_standalone(m)
-        if content is None:
-            continue
-        text = strip_streaming_placeholders(content).strip()
-        if text:
-            parts.append(text)
+def _member_part(stem: str) -> list[str] | None:
+    """独立子项在合集中的段：去占位符、去首尾空白后的行；文件不存在返回 None。"""
+    content = read_standalone(stem)
+    if content is None:
+        return None
+    text = strip_streaming_placeholders(content).strip()
+    return text.split("\n") if text else []
 
-    if parts:
-        result = "\n\n".join(parts) + "\n"
-        if write_if_changed(regional_path, result):
-            print(f"  ✓ 独立子项 → {regional_name}.list")
+
+def _rebuild_aggregate(path: Path, members: list[str], state: dict[str, dict],
+                       part_cache: dict[str, list[str] | None]) -> tuple[bool | None, list[str]]:
+    """按成员重建合集：'\n\n'.join(各成员段) + '\n'（空段跳过）。
+
+    state[path.name] 为上次写出该合集时记录的状态。变动按 RULE_INDEX 判定：stamp 未变的
+    文件沿用已知 hash（见 RuleSetIndex.remember），不读内容。合集 hash 与状态相符且
+    成员列表未变时，成员都未变动则什么都不读、不写；否则 hash 未变的成员沿用现有合集
+    里的对应行，只重读、替换变动成员的段。
+    返回 (无成员时 None / 是否改写了合集, 段有变动的成员 stems)。
+    """
+    prev = state.get(path.name)
+    metas = [(stem, meta) for stem in members
+             if (meta := RULE_INDEX.get(SURGE_DIR / f"{stem}.list")) is not None]
+    prev_hashes = {m[0]: m[1] for m in (prev or {}).get("members", [])}
+    stale = [stem for stem, meta in metas if prev_hashes.get(stem) != meta.sha256]
+
+    agg = RULE_INDEX.get(path)
+    intact = (prev is not None and agg is not None and prev.get("hash") == agg.sha256
+              and [m[0] for m in prev["members"]] == [stem for stem, _ in metas])
+    if intact and not stale:
+        return (False if any(m[2] for m in prev["members"]) else None), []
+
+    old_spans: dict[str, list[str]] = {}
+    if intact:
+        old_lines = path.read_text(encoding="utf-8")[:-1].split("\n")
+        pos = 0
+        for stem, _member_hash, n in prev["members"]:
+            old_spans[stem] = old_lines[pos:pos + n]
+            if n:
+                pos += n + 1  # 段间空行
+
+    parts: list[list[str]] = []
+    state_members: list[list] = []
+    for stem, meta in metas:
+        lines = old_spans.get(stem) if stem not in stale else None
+        if lines is None:
+            if stem not in part_cache:
+                part_cache[stem] = _member_part(stem)
+            lines = part_cache[stem] or []
+        parts.append(lines)
+        state_members.append([stem, meta.sha256, len(lines)])
+
+    texts = ["\n".join(lines) for lines in parts if lines]
+    if not texts:
+        return None, []
+    data = ("\n\n".join(texts) + "\n").encode("utf-8")
+    updated = write_if_changed(path, data)
+    st = path.stat()
+    sha = hashlib.sha256(data).hexdigest()
+    RULE_INDEX.remember(path, (st.st_mtime_ns, st.st_size), sha)
+    state[path.name] = {"members": state_members, "hash": sha}
+    return updated, stale
+
+
+def _rebuild_regional(regional_path: Path, regional_name: str, members: list[str],
+                      state: dict[str, dict], part_cache: dict[str, list[str] | None]) -> list[str]:
+    """独立子项 → 重建地区合集（只替换变动成员的段）。返回段有变动的成员 stems。"""
+    updated, changed = _rebuild_aggregate(regional_path, members, state, part_cache)
+    if not updated:
+        return []  # 无成员或合集内容未变：没有 section 移动
+    print(f"  ✓ 独立子项 → {regional_name}.list")
+    return changed
+
+
+def _load_streaming_state() -> tuple[dict[str, dict], dict[str, str] | None]:
+    """返回 (各合集状态, 上次运行结束时的文件 hash 快照 | 无快照时 None)。
+
+    快照里 stamp（mtime / size）未变的文件交给 RULE_INDEX 沿用其 hash，不再重读。
+    """
+    try:
+        doc = json.loads(STREAMING_STATE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}, None
+    snapshot = doc.get("snapshot")
+    for p, stamp in doc.get("stamps", {}).items():
+        if snapshot and p in snapshot:
+            RULE_INDEX.remember(REPO_ROOT / p, tuple(stamp), snapshot[p])
+    return doc.get("aggregates", {}), snapshot
+
+
+def _streaming_files() -> list[RuleFileMeta]:
+    """合集与各成员（含占位符的文件）。"""
+    return [meta for meta in RULE_INDEX.files()
+            if meta.path.stem.startswith("Streaming") or meta.placeholder is not None]
+
+
+def _streaming_snapshot() -> dict[str, str]:
+    """合集与各成员的内容 hash，供下次运行判断改动方向。"""
+    return {meta.path.relative_to(REPO_ROOT).as_posix(): meta.sha256 for meta in _streaming_files()}
+
+
+def _print_streaming_report(moves: list[tuple[str, str, str]]) -> None:
+    """按 (来源 → 目标) 汇总本次移动的 section。"""
+    grouped: dict[tuple[str, str], list[str]] = defaultdict(list)
+    for section, src, dst in moves:
+        grouped[(src, dst)].append(section)
+    for (src, dst), sections in grouped.items():
+        print(f"  [变动] {src} → {dst}: {', '.join(sections)}")
 
 
 # ═══════════════════════════════════════════════════════════════════════
 #  解析辅助
 # ═══════════════════════════════════════════════════════════════════════
 
+# ── 行分类 ──
+# 输入行以规则行为主（Phishing 等十万行级），分类函数先做首字符 / startswith 判断，
+# 只有以 '#' 开头的少数注释行才进预编译正则。
+
+def section_header(stripped: str) -> str | None:
+    """'# > Name' / '# >> Sub' 行 → 节名（SECTION_HEADER_RE 语义）；其余行 None。"""
+    if not stripped.startswith("#"):
+        return None
+    m = SECTION_HEADER_RE.match(stripped)
+    return m.group(1).strip() if m else None
+
+
+def is_streaming_placeholder(stripped: str) -> bool:
+    """'### Streaming [REGION]' 占位符行。"""
+    return stripped.startswith("###") and STREAMING_PLACEHOLDER_RE.match(stripped) is not None
+
+
+def top_section_name(stripped: str) -> str | None:
+    """仅顶层 '# > Name'（不含 '# >>' 配置 / 子节标记）→ Name；其余行 None。"""
+    if not stripped.startswith("#"):
+        return None
+    m = TOP_SECTION_RE.match(stripped)
+    return m.group(1).strip() if m else None
+
+
 def parse_and_rule(raw: str):
-    m = re.match(r"AND,\(\((.+)\)\)$", raw.strip())
+    raw = raw.strip()
+    if not raw.startswith("AND,"):
+        return None
+    m = AND_RULE_RE.match(raw)
     if not m:
         return None
     inner = m.group(1)
-    parts = re.split(r"\),\s*\(", inner)
+    parts = AND_SPLIT_RE.split(inner)
     sub_rules = []
     for p in parts:
         p = p.strip().strip("()")
@@ -430,127 +843,274 @@ def _split_inline_comment(rule: str) -> tuple[str, str]:
     return rule[:idx].rstrip().rstrip(","), rule[idx + 2:].strip()
 
 
-def _emit_with_prelude(
-    out: list[str],
-    line: str,
-    ps: PendingSection,
-    pending_blank: bool,
-    head_guard: int = 0,
-) -> bool:
-    """真正 emit 时统一处理：空行分隔 + flush pending section/sub + 追加 line。
-    返回新的 pending_blank (总是 False)。head_guard 指 out 初始非空内容行数
-    （Clash 的 'payload:' 为 1，QX 为 0），用于避免紧跟头插入空行。
-    """
-    if pending_blank and len(out) > head_guard:
-        out.append("")
-    out.extend(ps.flush())
-    out.append(line)
-    return False
+_NO_FLAGS: tuple[str, ...] = ()
 
 
-def convert_qx(lines: list[str], policy: str) -> str:
-    out: list[str] = []
-    ps = PendingSection()
-    pending_blank = False
+class Rule:
+    """一条已解析的 Surge 规则，由 parse_rule 一次拆分、各目标 emitter 共用。
 
+    type 为规则类型（sys.intern：同类型共享同一 str 对象，十万行级文件不再每行各持
+    一份，QX_SKIP / SINGBOX_MAP 等查表也先走身份比较）；value 为首个参数（无逗号的
+    行为 None）；flags 为其余参数元组（如 ("no-resolve",)，同样 intern）；inline 为
+    行内 // 注释；text 为原始行（已 strip），body 为去掉行内注释后的规则体。
+    """
+
+    __slots__ = ("type", "value", "flags", "inline", "text", "body")
+
+    def __init__(self, rule_type: str, value: str | None, flags: tuple[str, ...],
+                 inline: str, text: str, body: str) -> None:
+        self.type = rule_type
+        self.value = value
+        self.flags = flags
+        self.inline = inline
+        self.text = text
+        self.body = body
+
+    @property
+    def canonical(self) -> str:
+        """各字段去首尾空白后以 ',' 重新拼接（Clash payload 即此形式）。"""
+        if self.value is None:
+            return self.type
+        if not self.flags:
+            return f"{self.type},{self.value}"
+        return ",".join((self.type, self.value, *self.flags))
+
+
+def parse_rule(stripped: str) -> Rule:
+    """已 strip 的规则行 → Rule（行内 // 注释拆出，字段按 ',' 拆分并去首尾空白）。"""
+    body, inline = _split_inline_comment(stripped)
+    head, sep, rest = body.partition(",")
+    rule_type = sys.intern(head.strip())
+    if not sep:
+        return Rule(rule_type, None, _NO_FLAGS, inline, stripped, body)
+    if "," not in rest:
+        return Rule(rule_type, rest.strip(), _NO_FLAGS, inline, stripped, body)
+    value, *flags = rest.split(",")
+    return Rule(rule_type, value.strip(), tuple(sys.intern(f.strip()) for f in flags),
+                inline, stripped, body)
+
+
+def _tokenize_surge(lines: Iterable[str]):
+    """Surge RULE-SET 行 → 类型化 token 流（QX / Clash / CIDR 伴生共用一次解析）。
+
+    token 为元组，首元素为种类：
+      ("blank",)                       空行
+      ("sub", stripped)                '# >> Sub'
+      ("section", stripped)            '# > Section'
+      ("slash", text)                  '// text'（text 已去 // 与首尾空白）
+      ("comment", stripped)            其余 # 注释
+      ("rule", Rule)                   规则行（见 parse_rule）
+    ### Streaming 占位符不产出 token（各目标均跳过）。
+    """
     for line in lines:
         stripped = line.strip()
+        if not stripped:
+            yield _TOK_BLANK
+        elif stripped.startswith("# >>"):
+            yield ("sub", stripped)
+        elif stripped.startswith("# >"):
+            yield ("section", stripped)
+        elif stripped.startswith("//"):
+            yield ("slash", stripped[2:].strip())
+        elif stripped.startswith("#"):
+            if not is_streaming_placeholder(stripped):
+                yield ("comment", stripped)
+        else:
+            yield ("rule", parse_rule(stripped))
+
+
+_TOK_BLANK = ("blank",)
+
+
+class _SectionedEmitter:
+    """QX / Clash emitter 共用部分：经 sink 逐行输出（sink 可为 list.append 或
+    流式写入器的 write），'# > Section' / '# >> Sub' 头与空行分隔缓冲到真有规则
+    emit 时才刷出。"""
+
+    __slots__ = ("sink", "ps", "pending_blank", "started", "rules")
+
+    def __init__(self, sink: Callable[[str], None]) -> None:
+        self.sink = sink
+        self.ps = PendingSection()
+        self.pending_blank = False
+        self.started = False  # 是否已输出内容行（Clash 的 'payload:' 头不算）
+        self.rules = 0        # 已输出规则条数（运行报告用）
+
+    def _emit(self, line: str) -> None:
+        """真正 emit 时统一处理：空行分隔（紧跟文件头时不插）+ flush pending
+        section/sub + 输出 line。"""
+        sink = self.sink
+        if self.pending_blank and self.started:
+            sink("")
+        for header in self.ps.flush():
+            sink(header)
+        sink(line)
+        self.pending_blank = False
+        self.started = True
+
+
+class _QxEmitter(_SectionedEmitter):
+    """消费 _tokenize_surge token，逐行输出 QX filter。"""
+
+    __slots__ = ("policy",)
+
+    def __init__(self, policy: str, sink: Callable[[str], None]) -> None:
+        super().__init__(sink)
+        self.policy = policy
+
+    def feed(self, tok: tuple) -> None:
+        kind = tok[0]
+        if kind == "rule":
+            rule = tok[1]
+            rule_type = rule.type
+            if rule_type in QX_SKIP:
+                return
+
+            value = rule.value or ""
+            no_resolve = bool(rule.flags) and rule.flags[0].lower() == "no-resolve"
+
+            if rule_type in ("IP-CIDR", "IP-CIDR6", "IP6-CIDR", "GEOIP", "IP-ASN"):
+                # QX uses IP6-CIDR instead of Surge/Clash's IP-CIDR6
+                qx_type = "IP6-CIDR" if rule_type == "IP-CIDR6" else rule_type
+                suffix = ",no-resolve" if no_resolve else ""
+                rule_line = f"{qx_type},{value},{self.policy}{suffix}"
+            elif rule_type in ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"):
+                rule_line = f"{rule_type},{value},{self.policy}"
+            elif value:
+                rule_line = f"{rule_type},{value},{self.policy}"
+            else:
+                return
+
+            if rule.inline:
+                rule_line = f"{rule_line}  // {rule.inline}"
+            self._emit(rule_line)
+            self.rules += 1
+        elif kind == "blank":
+            self.pending_blank = True
+        elif kind == "sub":
+            self.ps.push_sub(tok[1])
+        elif kind == "section":
+            self.ps.push_section(tok[1])
+        elif kind == "slash":
+            self._emit(f"# {tok[1]}")
+        else:
+            self._emit(tok[1])
 
-        if is_blank(line):
-            pending_blank = True
-            continue
-        if stripped.startswith("# >>"):
-            ps.push_sub(stripped)
-            continue
-        if stripped.startswith("# >"):
-            ps.push_section(stripped)
-            continue
-        if stripped.startswith("//"):
-            pending_blank = _emit_with_prelude(out, f"# {stripped[2:].strip()}", ps, pending_blank)
-            continue
-        if STREAMING_PLACEHOLDER_RE.match(stripped):
-            continue
-        if stripped.startswith("#"):
-            pending_blank = _emit_with_prelude(out, stripped, ps, pending_blank)
-            continue
+    def finish(self) -> None:
+        if not self.started:
+            self.sink("")  # 空产物仍输出单个换行
 
-        body, inline = _split_inline_comment(stripped)
-        parts = [p.strip() for p in body.split(",")]
-        rule_type = parts[0] if parts else ""
-        if rule_type in QX_SKIP:
-            continue
 
-        value = parts[1] if len(parts) > 1 else ""
-        no_resolve = len(parts) > 2 and parts[2].lower() == "no-resolve"
-
-        if rule_type in ("IP-CIDR", "IP-CIDR6", "IP6-CIDR", "GEOIP", "IP-ASN"):
-            # QX uses IP6-CIDR instead of Surge/Clash's IP-CIDR6
-            qx_type = "IP6-CIDR" if rule_type == "IP-CIDR6" else rule_type
-            suffix = ",no-resolve" if no_resolve else ""
-            rule_line = f"{qx_type},{value},{policy}{suffix}"
-        elif rule_type in ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"):
-            rule_line = f"{rule_type},{value},{policy}"
-        elif value:
-            rule_line = f"{rule_type},{value},{policy}"
+class _ClashEmitter(_SectionedEmitter):
+    """消费 _tokenize_surge token，逐行输出 Clash classical payload。
+
+    sb 非空时每条 emit 的规则同步喂给 sing-box 收集器；seen 非空时记录
+    已 emit 规则串（供 process_file 判断 preserve 规则是否重复）。
+    """
+
+    __slots__ = ("sb", "seen")
+
+    def __init__(self, sink: Callable[[str], None],
+                 sb: "_SingboxCollector | None" = None,
+                 seen: set[str] | None = None) -> None:
+        super().__init__(sink)
+        self.sb = sb
+        self.seen = seen
+        sink("payload:")
+
+    def feed(self, tok: tuple) -> None:
+        kind = tok[0]
+        if kind == "rule":
+            rule = tok[1]
+            rule_type = rule.type
+            if rule_type in CLASH_SKIP:
+                return
+
+            if rule_type == "AND":
+                sub_rules = parse_and_rule(rule.body) or []
+                if any(st in CLASH_SKIP for st, sv in sub_rules):
+                    return
+
+            rule_line = f"  - {rule.canonical}"
+            if rule.inline:
+                rule_line = f"{rule_line}  # {rule.inline}"
+            self._emit(rule_line)
+            self.rules += 1
+            if self.seen is not None:
+                self.seen.add(rule_line.strip()[2:].strip())
+            if self.sb is not None:
+                self.sb.add_rule(rule)
+        elif kind == "blank":
+            self.pending_blank = True
+        elif kind == "sub":
+            self.ps.push_sub(f"  {tok[1]}")
+        elif kind == "section":
+            self.ps.push_section(f"  {tok[1]}")
+        elif kind == "slash":
+            self._emit(f"  # {tok[1]}")
         else:
-            continue
+            self._emit(f"  {tok[1]}")
 
-        if inline:
-            rule_line = f"{rule_line}  // {inline}"
+    def finish(self) -> None:
+        pass
 
-        pending_blank = _emit_with_prelude(out, rule_line, ps, pending_blank)
 
-    while out and not out[-1].strip():
-        out.pop()
-    return "\n".join(out) + "\n"
+class _CidrEmitter:
+    """消费 _tokenize_surge token，收集 IP-CIDR 值（需排序去重，故整体缓冲）。"""
 
+    __slots__ = ("cidrs",)
 
-def convert_clash(lines: list[str]) -> str:
-    out: list[str] = ["payload:"]
-    ps = PendingSection()
-    pending_blank = False
+    def __init__(self) -> None:
+        self.cidrs: list[str] = []
+
+    def feed(self, tok: tuple) -> None:
+        if tok[0] == "rule":
+            rule = tok[1]
+            if rule.value is None:
+                if "/" in rule.text:
+                    self.cidrs.append(rule.text)  # 纯 CIDR 行（无规则类型前缀），同 _cidr_of
+            elif rule.type.upper() in _CIDR_RULE_TYPES:
+                self.cidrs.append(rule.value)
+
+    def finish(self) -> None:
+        pass
 
-    for line in lines:
-        stripped = line.strip()
+    def render(self) -> str | None:
+        return _render_ipcidr_payload(self.cidrs)
 
-        if is_blank(line):
-            pending_blank = True
-            continue
-        if stripped.startswith("# >>"):
-            ps.push_sub(f"  {stripped}")
-            continue
-        if stripped.startswith("# >"):
-            ps.push_section(f"  {stripped}")
-            continue
-        if stripped.startswith("//"):
-            pending_blank = _emit_with_prelude(out, f"  # {stripped[2:].strip()}", ps, pending_blank, head_guard=1)
-            continue
-        if STREAMING_PLACEHOLDER_RE.match(stripped):
-            continue
-        if stripped.startswith("#"):
-            pending_blank = _emit_with_prelude(out, f"  {stripped}", ps, pending_blank, head_guard=1)
-            continue
 
-        body, inline = _split_inline_comment(stripped)
-        parts = [p.strip() for p in body.split(",")]
-        rule_type = parts[0] if parts else ""
-        if rule_type in CLASH_SKIP:
-            continue
+def _drive(emitter, tokens, buf: list[str]):
+    """单 emitter 驱动为生成器：每个 token 喂完即把 buf（emitter 的 sink）中的行
+    yield 出去并清空，内存只随单个 token 的输出量增长。"""
+    yield from buf  # 构造时即输出的文件头（Clash 'payload:'）
+    buf.clear()
+    for tok in tokens:
+        emitter.feed(tok)
+        if buf:
+            yield from buf
+            buf.clear()
+    emitter.finish()
+    yield from buf
 
-        if rule_type == "AND":
-            sub_rules = parse_and_rule(body) or []
-            if any(st in CLASH_SKIP for st, sv in sub_rules):
-                continue
 
-        rule_line = f"  - {','.join(parts)}"
-        if inline:
-            rule_line = f"{rule_line}  # {inline}"
+def iter_qx(lines: Iterable[str], policy: str):
+    """Surge RULE-SET → QX filter，逐行 yield（不含换行符）。"""
+    buf: list[str] = []
+    return _drive(_QxEmitter(policy, buf.append), _tokenize_surge(lines), buf)
 
-        pending_blank = _emit_with_prelude(out, rule_line, ps, pending_blank, head_guard=1)
 
-    while out and not out[-1].strip():
-        out.pop()
-    return "\n".join(out) + "\n"
+def iter_clash(lines: Iterable[str]):
+    """Surge RULE-SET → Clash classical payload，逐行 yield（不含换行符）。"""
+    buf: list[str] = []
+    return _drive(_ClashEmitter(buf.append), _tokenize_surge(lines), buf)
+
+
+def convert_qx(lines: list[str], policy: str) -> str:
+    return "\n".join(iter_qx(lines, policy)) + "\n"
+
+
+def convert_clash(lines: list[str]) -> str:
+    return "\n".join(iter_clash(lines)) + "\n"
 
 
 _SINGBOX_TYPE_ORDER = [
@@ -567,143 +1127,452 @@ def _groups_to_singbox_rules(
     rules: list[dict] = []
     for key in _SINGBOX_TYPE_ORDER:
         if key in groups:
-            rules.append({key: sorted(set(groups[key]))})
+            values = groups[key]
+            rules.append({key: collapse_cidrs(values) if key == "ip_cidr" else sorted(set(values))})
     if logical_rules:
         rules.extend(logical_rules)
     return rules
 
 
-def convert_qx_domainset(lines: list[str], policy: str) -> str:
-    """DOMAIN-SET 文件 → QX filter（QX 无 domain-set 概念，展开为带类型的规则行）：
-    `.foo` →（含自身与子域）DOMAIN-SUFFIX,foo,policy；裸域名 → DOMAIN,foo,policy。"""
-    out: list[str] = []
+def _tokenize_domainset(lines: Iterable[str]):
+    """DOMAIN-SET 行 → token 流：("comment", s) / ("suffix", 去点域名) / ("domain", s)。"""
     for line in lines:
         s = line.strip()
         if not s:
             continue
         if s.startswith("#"):
-            out.append(s)
+            yield ("comment", s)
         elif s.startswith("."):
-            out.append(f"DOMAIN-SUFFIX,{s[1:]},{policy}")
+            yield ("suffix", s[1:])
         else:
-            out.append(f"DOMAIN,{s},{policy}")
-    return "\n".join(out) + "\n"
+            yield ("domain", s)
 
 
-def convert_clash_domainset(lines: list[str]) -> str:
-    """DOMAIN-SET 文件 → Clash domain-behavior payload：`.foo` → '+.foo'，裸域名原样。"""
-    out = ["payload:"]
-    for line in lines:
-        s = line.strip()
-        if not s:
-            continue
-        if s.startswith("#"):
-            out.append(f"  {s}")
-        elif s.startswith("."):
-            out.append(f"  - '+.{s[1:]}'")
+class _QxDomainsetEmitter:
+    """DOMAIN-SET token → QX filter（QX 无 domain-set 概念，展开为带类型的规则行）：
+    `.foo` →（含自身与子域）DOMAIN-SUFFIX,foo,policy；裸域名 → DOMAIN,foo,policy。"""
+
+    __slots__ = ("policy", "sink", "started", "rules")
+
+    def __init__(self, policy: str, sink: Callable[[str], None]) -> None:
+        self.policy = policy
+        self.sink = sink
+        self.started = False
+        self.rules = 0
+
+    def feed(self, tok: tuple) -> None:
+        kind, v = tok
+        if kind == "comment":
+            self.sink(v)
         else:
-            out.append(f"  - {s}")
-    return "\n".join(out) + "\n"
+            if kind == "suffix":
+                self.sink(f"DOMAIN-SUFFIX,{v},{self.policy}")
+            else:
+                self.sink(f"DOMAIN,{v},{self.policy}")
+            self.rules += 1
+        self.started = True
+
+    def finish(self) -> None:
+        if not self.started:
+            self.sink("")  # 空产物仍输出单个换行
+
+
+class _ClashDomainsetEmitter:
+    """DOMAIN-SET token → Clash domain-behavior payload：`.foo` → '+.foo'，裸域名原样。
+    mrs 非 None 时同时收集 payload 规则串（供 write_mrs）。"""
+
+    __slots__ = ("sink", "sb", "mrs", "rules")
+
+    def __init__(self, sink: Callable[[str], None],
+                 sb: "_SingboxCollector | None" = None, mrs: list[str] | None = None) -> None:
+        self.sink = sink
+        self.sb = sb
+        self.mrs = mrs
+        self.rules = 0
+        sink("payload:")
+
+    def feed(self, tok: tuple) -> None:
+        kind, v = tok
+        if kind == "comment":
+            self.sink(f"  {v}")
+            return
+        line = f"  - '+.{v}'" if kind == "suffix" else f"  - {v}"
+        self.sink(line)
+        self.rules += 1
+        if self.sb is not None:
+            self.sb.add_payload_line(line)
+        if self.mrs is not None:
+            self.mrs.append(f"+.{v}" if kind == "suffix" else v)
+
+    def finish(self) -> None:
+        pass
+
+
+def iter_qx_domainset(lines: Iterable[str], policy: str):
+    """DOMAIN-SET 文件 → QX filter，逐行 yield（见 _QxDomainsetEmitter）。"""
+    buf: list[str] = []
+    return _drive(_QxDomainsetEmitter(policy, buf.append), _tokenize_domainset(lines), buf)
+
+
+def iter_clash_domainset(lines: Iterable[str]):
+    """DOMAIN-SET 文件 → Clash domain-behavior payload，逐行 yield（见 _ClashDomainsetEmitter）。"""
+    buf: list[str] = []
+    return _drive(_ClashDomainsetEmitter(buf.append), _tokenize_domainset(lines), buf)
+
+
+def convert_qx_domainset(lines: list[str], policy: str) -> str:
+    """DOMAIN-SET 文件 → QX filter（见 _QxDomainsetEmitter）。"""
+    return "\n".join(iter_qx_domainset(lines, policy)) + "\n"
+
+
+def convert_clash_domainset(lines: list[str]) -> str:
+    """DOMAIN-SET 文件 → Clash domain-behavior payload（见 _ClashDomainsetEmitter）。"""
+    return "\n".join(iter_clash_domainset(lines)) + "\n"
 
 
 def convert_domain_payload_to_singbox(text: str) -> str | None:
     """Clash domain-behavior payload → sing-box JSON（domain / domain_suffix）。"""
-    groups: dict[str, list[str]] = {}
+    sb = _SingboxCollector(domain=True)
     for line in _iter_clash_payload_rules(text):
-        if line.startswith("#") or line.startswith("//"):
-            continue
-        v = line.strip().strip("'\"")
-        if not v:
-            continue
-        if v.startswith("+."):
-            groups.setdefault("domain_suffix", []).append(v[2:])
-        else:
-            groups.setdefault("domain", []).append(v)
-    if not groups:
-        return None
-    rules = _groups_to_singbox_rules(groups)
-    return json.dumps({"version": 2, "rules": rules}, indent=2, ensure_ascii=False) + "\n"
+        sb.add(line)
+    return sb.render()
+
+
+def _iter_source_lines(path: Path):
+    """逐行读取源文件（不整文件读入）；行切分与 read_text().splitlines() 一致
+    （\\x0b / \\x1c / \\u2028 等 splitlines 也认作换行的字符同样切开）。"""
+    with open(path, encoding="utf-8") as f:
+        for raw in f:
+            parts = raw.splitlines()
+            if len(parts) == 1:
+                yield parts[0]
+            else:
+                yield from parts or ("",)
+
+
+_CIDR_RULE_TYPES = ("IP-CIDR", "IP-CIDR6", "IP6-CIDR")
+
+
+class _CidrRunCollapser:
+    """包装 _tokenize_surge token 流，就地聚合 IP-CIDR 规则（重叠 / 相邻前缀合并）。
+
+    只在一段连续规则行内聚合：任何非规则 token（注释 / '# >' 段头 / // / 空行）
+    都截断当前段，手工注释标注的条目不会被并入别处、其注释也不会被掏空。段内按
+    (类型（不分大小写，与各 emitter 一致）, 地址族, 附加参数) 分组，合并后的前缀
+    落在其成员中最靠前的位置并沿用该行的类型写法，其余成员丢弃；带行内注释的
+    规则不参与。before / after 为参与聚合的前后条数。
+    """
+
+    __slots__ = ("before", "after")
+
+    def __init__(self) -> None:
+        self.before = 0
+        self.after = 0
+
+    def apply(self, tokens: Iterable[tuple]):
+        run: list[tuple] = []
+        for tok in tokens:
+            if tok[0] == "rule":
+                run.append(tok)
+                continue
+            if run:
+                yield from self._collapse(run)
+                run = []
+            yield tok
+        if run:
+            yield from self._collapse(run)
+
+    def _collapse(self, run: list[tuple]) -> list[tuple]:
+        groups: dict[tuple, list[tuple[int, ipaddress.IPv4Network | ipaddress.IPv6Network]]] = defaultdict(list)
+        for i, (_, rule) in enumerate(run):
+            rule_type = rule.type.upper()
+            if rule_type not in _CIDR_RULE_TYPES or rule.value is None or rule.inline:
+                continue
+            net = _parse_network(rule.value)
+            if net is not None:
+                groups[(rule_type, net.version, rule.flags)].append((i, net))
+
+        out: list[tuple | None] = list(run)
+        for members in groups.values():
+            merged = list(ipaddress.collapse_addresses(net for _, net in members))
+            self.before += len(members)
+            self.after += len(merged)
+            if len(merged) == len(members):
+                continue  # 无重叠 / 相邻（collapse 只会减少条数）
+            # 合并结果互不相交且有序：按起始地址二分找到每个成员所属的合并前缀
+            starts = [m.network_address for m in merged]
+            owner: dict[int, list[int]] = defaultdict(list)
+            for i, net in members:
+                owner[bisect.bisect_right(starts, net.network_address) - 1].append(i)
+            for k, idxs in owner.items():
+                first, *rest = sorted(idxs)
+                rule = run[first][1]
+                if rest or str(merged[k]) != rule.value:
+                    out[first] = ("rule", parse_rule(",".join((rule.type, str(merged[k]), *rule.flags))))
+                    for i in rest:
+                        out[i] = None
+        return [tok for tok in out if tok is not None]
 
 
 def process_file(surge_file: Path, clash_override: set[str] | None = None,
                  domainset_stems: set[str] | None = None) -> int:
-    text = surge_file.read_text(encoding="utf-8")
-    lines = text.splitlines()
+    """单文件 Step 4：逐行读源、一次解析产出 token 流，同时喂给 QX / Clash / CIDR
+    伴生 / sing-box 各目标 emitter；QX / Clash 产物经 open_if_changed 边生成边写，
+    全程不持有源文本或整段输出（sing-box 需排序去重，收集器除外）。sing-box 由
+    Clash emit 出的规则串驱动，与「从最终 Clash YAML 派生」等价。"""
     stem = surge_file.stem                                           # 文件名，用作输出文件名及 QX policy
     rel  = str(surge_file.relative_to(SURGE_DIR).with_suffix(""))  # 含子目录，用于 clash_override 匹配
     updated = 0
+    t0 = time.perf_counter()
+    w0, f0 = RUN_STATS.bytes_written, RUN_STATS.files_written
     # sync-rules.txt # >> Clash 条目已由 Step 1 直接写入 Clash/sing-box，跳过自动转换
     skip_clash_singbox = clash_override is not None and rel in clash_override
     # sync-rules.txt # >> Surge Domain-Set 条目：镜像保持 DOMAIN-SET 原格式，按 domain 语义派生
     is_domainset = domainset_stems is not None and stem in domainset_stems
 
-    # QX / Clash / sing-box 输出全部摊平（不保留子目录结构）
-    qx_content = (convert_qx_domainset if is_domainset else convert_qx)(lines, stem)
-    if write_if_changed(QX_DIR / f"{stem}.list", qx_content):
-        print(f"    ✓ QX:      {stem}.list")
-        updated += 1
+    preserved: list[tuple[str, str]] = []
+    if not skip_clash_singbox and not is_domainset:
+        # 读取现有 Clash YAML 中手动添加的 Clash 专属规则（PROCESS-NAME / PROCESS-NAME-REGEX）
+        preserved = _extract_preserved_clash_rules(CLASH_DIR / f"{stem}.yaml")
 
-    if not skip_clash_singbox:
+    # QX / Clash / sing-box 输出全部摊平（不保留子目录结构）
+    sb = clash_w = cidr = collapser = None
+    mrs_rules: list[str] = []  # domainset 的 Clash payload 规则串（→ .mrs）
+    with contextlib.ExitStack() as stack:
+        qx_w = stack.enter_context(open_if_changed(QX_DIR / f"{stem}.list"))
+        if not skip_clash_singbox:
+            clash_w = stack.enter_context(open_if_changed(CLASH_DIR / f"{stem}.yaml"))
+        seen: set[str] | None = None
         if is_domainset:
             # domain-behavior payload：纯域名，无 Clash 专属 preserve / CIDR 伴生可言
-            clash_body = convert_clash_domainset(lines)
+            tokens = _tokenize_domainset(_iter_source_lines(surge_file))
+            rule_kinds = ("suffix", "domain")
+            emitters = [_QxDomainsetEmitter(stem, qx_w.write)]
+            if clash_w is not None:
+                sb = _SingboxCollector(domain=True)
+                emitters.append(_ClashDomainsetEmitter(clash_w.write, sb, mrs_rules))
         else:
-            # 读取现有 Clash YAML 中手动添加的 Clash 专属规则（PROCESS-NAME / PROCESS-NAME-REGEX）
-            preserved = _extract_preserved_clash_rules(CLASH_DIR / f"{stem}.yaml")
-
+            # IP-CIDR 在 token 流内按连续规则段聚合，QX / Clash / 伴生 / sing-box 均基于聚合结果
+            collapser = _CidrRunCollapser()
+            tokens = collapser.apply(_tokenize_surge(_iter_source_lines(surge_file)))
+            rule_kinds = ("rule",)
+            emitters = [_QxEmitter(stem, qx_w.write)]
+            if clash_w is not None:
+                seen = set() if preserved else None
+                sb = _SingboxCollector()
+                emitters.append(_ClashEmitter(clash_w.write, sb, seen))
+                # Clash CIDR 伴生文件（如 LAN → lancidr.txt）：仅提取 IP-CIDR，输出 ipcidr payload
+                if stem in CLASH_CIDR_COMPANION:
+                    cidr = _CidrEmitter()
+                    emitters.append(cidr)
+
+        feeds = [em.feed for em in emitters]
+        rules_in = 0
+        if len(feeds) == 1:
+            feed = feeds[0]
+            for tok in tokens:
+                if tok[0] in rule_kinds:
+                    rules_in += 1
+                feed(tok)
+        else:
+            for tok in tokens:
+                if tok[0] in rule_kinds:
+                    rules_in += 1
+                for feed in feeds:
+                    feed(tok)
+        for em in emitters:
+            em.finish()
+        if collapser is not None:
+            rules_in += collapser.before - collapser.after  # 按聚合前的源条数计
+
+        clash_rules = emitters[1].rules if clash_w is not None else 0
+        if preserved:
             # Surge → Clash：只追加 Surge 源中没有的手动规则（末尾），防止重复
-            clash_body = convert_clash(lines)
-            if preserved:
-                existing = {l.strip()[2:].strip() for l in clash_body.splitlines()
-                            if l.strip().startswith("- ")}
-                extra = [(t, v) for t, v in preserved if f"{t},{v}" not in existing]
-                if extra:
-                    lines_extra = "\n".join(f"  - {t},{v}" for t, v in extra)
-                    clash_body = clash_body.rstrip("\n") + "\n" + lines_extra + "\n"
-        if write_if_changed(CLASH_DIR / f"{stem}.yaml", clash_body):
+            for t, v in preserved:
+                if f"{t},{v}" not in seen:
+                    line = f"  - {t},{v}"
+                    clash_w.write(line)
+                    sb.add_payload_line(line)
+                    clash_rules += 1
+
+    if collapser is not None and collapser.after < collapser.before:
+        print(f"    - CIDR 聚合 {collapser.before} → {collapser.after} 条")
+    if qx_w.changed:
+        print(f"    ✓ QX:      {stem}.list")
+        updated += 1
+
+    if clash_w is not None:
+        if clash_w.changed:
             print(f"    ✓ Clash:   {stem}.yaml")
             updated += 1
 
-        # Clash CIDR 伴生文件（如 LAN → lancidr.txt）：仅提取 IP-CIDR，输出 ipcidr payload
-        companion = None if is_domainset else CLASH_CIDR_COMPANION.get(stem)
-        if companion:
-            cidr_body = convert_ipcidr_to_clash(text)
+        if cidr is not None:
+            companion = CLASH_CIDR_COMPANION[stem]
+            cidr_body = cidr.render()
             if cidr_body and write_if_changed(CLASH_DIR / companion, cidr_body):
                 print(f"    ✓ Clash:   {companion}")
                 updated += 1
+            mrs_name = f"{Path(companion).stem}.mrs"
+            if cidr_body and write_mrs(CLASH_DIR / mrs_name, "ipcidr",
+                                       _iter_clash_payload_rules(cidr_body)):
+                print(f"    ✓ Clash:   {mrs_name}")
+                updated += 1
 
-        # Clash → sing-box：从最终 Clash YAML 派生，保留规则自然包含在内
-        sb_content = (convert_domain_payload_to_singbox(clash_body) if is_domainset
-                      else convert_classical_payload_to_singbox(clash_body, f"{stem}.json"))
+        if mrs_rules and write_mrs(CLASH_DIR / f"{stem}.mrs", "domain", mrs_rules):
+            print(f"    ✓ Clash:   {stem}.mrs")
+            updated += 1
+
+        # Clash → sing-box：收集器已随 Clash emit 同步累积（含保留规则）
+        sb_content = sb.render(f"{stem}.json")
         if sb_content:
             if write_if_changed(SINGBOX_DIR / f"{stem}.json", sb_content):
                 print(f"    ✓ sing-box: {stem}.json")
                 updated += 1
+            if write_srs(SINGBOX_SRS_DIR / f"{stem}.srs", sb.rules):
+                print(f"    ✓ sing-box: {stem}.srs")
+                updated += 1
 
+    REPORT.files.append({
+        "file": surge_file.relative_to(SURGE_DIR).as_posix(),
+        "seconds": round(time.perf_counter() - t0, 4),
+        "rules_in": rules_in,
+        "rules_out": {"qx": emitters[0].rules, "clash": clash_rules,
+                      "singbox": sb.emitted if sb is not None else 0},
+        "dropped": dict(sb.dropped) if sb is not None else {},
+        "bytes_written": RUN_STATS.bytes_written - w0,
+        "files_written": RUN_STATS.files_written - f0,
+    })
     return updated
 
 
-def convert_all():
-    """遍历 Surge/RULE-SET 所有 .list（含子目录），逐文件转换。"""
+def _convert_one(task: tuple[Path, set[str], set[str]]) -> tuple[str, int, dict]:
+    """进程池 worker：转换单个文件，捕获其打印日志，返回 (日志, 更新数, 计量)；
+    计量为本任务新增的 REPORT.files / dropped，由父进程 REPORT.absorb 并入。"""
+    sf, clash_override, domainset_stems = task
+    REPORT.files.clear()
+    REPORT.dropped.clear()
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        print(f"  [{sf.relative_to(SURGE_DIR)}]")
+        updated = process_file(sf, clash_override, domainset_stems)
+    return buf.getvalue(), updated, {"files": list(REPORT.files), "dropped": dict(REPORT.dropped)}
+
+
+def _converter_version() -> str:
+    """转换器版本 = 本脚本与 _common.py 源码 hash：改动转换逻辑（含共用的写出 /
+    读取辅助）即令清单全部失效，无需手动 bump。"""
+    here = Path(__file__).resolve()
+    return "+".join(sha256_file(p) or "" for p in (here, here.with_name("_common.py")))
+
+
+def _output_paths(stem: str, mode: str) -> list[Path]:
+    """process_file 可能写出的全部产物路径（按 mode：surge-only / domainset / classical）。"""
+    paths = [QX_DIR / f"{stem}.list"]
+    if mode != "surge-only":
+        paths += [CLASH_DIR / f"{stem}.yaml", SINGBOX_DIR / f"{stem}.json",
+                  SINGBOX_SRS_DIR / f"{stem}.srs"]
+        if mode == "domainset":
+            paths.append(CLASH_DIR / f"{stem}.mrs")
+        if mode == "classical" and stem in CLASH_CIDR_COMPANION:
+            companion = CLASH_CIDR_COMPANION[stem]
+            paths += [CLASH_DIR / companion, CLASH_DIR / f"{Path(companion).stem}.mrs"]
+    return paths
+
+
+def _manifest_entry(source_hash: str, version: str, stem: str, mode: str) -> dict:
+    """转换后的清单条目：记录当前存在的各产物 hash。"""
+    outputs = {}
+    for p in _output_paths(stem, mode):
+        h = sha256_file(p)
+        if h is not None:
+            outputs[p.relative_to(REPO_ROOT).as_posix()] = h
+    return {"source": source_hash, "converter": version, "mode": mode, "outputs": outputs}
+
+
+def _manifest_fresh(entry: dict | None, source_hash: str, version: str, mode: str) -> bool:
+    """清单条目与源 hash / 转换器版本 / 模式一致，且记录的产物均未被改动 → 可跳过转换。"""
+    if (not entry or entry.get("source") != source_hash
+            or entry.get("converter") != version or entry.get("mode") != mode):
+        return False
+    outputs = entry.get("outputs") or {}
+    return bool(outputs) and all(sha256_file(REPO_ROOT / p) == h for p, h in outputs.items())
+
+
+def _load_manifest() -> dict[str, dict]:
+    try:
+        return json.loads(CONVERT_MANIFEST.read_text(encoding="utf-8")).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def convert_all(jobs: int = 1, force: bool = False, manifest: "SyncRulesManifest | None" = None):
+    """遍历 Surge/RULE-SET 所有 .list（含子目录），逐文件转换。
+
+    jobs > 1 时各文件分发到进程池并行转换（process_file 彼此独立），日志与更新
+    计数仍按文件路径顺序合并输出，与串行模式一致；jobs <= 0 取 CPU 核数。
+
+    CONVERT_MANIFEST 记录上次转换时各源文件的 hash 与产物 hash：源、转换器版本、
+    转换模式与产物均未变的文件整文件跳过（force=True 时忽略清单全部重转）。
+    """
     print("\n── Step 4: Surge → QX / Clash / sing-box ──")
 
+    rules_txt = manifest or load_sync_rules()
     # # >> Clash 条目优先级高于 Surge 自动转换（Clash/sing-box 已由 Step 1 写入）
-    rules_txt = parse_sync_rules()
-    clash_override = {e["name"] for e in rules_txt["clash"]}
+    clash_override = rules_txt.clash_managed
     # # >> Surge Domain-Set 条目按 domain 语义派生（文件名 stem 匹配，与输出摊平规则一致）
-    domainset_stems = {e["name"].rsplit("/", 1)[-1] for e in rules_txt["surge_domainset"]}
+    domainset_stems = rules_txt.domainset_stems
 
     surge_files = sorted(SURGE_DIR.rglob("*.list"))
     if not surge_files:
         print("  未找到 Surge 规则文件")
         return
 
-    total = 0
+    version = _converter_version()
+    manifest = {} if force else _load_manifest()
+    new_manifest: dict[str, dict] = {}
+    pending: list[tuple[Path, str, str, str]] = []  # (源文件, 清单键, 源 hash, 模式)
     for sf in surge_files:
-        rel = sf.relative_to(SURGE_DIR)
-        print(f"  [{rel}]")
-        total += process_file(sf, clash_override, domainset_stems)
+        key = sf.relative_to(SURGE_DIR).as_posix()
+        rel = str(sf.relative_to(SURGE_DIR).with_suffix(""))
+        mode = ("surge-only" if rel in clash_override
+                else "domainset" if sf.stem in domainset_stems else "classical")
+        source_hash = sha256_file(sf)
+        if _manifest_fresh(manifest.get(key), source_hash, version, mode):
+            new_manifest[key] = manifest[key]
+        else:
+            pending.append((sf, key, source_hash, mode))
 
+    skipped = len(surge_files) - len(pending)
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(pending)))
+
+    total = 0
+    if jobs == 1:
+        for sf, _, _, _ in pending:
+            rel = sf.relative_to(SURGE_DIR)
+            print(f"  [{rel}]")
+            total += process_file(sf, clash_override, domainset_stems)
+    else:
+        tasks = [(sf, clash_override, domainset_stems) for sf, _, _, _ in pending]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # 大文件（如 Phishing.list）先提交，避免最后被单个长任务拖尾
+            by_size = sorted(range(len(tasks)), key=lambda i: -tasks[i][0].stat().st_size)
+            futures = {i: pool.submit(_convert_one, tasks[i]) for i in by_size}
+            for i in range(len(tasks)):
+                log, updated, part = futures[i].result()
+                print(log, end="")
+                total += updated
+                REPORT.absorb(part)
+
+    for sf, key, source_hash, mode in pending:
+        new_manifest[key] = _manifest_entry(source_hash, version, sf.stem, mode)
+    manifest_text = json.dumps({"files": dict(sorted(new_manifest.items()))},
+                               indent=1, ensure_ascii=False) + "\n"
+    write_if_changed(CONVERT_MANIFEST, manifest_text)
+
+    if skipped:
+        print(f"  跳过 {skipped} 个未变化文件（见 {CONVERT_MANIFEST.name}）")
     print(f"  更新 {total} 个文件")
 
 
@@ -711,42 +1580,44 @@ def convert_all():
 #  Step 4: 清理已删除的文件
 # ═══════════════════════════════════════════════════════════════════════
 
-def cleanup_stale():
+def cleanup_stale(manifest: "SyncRulesManifest | None" = None):
     """QX/Clash/sing-box 中存在但 Surge 中已无对应源的文件 → 删除。
     同时清理 Surge/RULE-SET/ 中以前由 # >> Surge 拉取、现已从 sync-rules.txt 移除的文件
     （通过 '### fork from' 首行识别为外部来源）。
     """
     print("\n── Step 5: 清理已删除的文件 ──")
 
-    sync_rules = parse_sync_rules()
-    # 当前 sync-rules.txt 管理的 stems（含 Domain-Set 段）
-    surge_managed = {e["name"] for e in sync_rules["surge"] + sync_rules["surge_domainset"]}
-    clash_managed = {e["name"] for e in sync_rules["clash"]}
+    sync_rules = manifest or load_sync_rules()
+    # 当前 sync-rules.txt 管理的 stems（含 Domain-Set 段）；校验未通过的行不在管理集合内，
+    # 其名称同样保留，以免误删已拉取的源与全部产物
+    rejected = sync_rules.rejected
+    surge_managed = sync_rules.surge_managed | rejected
+    clash_managed = sync_rules.clash_managed
 
     # 清理 Surge/RULE-SET/ 中不再被 # >> Surge 管理的外部拉取文件
-    for sf in sorted(SURGE_DIR.rglob("*.list")):
+    for meta in RULE_INDEX.files(recursive=True):
+        sf = meta.path
         rel = str(sf.relative_to(SURGE_DIR).with_suffix(""))
         if rel in surge_managed:
             continue
-        try:
-            first_line = sf.read_text(encoding="utf-8").splitlines()[0].strip()
-        except (IndexError, OSError):
-            continue
-        if first_line.startswith("### fork from "):
+        if meta.fork_from is not None:
             sf.unlink()
             print(f"  ✗ 删除 {sf.relative_to(REPO_ROOT)}（已从 sync-rules.txt 移除）")
 
     # QX / Clash / sing-box：保留有 Surge 源（摊平，用 stem）或 # >> Clash 管理（保留路径）的文件
     surge_stems = {sf.stem for sf in SURGE_DIR.rglob("*.list")}
-    keep = surge_stems | clash_managed
+    keep = surge_stems | clash_managed | rejected | {name.rsplit("/", 1)[-1] for name in rejected}
+    # .mrs 另需保留 CIDR 伴生文件（如 lancidr.mrs）
+    keep_mrs = keep | {Path(c).stem for c in CLASH_CIDR_COMPANION.values()}
 
     deleted = 0
-    for target_dir, ext in [(QX_DIR, ".list"), (CLASH_DIR, ".yaml"), (SINGBOX_DIR, ".json")]:
+    for target_dir, ext in [(QX_DIR, ".list"), (CLASH_DIR, ".yaml"), (CLASH_DIR, ".mrs"),
+                            (SINGBOX_DIR, ".json"), (SINGBOX_SRS_DIR, ".srs")]:
         if not target_dir.exists():
             continue
         for f in sorted(target_dir.rglob(f"*{ext}")):
             rel = str(f.relative_to(target_dir).with_suffix(""))
-            if rel not in keep:
+            if rel not in (keep_mrs if ext == ".mrs" else keep):
                 f.unlink()
                 print(f"  ✗ 删除 {f.relative_to(REPO_ROOT)}")
                 deleted += 1
@@ -759,42 +1630,140 @@ def cleanup_stale():
 #  Step 1: sync-rules.txt 外部规则拉取
 # ═══════════════════════════════════════════════════════════════════════
 
-def parse_sync_rules() -> dict:
-    """解析 sync-rules.txt，返回 {"surge": [...], "surge_domainset": [...], "clash": [...], "module": [...]}，
-    条目均为 {url, name, overrides}。# >> Surge 段内以 `DOMAIN-SET,` 前缀标注的条目
-    为 DOMAIN-SET 格式来源（裸域名 / `.` 前缀域名），落库保持原格式、
-    Step 4 按各平台原生 domain 语义派生；无前缀条目为 RULE-SET 格式来源。"""
-    result: dict[str, list[dict]] = {"surge": [], "surge_domainset": [], "clash": [], "module": []}
-    if not SYNC_RULES_TXT.exists():
-        return result
+class SyncRuleEntry:
+    """sync-rules.txt 单条来源：url、落库名 name（可含子目录，如 Apple/Apple News）、
+    行内 #!key=value 覆盖；domainset 表示条目带 `DOMAIN-SET,` 前缀。"""
+
+    __slots__ = ("url", "name", "overrides", "domainset")
+
+    def __init__(self, url: str, name: str, overrides: dict[str, str], domainset: bool) -> None:
+        self.url = url
+        self.name = name
+        self.overrides = overrides
+        self.domainset = domainset
+
+    @property
+    def stem(self) -> str:
+        """输出文件名（QX / Clash / sing-box 产物摊平，不含子目录）。"""
+        return self.name.rsplit("/", 1)[-1]
+
+
+class SyncRulesManifest:
+    """sync-rules.txt 解析结果，main() 解析一次后传给各 Step。
+
+    surge / surge_domainset / clash / module 为各段条目（# >> Surge 段内带
+    `DOMAIN-SET,` 前缀的条目归入 surge_domainset：裸域名 / `.` 前缀域名来源，
+    落库保持原格式、Step 4 按各平台原生 domain 语义派生；无前缀条目为 RULE-SET
+    格式来源）。各 Step 需要的名称集合在构造时一并算好。
+    """
+
+    __slots__ = ("surge", "surge_domainset", "clash", "module", "problems", "rejected",
+                 "surge_managed", "clash_managed", "domainset_stems", "clash_domainset_names")
+
+    def __init__(self, surge: list[SyncRuleEntry], surge_domainset: list[SyncRuleEntry],
+                 clash: list[SyncRuleEntry], module: list[SyncRuleEntry],
+                 problems: list[str] | None = None, rejected: set[str] | None = None) -> None:
+        self.surge = surge
+        self.surge_domainset = surge_domainset
+        self.clash = clash
+        self.module = module
+        self.problems = problems or []  # 校验未通过、已忽略的行
+        self.rejected = rejected or set()  # 上述行的名称，Step 5 不清理其文件
+        # # >> Surge 管理的落库名（含 Domain-Set 段），Step 1 / Step 5 用
+        self.surge_managed = {e.name for e in surge + surge_domainset}
+        # # >> Clash 管理的名称：Step 4 跳过同名 Clash/sing-box 输出，Step 5 保留其产物
+        self.clash_managed = {e.name for e in clash}
+        # Domain-Set 来源按文件名 stem 匹配（与输出摊平规则一致）
+        self.domainset_stems = {e.stem for e in surge_domainset}
+        self.clash_domainset_names = {e.name for e in clash if e.domainset}
+
+    @property
+    def rule_entries(self) -> list[SyncRuleEntry]:
+        """Step 1 需要下载的规则条目（Surge + Surge Domain-Set + Clash）。"""
+        return self.surge + self.surge_domainset + self.clash
+
+
+_SYNC_RULES_SECTIONS = {"# >> Surge": "surge", "# >> Clash": "clash", "# >> Module": "module"}
+
+
+def _check_entry(url: str, name: str, section: str) -> str | None:
+    """校验条目，返回问题描述；合法返回 None。"""
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return f"URL 无效: {url}"
+    if not name:
+        return "缺少名称"
+    segments = name.split("/")
+    if "\\" in name or any(seg in ("", ".", "..") for seg in segments):
+        return f"名称无效: {name}"
+    if section == "module" and len(segments) > 1:
+        return f"Module 名称不能含子目录: {name}"
+    return None
+
+
+def parse_sync_rules(path: Path = SYNC_RULES_TXT) -> SyncRulesManifest:
+    """解析 sync-rules.txt 为 SyncRulesManifest（不做缓存，见 load_sync_rules）。
+
+    URL 非 http(s)、名称为空 / 含 `..` 等非法路径段的行记入 problems 并忽略，不影响
+    其余条目，其名称记入 rejected 供 Step 5 保留；同段重复的 (URL, 名称) 只取第一行。
+    """
+    buckets: dict[str, list[SyncRuleEntry]] = {"surge": [], "surge_domainset": [], "clash": [], "module": []}
+    problems: list[str] = []
+    rejected: set[str] = set()
+    seen: set[tuple[str, str, str]] = set()
+    if not path.exists():
+        return SyncRulesManifest(**buckets)
     section = None
-    for line in SYNC_RULES_TXT.read_text(encoding="utf-8").splitlines():
+    for lineno, line in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
         s = line.strip()
-        if s == "# >> Surge":
-            section = "surge"
-        elif s == "# >> Clash":
-            section = "clash"
-        elif s == "# >> Module":
-            section = "module"
+        if s in _SYNC_RULES_SECTIONS:
+            section = _SYNC_RULES_SECTIONS[s]
         elif section and s and not s.startswith("#") and "," in s:
             is_domainset = False
             if section in ("surge", "clash") and s.upper().startswith("DOMAIN-SET,"):
                 is_domainset, s = True, s[len("DOMAIN-SET,"):].strip()
             section_key = "surge_domainset" if (section == "surge" and is_domainset) else section
             url, rest = s.split(",", 1)
+            url = url.strip()
             # rest = "name" 或 "name #!key=value #!key=value ..."（空格+#! 分隔）
             parts = rest.split(" #!")
             name = parts[0].strip()
+            problem = _check_entry(url, name, section)
+            if problem:
+                problems.append(f"第 {lineno} 行 {problem}")
+                if name:
+                    rejected.add(name)
+                continue
+            if (section_key, url, name) in seen:
+                continue
+            seen.add((section_key, url, name))
             overrides = {}
             for part in parts[1:]:
                 if "=" in part:
                     k, v = part.split("=", 1)
                     overrides[k.strip()] = v.strip()
-            entry = {"url": url.strip(), "name": name, "overrides": overrides}
-            if section == "clash":
-                entry["domainset"] = is_domainset
-            result[section_key].append(entry)
-    return result
+            buckets[section_key].append(SyncRuleEntry(url, name, overrides, is_domainset))
+    return SyncRulesManifest(**buckets, problems=problems, rejected=rejected)
+
+
+_manifest_cache: dict[Path, tuple[tuple[int, int], SyncRulesManifest]] = {}
+
+
+def load_sync_rules(path: Path = SYNC_RULES_TXT) -> SyncRulesManifest:
+    """按 (mtime, size) 缓存的 parse_sync_rules；首次解析时打印校验问题。"""
+    try:
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = (-1, -1)
+    cached = _manifest_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    manifest = parse_sync_rules(path)
+    for problem in manifest.problems:
+        print(f"  [WARN] {path.name} {problem}，已忽略")
+    _manifest_cache[path] = (stamp, manifest)
+    return manifest
 
 
 def _removal_domain(line: str) -> str | None:
@@ -810,22 +1779,111 @@ def _removal_domain(line: str) -> str | None:
     return cand or None
 
 
-def _build_removals(entries: list[dict]) -> dict[str, set[str]]:
+def _build_removals(entries: list[SyncRuleEntry]) -> dict[str, set[str]]:
     """从条目的 `#!remove=a.com,b.com` 覆盖构造 {name: {去点小写域名}}。
     匹配忽略前导 '.'/'+.'，故 remove=.sellfox.com 同时命中 sellfox.com /
     .sellfox.com / +.sellfox.com / DOMAIN-SUFFIX,sellfox.com。"""
     rem: dict[str, set[str]] = defaultdict(set)
     for e in entries:
-        raw = e["overrides"].get("remove")
+        raw = e.overrides.get("remove")
         if not raw:
             continue
         for tok in raw.split(","):
             tok = tok.strip().lstrip("+").lstrip(".").lower()
             if tok:
-                rem[e["name"]].add(tok)
+                rem[e.name].add(tok)
     return rem
 
 
+# ── 后缀覆盖去冗余 ───────────────────────────────────────────────────
+
+class DomainTrie:
+    """反转 label 的后缀 trie：com → example → www。
+
+    节点为 dict[label → 子节点]；终止节点（某后缀规则本身）记为 _TRIE_END，
+    插入时一并丢弃其子树 —— 被覆盖的更长后缀不再占内存，也不必再查。
+    """
+
+    __slots__ = ("_root",)
+
+    def __init__(self) -> None:
+        self._root: dict = {}
+
+    def add(self, domain: str) -> None:
+        labels = domain.split(".")
+        node = self._root
+        for i in range(len(labels) - 1, 0, -1):
+            node = node.setdefault(labels[i], {})
+            if node is _TRIE_END:
+                return  # 已被更短后缀覆盖
+        node[labels[0]] = _TRIE_END
+
+    def covers(self, domain: str, strict: bool = False) -> bool:
+        """domain 是否落在某条后缀之下；strict=True 时不计与 domain 完全相同的后缀。"""
+        node = self._root
+        labels = domain.split(".")
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return False
+            if node is _TRIE_END:
+                return i > 0 or not strict
+        return False
+
+
+_TRIE_END: dict = {}  # 共享哨兵，仅作身份比较
+
+
+def _domain_key(line: str, kind: str) -> tuple[str, bool] | None:
+    """取合并行的 (小写域名, 是否后缀语义)；不参与去冗余的行返回 None。
+
+    kind：
+      "ruleset"     Surge RULE-SET / Clash classical —— 仅 `DOMAIN,x` / `DOMAIN-SUFFIX,x`
+                    两段式（带 no-resolve 等附加参数或行内注释的行保持原样）
+      "domainset"   Surge DOMAIN-SET —— `.x` 为后缀（含 x 本身），裸域名为精确
+      "clash-domain" Clash domain payload —— `+.x` 为后缀；`.x` 仅子域、`*` 通配不参与
+    """
+    if not line or line.startswith("#"):
+        return None
+    if kind == "ruleset":
+        parts = line.split(",")
+        if len(parts) != 2 or "//" in line or "#" in line:
+            return None
+        t = parts[0].strip().upper()
+        if t not in ("DOMAIN", "DOMAIN-SUFFIX"):
+            return None
+        v = parts[1].strip().lower()
+        return (v, t == "DOMAIN-SUFFIX") if v else None
+    if "*" in line or "," in line or " " in line:
+        return None
+    if kind == "domainset":
+        if line.startswith("."):
+            return (line[1:].lower(), True) if len(line) > 1 else None
+        return line.lower(), False
+    if line.startswith("+."):
+        return (line[2:].lower(), True) if len(line) > 2 else None
+    if line.startswith("."):
+        return None
+    return line.lower(), False
+
+
+def prune_covered_domains(lines: list[str], kind: str) -> tuple[list[str], int]:
+    """剔除已被更宽后缀覆盖的条目，返回 (保留行, 剔除条数)；行序不变。
+
+    DOMAIN-SUFFIX,example.com 覆盖 DOMAIN,a.example.com / DOMAIN-SUFFIX,a.example.com /
+    DOMAIN,example.com；DOMAIN-SET 里 .foo.com 覆盖 .bar.foo.com / foo.com。
+    精确重复仍由调用方按整行去重；大小写不同的同一后缀彼此不剔除。
+    """
+    keys = [_domain_key(line, kind) for line in lines]
+    trie = DomainTrie()
+    for k in keys:
+        if k is not None and k[1]:
+            trie.add(k[0])
+    kept = [line for line, k in zip(lines, keys)
+            if k is None or not trie.covers(k[0], strict=k[1])]
+    return kept, len(lines) - len(kept)
+
+
 def _is_clash_payload(text: str) -> bool:
     """检测文本是否为 Clash payload: 格式（前 10 行内含 'payload:'）。"""
     for line in text.splitlines()[:10]:
@@ -848,7 +1906,7 @@ def normalize_surge_rules(text: str) -> str | None:
             continue
         if stripped.startswith("#"):
             # 仅保留 '# > Name' section header（排除 '# >>' 配置标记）
-            if re.match(r"^#\s*>(?!>)\s*\S", stripped):
+            if TOP_SECTION_RE.match(stripped):
                 out.append(stripped)
             continue
         out.append(stripped)
@@ -920,47 +1978,101 @@ def convert_clash_payload_to_surge(text: str) -> str | None:
 
 # ── ipcidr behavior ──────────────────────────────────────────────────
 
+def _cidr_of(line: str) -> str | None:
+    """单行（已 strip）→ IP CIDR 字符串；非 CIDR 行返回 None。"""
+    if not line or line.startswith("#") or line.startswith("//"):
+        return None
+    parts = [p.strip() for p in line.split(",")]
+    if parts[0].upper() in ("IP-CIDR", "IP-CIDR6", "IP6-CIDR") and len(parts) > 1:
+        return parts[1]
+    if "/" in line and "," not in line:
+        # 纯 CIDR 行（无规则类型前缀）
+        return line
+    return None
+
+
 def _extract_cidrs(text: str) -> list[str]:
     """从 Surge RULE-SET 或纯 CIDR 列表中提取 IP CIDR 字符串。"""
-    cidrs = []
-    for line in text.splitlines():
-        line = line.strip()
-        if not line or line.startswith("#") or line.startswith("//"):
-            continue
-        parts = [p.strip() for p in line.split(",")]
-        if parts[0].upper() in ("IP-CIDR", "IP-CIDR6", "IP6-CIDR") and len(parts) > 1:
-            cidrs.append(parts[1])
-        elif "/" in line and "," not in line:
-            # 纯 CIDR 行（无规则类型前缀）
-            cidrs.append(line)
-    return cidrs
+    return [c for line in text.splitlines() if (c := _cidr_of(line.strip())) is not None]
 
 
-def convert_ipcidr_to_clash(text: str) -> str | None:
-    """Surge IP-CIDR 规则列表 → Clash ipcidr YAML。"""
-    cidrs = _extract_cidrs(text)
+def _parse_network(cidr: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    try:
+        return ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        return None
+
+
+def collapse_cidrs(cidrs: Iterable[str]) -> list[str]:
+    """合并重叠 / 相邻前缀（IPv4、IPv6 分别经 ipaddress.collapse_addresses），
+    返回按字符串排序的去重结果；无法解析的串原样保留。"""
+    v4, v6, raw = [], [], set()
+    for c in cidrs:
+        net = _parse_network(c)
+        if net is None:
+            raw.add(c)
+        else:
+            (v4 if net.version == 4 else v6).append(net)
+    merged = {str(n) for nets in (v4, v6) for n in ipaddress.collapse_addresses(nets)}
+    return sorted(merged | raw)
+
+
+def _render_ipcidr_payload(cidrs: list[str]) -> str | None:
     if not cidrs:
         return None
     out = ["payload:"]
-    for c in sorted(set(cidrs)):
+    for c in collapse_cidrs(cidrs):
         out.append(f"  - '{c}'")
     return "\n".join(out) + "\n"
 
 
+def convert_ipcidr_to_clash(text: str) -> str | None:
+    """Surge IP-CIDR 规则列表 → Clash ipcidr YAML。"""
+    return _render_ipcidr_payload(_extract_cidrs(text))
+
+
 # ── classical behavior ───────────────────────────────────────────────
 
-def convert_classical_payload_to_singbox(text: str, name: str = "") -> str | None:
-    """Clash classical payload: → sing-box JSON（外部规则已是 Clash 格式时使用）。
+class _SingboxCollector:
+    """逐条累积 Clash payload 规则串，渲染为 sing-box JSON。
 
-    sing-box 无对应字段的规则类型（如 IP-ASN、DOMAIN-WILDCARD）会被丢弃；此处
-    统计并打印告警，避免「新增未映射类型 → 产物静默缺规则」不被察觉（见 SINGBOX_MAP）。
+    domain=False 为 classical 语义（TYPE,value / AND,((…))）；domain=True 为
+    domain-behavior 语义（'+.' 前缀 → domain_suffix，其余 → domain）。
+    sing-box 无对应字段的规则类型（如 IP-ASN、DOMAIN-WILDCARD）会被丢弃；render
+    时统计并打印告警，避免「新增未映射类型 → 产物静默缺规则」不被察觉（见 SINGBOX_MAP）。
     """
-    groups: dict[str, list[str]] = {}
-    logical_rules: list[dict] = []
-    dropped: dict[str, int] = {}
-    for line in _iter_clash_payload_rules(text):
+
+    __slots__ = ("domain", "groups", "logical_rules", "dropped", "emitted", "rules")
+
+    def __init__(self, domain: bool = False) -> None:
+        self.domain = domain
+        self.groups: dict[str, list[str]] = {}
+        self.logical_rules: list[dict] = []
+        self.dropped: dict[str, int] = {}
+        self.emitted = 0  # render 后的规则条数（去重 / CIDR 聚合后；运行报告用）
+        self.rules: list[dict] = []  # render 产出的 rules 数组（供 write_srs 复用）
+
+    def add_payload_line(self, raw: str) -> None:
+        """喂入一行 Clash payload 文本（'  - rule'），取规则串规则同 _iter_clash_payload_rules。"""
+        stripped = raw.strip()
+        if stripped.startswith("- "):
+            rule = stripped[2:].strip().strip("'\"")
+            if rule and not rule.startswith("#"):
+                self.add(rule)
+
+    def add(self, line: str) -> None:
         if line.startswith("#") or line.startswith("//"):
-            continue
+            return
+        if self.domain:
+            v = line.strip().strip("'\"")
+            if not v:
+                return
+            if v.startswith("+."):
+                self.groups.setdefault("domain_suffix", []).append(v[2:])
+            else:
+                self.groups.setdefault("domain", []).append(v)
+            return
+
         # 剥掉 YAML 行内注释（`  # ...`），避免 "domain  # comment" 混入值
         hash_idx = line.find("#")
         if hash_idx > 0:
@@ -968,64 +2080,427 @@ def convert_classical_payload_to_singbox(text: str, name: str = "") -> str | Non
         line = line.strip()
 
         if line.startswith("AND,"):
-            # 逻辑规则 → sing-box type:logical/mode:and（version 2 起即支持）。
-            # 所有子条件均为 sing-box 支持的类型才转换；含 USER-AGENT 等不支持
-            # 子类型则整条跳过（与 Clash preserve / QX 的处理一致）。
-            sub = parse_and_rule(line)
-            if not sub:
-                continue
-            sb_sub = [{SINGBOX_MAP[t]: [v]} for t, v in sub if t in SINGBOX_MAP]
-            if sb_sub and len(sb_sub) == len(sub):
-                logical_rules.append({"type": "logical", "mode": "and", "rules": sb_sub})
-            continue
+            self._add_logical(line)
+            return
 
         parts = [p.strip() for p in line.split(",")]
-        sb_type = SINGBOX_MAP.get(parts[0])
-        if sb_type and len(parts) > 1:
-            groups.setdefault(sb_type, []).append(parts[1])
-        elif len(parts) > 1:
+        if len(parts) > 1:
+            self._add_typed(parts[0], parts[1])
+
+    def add_rule(self, rule: Rule) -> None:
+        """喂入 _tokenize_surge 已解析的规则（Step 4 由 Clash emitter 直传），
+        与 add_payload_line 同义，但省去拼成 Clash 行再拆分的往返。"""
+        if rule.type == "AND":
+            self._add_logical(rule.canonical)
+        elif rule.value is not None:
+            self._add_typed(rule.type, rule.value)
+
+    def _add_logical(self, line: str) -> None:
+        # 逻辑规则 → sing-box type:logical/mode:and（version 2 起即支持）。
+        # 所有子条件均为 sing-box 支持的类型才转换；含 USER-AGENT 等不支持
+        # 子类型则整条跳过（与 Clash preserve / QX 的处理一致）。
+        sub = parse_and_rule(line)
+        if not sub:
+            return
+        sb_sub = [{SINGBOX_MAP[t]: [v]} for t, v in sub if t in SINGBOX_MAP]
+        if sb_sub and len(sb_sub) == len(sub):
+            self.logical_rules.append({"type": "logical", "mode": "and", "rules": sb_sub})
+
+    def _add_typed(self, rule_type: str, value: str) -> None:
+        sb_type = SINGBOX_MAP.get(rule_type)
+        if sb_type:
+            self.groups.setdefault(sb_type, []).append(value)
+        else:
             # 有类型前缀但 SINGBOX_MAP 无对应字段 → 记录后丢弃
-            dropped[parts[0]] = dropped.get(parts[0], 0) + 1
+            self.dropped[rule_type] = self.dropped.get(rule_type, 0) + 1
+
+    def render(self, name: str = "") -> str | None:
+        if self.dropped:
+            label = f"{name} " if name else ""
+            summary = ", ".join(f"{t}×{n}" for t, n in sorted(self.dropped.items()))
+            print(f"    [WARN] {label}sing-box 无对应类型，已丢弃: {summary}")
+            REPORT.note_dropped(name, self.dropped)
+
+        if not self.groups and not self.logical_rules:
+            return None
 
-    if dropped:
-        label = f"{name} " if name else ""
-        summary = ", ".join(f"{t}×{n}" for t, n in sorted(dropped.items()))
-        print(f"    [WARN] {label}sing-box 无对应类型，已丢弃: {summary}")
+        rules = _groups_to_singbox_rules(self.groups, self.logical_rules)
+        self.emitted = sum(1 if "type" in r else len(next(iter(r.values()))) for r in rules)
+        self.rules = rules
+        return (json.dumps({"version": 2, "rules": rules}, indent=2, ensure_ascii=False) + "\n"
+                if rules else None)
 
-    if not groups and not logical_rules:
+
+def convert_classical_payload_to_singbox(text: str, name: str = "") -> str | None:
+    """Clash classical payload: → sing-box JSON（外部规则已是 Clash 格式时使用）。"""
+    sb = _SingboxCollector()
+    for line in _iter_clash_payload_rules(text):
+        sb.add(line)
+    return sb.render(name)
+
+
+# ── sing-box 二进制规则集（.srs）────────────────────────────────────
+# 按 sing-box common/srs 的 version 2 格式直接编码 _groups_to_singbox_rules 的输出，
+# 与 source JSON 同一趟写出，CI 不再下载 sing-box CLI、逐文件 rule-set compile。
+#
+#   文件   = "SRS" + 版本字节 + zlib(载荷)
+#   载荷   = uvarint(规则数) + 规则…
+#   规则   = 0x00 + 条目… + 0xFF + invert 字节           （default）
+#          | 0x01 + mode(and=0/or=1) + uvarint(子规则数) + 子规则… + invert 字节（logical）
+#   条目   = 类型字节 + 值：字符串列表为 uvarint(个数) + [uvarint(长度) + UTF-8]…；
+#            domain / domain_suffix 合为一个域名 succinct trie；ip_cidr 为合并后的地址区间
+#
+# zlib 流与 Go compress/flate 的压缩字节不同（格式兼容），故 write_srs 按解压后的
+# 载荷判断是否变化：载荷一致时保留现有文件（含 CLI 编出的旧产物），不产生无谓提交。
+
+_SRS_MAGIC = b"SRS"
+_SRS_VERSION = 2  # 与 source JSON 的 "version": 2 一致
+
+# default 规则各字段的条目类型码；字段按此顺序写出（与 sing-box writeDefaultRule 一致）
+_SRS_ITEM_DOMAIN = 2
+_SRS_ITEM_IP_CIDR = 6
+_SRS_STRING_ITEMS = {"domain_keyword": 3, "domain_regex": 4, "process_name": 11}
+_SRS_FIELDS = {"domain", "domain_suffix", "ip_cidr", *_SRS_STRING_ITEMS}
+
+# 域名 trie 键的尾标：反转后的 'example.com' + '\n' = 匹配自身及子域（domain_suffix），
+# '.example.com' 形式的后缀 + '\r' = 仅子域；domain 为反转原串
+_SRS_ROOT_LABEL = b"\n"
+_SRS_PREFIX_LABEL = b"\r"
+
+
+def _uvarint(n: int) -> bytes:
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _bitmap_words(bits: bytes) -> tuple[int, bytes]:
+    """位串（ASCII '0'/'1'，第 i 个字符为第 i 位）→ (uint64 字数, 大端字序列)：第 i 位在
+    第 i>>6 字的第 i&63 位，末尾全零的字不写。每字内位序反转后整体按二进制解析，
+    即得逐字大端排列，不在 Python 层逐字移位。"""
+    bits = bits.rstrip(b"0")
+    count = (len(bits) + 63) >> 6
+    bits = bits.ljust(count * 64, b"0")
+    packed = b"".join([bits[i:i + 64][::-1] for i in range(0, len(bits), 64)])
+    return count, int(packed or b"0", 2).to_bytes(count * 8, "big")
+
+
+def _srs_words(bits: bytes) -> bytes:
+    """位图 → uvarint(字数) + 大端 uint64 字序列。"""
+    count, words = _bitmap_words(bits)
+    return _uvarint(count) + words
+
+
+# _succinct_trie 的逐层事件码：n = 仅一条边（挂在前一键的节点下）、m = 新节点 + 一条边、
+# e = 终止节点（无边）；NUL = 该键在此层无事件
+_TRIE_EDGE_MASK = bytes.maketrans(b"nme", b"\xff\xff\x00")
+_TRIE_LEAF_BITS = bytes.maketrans(b"me", b"01")
+
+
+def _succinct_trie(keys: list[bytes]) -> tuple[bytes, bytes, bytes]:
+    """已排序、无重复、不含 NUL 的键 → LOUDS succinct trie：(leaves 位串, labelBitmap
+    位串, labels)，位串同 _bitmap_words。sing-box .srs 与 mihomo .mrs 的域名集合都是
+    这一结构。
+
+    按层序（BFS）展开：每个节点依次为各子边记 0 位并追加边上字节，末尾记 1 位；
+    终止于该节点的键在 leaves 中置位。同层节点按键序排列：键与前一键公共前缀长 p、
+    自身长 n 时，它在第 p 层只贡献一条边，第 p+1..n-1 层各是带一条边的新节点，第 n
+    层是终止节点。故把每个键摊成定宽的一行事件码，逐层取一列即得该层的位串与
+    labels——只有按键与按层的 bytes 操作，不逐节点循环（百万级节点快数倍）。
+    """
+    if not keys:
+        return b"", b"1", b""
+    width = max(map(len, keys)) + 1  # 最长键的终止节点在第 len 层
+    rows = b"".join([k.ljust(width, b"\0") for k in keys])
+    # 相邻两行异或：每行首个非零字节的位置即与前一键的公共前缀长
+    packed = int.from_bytes(rows, "big")
+    diff = (packed ^ (packed >> (width * 8))).to_bytes(len(rows), "big")
+    lcps = [width - len(diff[i:i + width].lstrip(b"\0")) for i in range(width, len(rows), width)]
+    lens = list(map(len, keys))
+    events: dict[tuple[int, int], bytes] = {}
+    for p, n in set(zip(lcps, lens[1:])):
+        events[p, n] = b"\0" * p + b"n" + b"m" * (n - p - 1) + b"e" + b"\0" * (width - n - 1)
+    # 首键从根起每层都是新节点
+    codes = b"".join([b"m" * lens[0] + b"e" + b"\0" * (width - lens[0] - 1),
+                      *map(events.__getitem__, zip(lcps, lens[1:]))])
+    # 只保留有边事件所在位置的键字节，其余置 NUL
+    edges = (packed & int.from_bytes(codes.translate(_TRIE_EDGE_MASK), "big")).to_bytes(len(rows), "big")
+
+    leaves, ends, labels = [], [], []
+    for d in range(width):
+        col = codes[d::width].translate(None, b"\0")
+        ends.append(col.replace(b"m", b"10").replace(b"n", b"0").replace(b"e", b"1"))
+        leaves.append(col.translate(_TRIE_LEAF_BITS, b"n"))
+        labels.append(edges[d::width].translate(None, b"\0"))
+    # 每层首个事件必为新节点，其前无待关闭的节点：去掉开头的 1 位，末尾补最后一个节点的 1 位
+    return b"".join(leaves), b"".join(ends)[1:] + b"1", b"".join(labels)
+
+
+def _merged_ip_ranges(nets: Iterable[ipaddress.IPv4Network | ipaddress.IPv6Network],
+                      ) -> list[tuple[int, int, int]]:
+    """网段 → 合并重叠 / 相邻后的地址区间 [(版本, 起, 止)]：IPv4 在前、IPv6 在后，各自
+    升序（同 Go netipx.IPSet 的区间表示）。"""
+    spans: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+    for n in nets:
+        spans[n.version].append((int(n.network_address), int(n.broadcast_address)))
+    out: list[tuple[int, int, int]] = []
+    for version in (4, 6):
+        merged: list[list[int]] = []
+        for lo, hi in sorted(spans[version]):
+            if merged and lo <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        out.extend((version, lo, hi) for lo, hi in merged)
+    return out
+
+
+def _srs_strings(item: int, values: list[str]) -> bytes:
+    out = bytearray((item,))
+    out += _uvarint(len(values))
+    for v in values:
+        data = v.encode("utf-8")
+        out += _uvarint(len(data))
+        out += data
+    return bytes(out)
+
+
+def _srs_domain_matcher(domains: list[str], suffixes: list[str]) -> bytes:
+    """domain / domain_suffix → 域名 matcher（_succinct_trie：leaves、labelBitmap、labels）。
+
+    键为反转后的域名（按 Unicode 码点反转，再 UTF-8 编码）。同一域名在 suffix 与
+    domain 中重复时只保留先出现者（suffix 优先）。
+    """
+    seen: set[str] = set()
+    keys: list[bytes] = []
+    for d in suffixes:
+        if d not in seen:
+            seen.add(d)
+            label = _SRS_PREFIX_LABEL if d.startswith(".") else _SRS_ROOT_LABEL
+            keys.append(d[::-1].encode("utf-8") + label)
+    for d in domains:
+        if d not in seen:
+            seen.add(d)
+            keys.append(d[::-1].encode("utf-8"))
+    keys.sort()
+    leaves, ends, labels = _succinct_trie(keys)
+    return b"\x00" + _srs_words(leaves) + _srs_words(ends) + _uvarint(len(labels)) + labels
+
+
+def _srs_ip_set(cidrs: list[str]) -> bytes:
+    """ip_cidr → 地址区间集合（_merged_ip_ranges），每个区间写
+    (uvarint(字节数) + 起始地址, uvarint(字节数) + 结束地址)。"""
+    ranges = _merged_ip_ranges(n for c in cidrs if (n := _parse_network(c)) is not None)
+    out = bytearray(b"\x01")
+    out += len(ranges).to_bytes(8, "big")
+    for version, lo, hi in ranges:
+        width = 4 if version == 4 else 16
+        prefix = _uvarint(width)
+        out += prefix + lo.to_bytes(width, "big") + prefix + hi.to_bytes(width, "big")
+    return bytes(out)
+
+
+def _srs_rule(rule: dict) -> bytes:
+    if rule.get("type") == "logical":
+        out = bytearray((1, 0 if rule["mode"] == "and" else 1))
+        out += _uvarint(len(rule["rules"]))
+        for sub in rule["rules"]:
+            out += _srs_rule(sub)
+        out.append(1 if rule.get("invert") else 0)
+        return bytes(out)
+
+    unknown = set(rule) - _SRS_FIELDS
+    if unknown:
+        raise ValueError(f"不支持的 sing-box 字段: {', '.join(sorted(unknown))}")
+    out = bytearray(b"\x00")
+    if "domain" in rule or "domain_suffix" in rule:
+        out.append(_SRS_ITEM_DOMAIN)
+        out += _srs_domain_matcher(rule.get("domain", []), rule.get("domain_suffix", []))
+    for key in ("domain_keyword", "domain_regex"):
+        if rule.get(key):
+            out += _srs_strings(_SRS_STRING_ITEMS[key], rule[key])
+    if rule.get("ip_cidr"):
+        out.append(_SRS_ITEM_IP_CIDR)
+        out += _srs_ip_set(rule["ip_cidr"])
+    if rule.get("process_name"):
+        out += _srs_strings(_SRS_STRING_ITEMS["process_name"], rule["process_name"])
+    out += b"\xff\x00"
+    return bytes(out)
+
+
+def encode_srs_payload(rules: list[dict]) -> bytes:
+    """sing-box rules 数组 → .srs 未压缩载荷。"""
+    return _uvarint(len(rules)) + b"".join(_srs_rule(r) for r in rules)
+
+
+def write_srs(path: Path, rules: list[dict]) -> bool:
+    """写出 .srs；载荷与现有文件解压后一致则跳过。写入返回 True。
+    含 .srs 无对应条目的字段（如手动保留的 PROCESS-NAME-REGEX → process_name_regex，
+    sing-box 二进制格式没有该条目）时只跳过本文件并告警，不中断整个 Step 4。"""
+    try:
+        payload = encode_srs_payload(rules)
+    except ValueError as e:
+        print(f"    [WARN] {path.name}：{e}，跳过 .srs 输出，保留现有文件")
+        return False
+    header = _SRS_MAGIC + bytes((_SRS_VERSION,))
+    try:
+        old = path.read_bytes()
+        if old[:4] == header and zlib.decompress(old[4:]) == payload:
+            return False
+    except (OSError, zlib.error):
+        pass
+    return write_if_changed(path, header + zlib.compress(payload, 9))
+
+
+# ── Clash 二进制规则集（.mrs）────────────────────────────────────────
+# 按 mihomo rules/provider 的 mrs 格式直接编码 Clash payload，与 YAML 同一趟写出，
+# CI 不再下载 mihomo 内核逐文件 convert-ruleset。mrs 只有 domain / ipcidr 两种
+# behavior，由调用方按规则语义给出（DOMAIN-SET → domain、纯 CIDR → ipcidr），
+# classical 不产出 .mrs。
+#
+#   文件   = zstd("MRS" + 版本字节 + behavior 字节 + int64(规则数) + int64(extra 长度=0) + 集合)
+#   domain = 0x01 + int64(字数) + leaves 字… + int64(字数) + labelBitmap 字… + int64(长度) + labels
+#            （_succinct_trie；键为反转后的小写域名，'+.x' 记 'x' 与 '+.x' 两键，'.x' 记 '+.x'）
+#   ipcidr = 0x01 + int64(区间数) + [起始 16 字节 + 结束 16 字节]…（IPv4 映射为 ::ffff:a.b.c.d）
+#
+# 整数均为大端。zstd 压缩字节与 mihomo（klauspost/compress）不同，故 write_mrs 同 write_srs
+# 按解压后的载荷判断是否变化。
+
+_MRS_MAGIC = b"MRS\x01"
+MRS_BEHAVIORS = {"domain": 0, "ipcidr": 1}
+
+
+def _mrs_domain_key(rule: str) -> tuple[str, ...]:
+    """单条 domain payload → trie 键（未反转）；非法域名（mihomo ValidAndSplitDomain
+    拒收：末尾 '.'、含空标签、含 '/'）返回空元组。"""
+    if not rule or rule[-1] == "." or "/" in rule:
+        return ()
+    domain = rule.lower()
+    parts = domain.split(".")
+    if len(parts) > 1 and "" in parts[1:]:
+        return ()
+    if parts[0] == "+":
+        return (domain[2:], domain) if len(parts) > 1 else ()
+    if parts[0] == "":
+        return ("+" + domain,)
+    return (domain,)
+
+
+def _mrs_domain_set(rules: Iterable[str]) -> tuple[int, bytes]:
+    """domain payload → (有效规则数, 集合字节)。"""
+    count = 0
+    keys: set[bytes] = set()
+    for rule in rules:
+        rule_keys = _mrs_domain_key(rule)
+        if rule_keys:
+            count += 1
+            keys.update(k[::-1].encode() for k in rule_keys)
+    leaves, ends, labels = _succinct_trie(sorted(keys))
+    out = bytearray(b"\x01")
+    for bits in (leaves, ends):
+        n_words, words = _bitmap_words(bits)
+        out += n_words.to_bytes(8, "big") + words
+    out += len(labels).to_bytes(8, "big") + labels
+    return count, bytes(out)
+
+
+def _mrs_ipcidr_set(rules: Iterable[str]) -> tuple[int, bytes]:
+    """ipcidr payload → (有效规则数, 集合字节)。同 netip.ParsePrefix，须带前缀长度。"""
+    nets = [n for r in rules if "/" in r and (n := _parse_network(r)) is not None]
+    ranges = _merged_ip_ranges(nets)
+    out = bytearray(b"\x01")
+    out += len(ranges).to_bytes(8, "big")
+    for version, lo, hi in ranges:
+        if version == 4:
+            lo, hi = lo | 0xFFFF_0000_0000, hi | 0xFFFF_0000_0000
+        out += lo.to_bytes(16, "big") + hi.to_bytes(16, "big")
+    return len(nets), bytes(out)
+
+
+def encode_mrs_payload(behavior: str, rules: Iterable[str]) -> bytes | None:
+    """Clash payload 规则串 → .mrs 未压缩载荷；无有效规则返回 None（mihomo 同样拒绝空集）。"""
+    encode = _mrs_domain_set if behavior == "domain" else _mrs_ipcidr_set
+    count, body = encode(rules)
+    if not count:
         return None
+    return (_MRS_MAGIC + bytes((MRS_BEHAVIORS[behavior],))
+            + count.to_bytes(8, "big") + (0).to_bytes(8, "big") + body)
+
+
+# ── zstd：优先 Python 3.14 compression.zstd，其次 zstandard；均无则不产出 .mrs ──
+# 压缩级别用库默认（3），与 mihomo（klauspost SpeedDefault）产物大小相当；19 级对
+# Phishing 这类大集合要多花一秒多，体积只小约 2%。
 
-    rules = _groups_to_singbox_rules(groups, logical_rules)
-    return (json.dumps({"version": 2, "rules": rules}, indent=2, ensure_ascii=False) + "\n"
-            if rules else None)
+# (compress, decompress, 解压错误类型)；未解析前为 None，解析后无可用模块为 ()
+_zstd_codec: tuple | None = None
+
+
+def _zstd() -> tuple:
+    """(compress, decompress, 错误类型)，首次调用时按可用模块选定（惰性导入）；
+    无 zstd 模块返回空元组。不在此打印警告：进程池 worker 各自解析，由 main 在父进程提示一次。"""
+    global _zstd_codec
+    if _zstd_codec is None:
+        try:
+            from compression import zstd  # Python 3.14+
+            _zstd_codec = (zstd.compress, zstd.decompress, zstd.ZstdError)
+        except ImportError:
+            try:
+                import zstandard
+                _zstd_codec = (zstandard.ZstdCompressor().compress,
+                               lambda b: zstandard.ZstdDecompressor().decompressobj().decompress(b),
+                               zstandard.ZstdError)
+            except ImportError:
+                _zstd_codec = ()
+    return _zstd_codec
+
+
+def write_mrs(path: Path, behavior: str, rules: Iterable[str]) -> bool:
+    """写出 .mrs；无 zstd 模块、无有效规则或载荷与现有文件解压后一致则跳过。写入返回 True。
+    无 zstd 模块时保留现有文件而不降级写不压缩的帧（否则本地运行会改写全部 .mrs）。"""
+    codec = _zstd()
+    if not codec:
+        return False
+    compress, decompress, zstd_error = codec
+    payload = encode_mrs_payload(behavior, rules)
+    if payload is None:
+        return False
+    try:
+        if decompress(path.read_bytes()) == payload:
+            return False
+    except (OSError, zstd_error):  # 文件不存在 / 已损坏：重写
+        pass
+    return write_if_changed(path, compress(payload))
 
 
-def fetch_external_rules():
+def fetch_external_rules(manifest: SyncRulesManifest | None = None):
     """拉取 sync-rules.txt 外部规则。
 
     # >> Surge  → Surge/RULE-SET/<name>.list（首行加 fork header，Step 4 正常转换）
-    # >> Clash  → Clash/RuleSet/<name>.yaml + sing-box/source/<name>.json（直接写入，
+    # >> Clash  → Clash/RuleSet/<name>.yaml（+ .mrs）+ sing-box/source/<name>.json（直接写入，
                   Step 4 对同名 Surge 文件跳过 Clash/sing-box 输出）
     """
     print("\n── Step 1: 拉取外部规则 ──")
-    rules = parse_sync_rules()
+    rules = manifest or load_sync_rules()
 
-    if not rules["surge"] and not rules["surge_domainset"] and not rules["clash"]:
+    if not rules.rule_entries:
         print("  sync-rules.txt 无规则条目")
         return
 
     # 预先并发拉取所有 URL（去重后并发，避免同 URL 重复下载）
-    all_urls = list({e["url"] for e in rules["surge"] + rules["surge_domainset"] + rules["clash"]})
+    all_urls = list({e.url for e in rules.rule_entries})
     if all_urls:
         print(f"  并发下载 {len(all_urls)} 个 URL …")
     prefetched = prefetch_urls(all_urls, _UA) if all_urls else {}
 
     # ── # >> Surge / # >> Surge Domain-Set section（同名多 URL 合并去重）──
     surge_groups: dict[str, list[str]] = defaultdict(list)
-    for e in rules["surge"] + rules["surge_domainset"]:
-        surge_groups[e["name"]].append(e["url"])
-    domainset_names = {e["name"] for e in rules["surge_domainset"]}
-    surge_removals = _build_removals(rules["surge"] + rules["surge_domainset"])
+    for e in rules.surge + rules.surge_domainset:
+        surge_groups[e.name].append(e.url)
+    domainset_names = {e.name for e in rules.surge_domainset}
+    surge_removals = _build_removals(rules.surge + rules.surge_domainset)
 
     for name, urls in surge_groups.items():
         fork_urls: list[str] = []
@@ -1033,11 +2508,13 @@ def fetch_external_rules():
         seen_rules: set[str] = set()
         section_names: list[str] = []  # 各来源的 # > Name，最终拼成 A & B
         removal = surge_removals.get(name, set())  # #!remove= 要剔除的域名
+        transient = False  # 有来源瞬时失败（非 404）→ 合并结果残缺，保留现有文件
 
         for url in urls:
             print(f"  [Surge] {name} ← {url}")
             text = prefetched.get(url)
             if text is None:
+                transient = transient or url not in FETCH_BUDGET.not_found
                 continue
             if name not in domainset_names and _is_clash_payload(text):
                 text = convert_clash_payload_to_surge(text)
@@ -1049,8 +2526,8 @@ def fetch_external_rules():
                 continue
             fork_urls.append(url)
             for line in normalized.splitlines():
-                if re.match(r"^#\s*>(?!>)\s*\S", line):
-                    display = re.sub(r"^#\s*>\s*", "", line).strip()
+                display = top_section_name(line)
+                if display is not None:
                     if display not in section_names:
                         section_names.append(display)
                 elif line not in seen_rules:
@@ -1059,10 +2536,17 @@ def fetch_external_rules():
                     seen_rules.add(line)
                     rule_lines.append(line)
 
+        if transient:
+            print(f"    [WARN] {name} 有来源下载失败（非 404），保留现有文件")
+            continue
         if not rule_lines:
             print(f"    [WARN] {name} 全部来源为空，跳过")
             _mark_upstream_deleted(SURGE_DIR / f"{name}.list")
             continue
+        rule_lines, pruned = prune_covered_domains(
+            rule_lines, "domainset" if name in domainset_names else "ruleset")
+        if pruned:
+            print(f"    - 剔除被后缀覆盖的冗余条目 {pruned} 条")
         header = " & ".join(section_names) if section_names else name.rsplit("/", 1)[-1]
         rule_lines.insert(0, f"# > {header}")
 
@@ -1074,21 +2558,23 @@ def fetch_external_rules():
 
     # ── # >> Clash section（同名多 URL 合并去重）──────────────────────
     clash_groups: dict[str, list[str]] = defaultdict(list)
-    clash_domainset_names = {e["name"] for e in rules["clash"] if e.get("domainset")}
-    clash_removals = _build_removals(rules["clash"])
-    for e in rules["clash"]:
-        clash_groups[e["name"]].append(e["url"])
+    clash_domainset_names = rules.clash_domainset_names
+    clash_removals = _build_removals(rules.clash)
+    for e in rules.clash:
+        clash_groups[e.name].append(e.url)
 
     for name, urls in clash_groups.items():
         fork_urls = []
         all_rules: list[str] = []
         seen_rules = set()
         removal = clash_removals.get(name, set())  # #!remove= 要剔除的域名
+        transient = False
 
         for url in urls:
             print(f"  [Clash] {name} ← {url}")
             text = prefetched.get(url)
             if text is None:
+                transient = transient or url not in FETCH_BUDGET.not_found
                 continue
             fork_urls.append(url)
             for rule in _clash_body_rules(text):
@@ -1098,9 +2584,16 @@ def fetch_external_rules():
                     seen_rules.add(rule)
                     all_rules.append(rule)
 
+        if transient:
+            print(f"    [WARN] {name} 有来源下载失败（非 404），保留现有文件")
+            continue
         if not all_rules:
             print(f"    [WARN] {name} Clash 转换为空，跳过")
             continue
+        all_rules, pruned = prune_covered_domains(
+            all_rules, "clash-domain" if name in clash_domainset_names else "ruleset")
+        if pruned:
+            print(f"    - 剔除被后缀覆盖的冗余条目 {pruned} 条")
 
         body = "payload:\n" + "\n".join(f"  - {r}" for r in all_rules) + "\n"
         clash_content = "### fork from " + " & ".join(fork_urls) + "\n" + body
@@ -1110,24 +2603,37 @@ def fetch_external_rules():
             print(f"    ✓ Clash:    {name}.yaml 无变化")
 
         # DOMAIN-SET, 前缀条目为 domain payload（裸域名 / +. 前缀），按 domain 语义转换
-        sb_content = (convert_domain_payload_to_singbox(body) if name in clash_domainset_names
-                      else convert_classical_payload_to_singbox(body, f"{name}.json"))
+        sb = _SingboxCollector(domain=name in clash_domainset_names)
+        for line in _iter_clash_payload_rules(body):
+            sb.add(line)
+        sb_content = sb.render(f"{name}.json")
         if sb_content:
             if write_if_changed(SINGBOX_DIR / f"{name}.json", sb_content):
                 print(f"    ✓ sing-box: {name}.json")
             else:
                 print(f"    ✓ sing-box: {name}.json 无变化")
+            if write_srs(SINGBOX_SRS_DIR / f"{name}.srs", sb.rules):
+                print(f"    ✓ sing-box: {name}.srs")
         else:
             print(f"    [WARN] {name} sing-box 转换为空，跳过")
 
+        # .mrs：DOMAIN-SET 条目为 domain；全部规则为 CIDR 则为 ipcidr；classical 无 mrs
+        if name in clash_domainset_names:
+            behavior = "domain"
+        elif all("/" in r and _parse_network(r) is not None for r in all_rules):
+            behavior = "ipcidr"
+        else:
+            behavior = None
+        if behavior and write_mrs(CLASH_DIR / f"{name}.mrs", behavior, all_rules):
+            print(f"    ✓ Clash:    {name}.mrs")
+
 
 # ═══════════════════════════════════════════════════════════════════════
 #  Main
-def fetch_external_modules():
+def fetch_external_modules(manifest: SyncRulesManifest | None = None):
     """拉取 sync-rules.txt # >> Module 节，写入 Surge/Module/<name>.sgmodule。"""
     print("\n── Step 1b: 拉取外部 sgmodule ──")
-    rules = parse_sync_rules()
-    entries = rules.get("module", [])
+    entries = (manifest or load_sync_rules()).module
     if not entries:
         print("  sync-rules.txt 无 Module 条目")
         return
@@ -1135,15 +2641,18 @@ def fetch_external_modules():
     module_dir = REPO_ROOT / "Surge" / "Module"
     module_dir.mkdir(parents=True, exist_ok=True)
 
-    module_urls = [e["url"] for e in entries]
+    module_urls = [e.url for e in entries]
     prefetched = prefetch_urls(module_urls, _UA, encode=True)
 
     for e in entries:
-        orig_url, name = e["url"], e["name"]
-        overrides: dict = e["overrides"]
+        orig_url, name = e.url, e.name
+        overrides = e.overrides
         text = prefetched.get(orig_url)
         if text is None:
-            _mark_upstream_deleted(module_dir / f"{name}.sgmodule")
+            if orig_url in FETCH_BUDGET.not_found:
+                _mark_upstream_deleted(module_dir / f"{name}.sgmodule")
+            else:
+                print(f"  [WARN] {name}.sgmodule 下载失败（非 404），保留现有文件")
             continue
         out = module_dir / f"{name}.sgmodule"
         lines = text.splitlines()
@@ -1201,24 +2710,58 @@ def fetch_external_modules():
 # ═══════════════════════════════════════════════════════════════════════
 
 def main():
+    parser = argparse.ArgumentParser(description="Surge RULE-SET 同步脚本")
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                        help="Step 4 并行转换进程数（默认 1 = 串行；0 = CPU 核数）")
+    parser.add_argument("--force", action="store_true",
+                        help="忽略 Step 4 转换清单，全部源文件重新转换")
+    parser.add_argument("--changed", action="append", metavar="PATH",
+                        help=f"Step 2/3 的改动文件（可重复；仓库相对路径），"
+                             f"优先于 {CHANGED_FILES_ENV}，并入快照检测结果")
+    parser.add_argument("--report", type=Path, default=RUN_REPORT, metavar="FILE",
+                        help=f"运行报告 JSON 输出路径（默认 {RUN_REPORT.relative_to(REPO_ROOT)}）")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("  Rules 同步脚本")
     print("=" * 60)
 
+    # zstd 在父进程解析并只提示一次（fork 出的 worker 继承解析结果）
+    if not _zstd():
+        print("  [WARN] 无 zstd 模块（pip install zstandard），跳过 .mrs 输出，保留现有文件")
+
+    # sync-rules.txt 只解析一次，各 Step 共用
+    manifest = load_sync_rules()
+
     # Step 1: 拉取外部规则（Surge 文件 + Clash 直转）
-    fetch_external_rules()
+    with REPORT.step("fetch-rules"):
+        fetch_external_rules(manifest)
 
     # Step 1b: 拉取外部 sgmodule
-    fetch_external_modules()
+    with REPORT.step("fetch-modules"):
+        fetch_external_modules(manifest)
 
     # Step 2/3: Streaming 三层双向同步
-    sync_streaming()
+    with REPORT.step("streaming"):
+        sync_streaming(args.changed)
 
     # Step 4: Surge → QX / Clash / sing-box
-    convert_all()
+    with REPORT.step("convert"):
+        convert_all(args.jobs, args.force, manifest)
 
     # Step 5: 清理
-    cleanup_stale()
+    with REPORT.step("cleanup"):
+        cleanup_stale(manifest)
+
+    REPORT.write(args.report)
+    timing = ", ".join(f"{s['name']} {s['seconds']:.1f}s" for s in REPORT.steps)
+    print(f"\n  耗时：{timing}（报告：{args.report.name}）")
+
+    failed = FETCH_BUDGET.failed | FETCH_BUDGET.errors
+    if failed:
+        print(f"\n  [WARN] {len(failed)} 个 URL 下载失败（非 404），对应文件保持不变：")
+        for url, err in failed.items():
+            print(f"    {url} ({err})")
 
     print(f"\n{'=' * 60}")
     print("  完成")
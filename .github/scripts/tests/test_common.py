@@ -0,0 +1,112 @@
+"""
+_common.py 回归测试（仅标准库，本地回环替身，不联网）
+
+运行：python3 -m unittest discover -s .github/scripts/tests
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import urllib.error
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["SYNC_FETCH_CACHE"] = ""  # 不读写真实下载缓存
+import _common  # noqa: E402
+from _common import FetchBudget, write_if_changed  # noqa: E402
+
+
+def _http_error(code: int) -> urllib.error.HTTPError:
+    return urllib.error.HTTPError("https://x.example/", code, "", None, None)
+
+
+class FetchBudgetTest(unittest.TestCase):
+
+    def test_classification(self):
+        budget = FetchBudget()
+        cases = {
+            "a": _http_error(404), "b": _http_error(503), "c": _http_error(429),
+            "d": TimeoutError(), "e": urllib.error.URLError(TimeoutError()),
+            "f": _http_error(403), "g": UnicodeDecodeError("utf-8", b"\xff", 0, 1, "bad"),
+            "h": urllib.error.URLError(OSError("Name or service not known")),
+        }
+        for url, e in cases.items():
+            budget.record(url, e)
+        self.assertEqual(budget.not_found, {"a"})
+        self.assertEqual(set(budget.failed), {"b", "c", "d", "e"})
+        self.assertEqual(set(budget.errors), {"f", "g", "h"})
+
+    def test_only_transient_retried(self):
+        budget = FetchBudget(retries=2)
+        self.assertTrue(budget.should_retry(_http_error(502), 0))
+        self.assertTrue(budget.should_retry(TimeoutError(), 1))
+        self.assertFalse(budget.should_retry(TimeoutError(), 2))
+        self.assertFalse(budget.should_retry(_http_error(403), 0))
+        self.assertFalse(budget.should_retry(_http_error(404), 0))
+
+
+class AsyncTimeoutTest(unittest.TestCase):
+    """超时按建连 / 每次读取计：排队等 host 名额与慢而持续的传输不算超时。"""
+
+    async def _serve(self, reader, writer):
+        self.handlers.append(asyncio.current_task())
+        try:
+            while line := await reader.readline():
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                if b"/stall" in line:
+                    await reader.read()  # 不响应，直到客户端超时断开
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 8\r\n\r\n")
+                for _ in range(4):  # 共约 0.2s，每次间隔小于超时
+                    await asyncio.sleep(0.05)
+                    writer.write(b"ok")
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    async def _fetch(self, paths: list[str], budget: FetchBudget) -> dict:
+        self.handlers: list[asyncio.Task] = []
+        server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = _common._AsyncFetcher("test", concurrency=8, per_host=1, timeout=0.15, budget=budget)
+        try:
+            return await fetcher.fetch_all([f"http://127.0.0.1:{port}{p}" for p in paths], False)
+        finally:
+            server.close()
+            await server.wait_closed()
+            await asyncio.gather(*self.handlers)  # fetch_all 已关闭全部连接，各 handler 随之结束
+
+    def test_queue_and_trickle_within_timeout(self):
+        budget = FetchBudget(retries=0)
+        results = asyncio.run(self._fetch(["/a", "/b", "/c"], budget))
+        self.assertEqual(list(results.values()), ["okokokok"] * 3)
+        self.assertEqual(budget.failed, {})
+
+    def test_stalled_read_times_out_as_transient(self):
+        budget = FetchBudget(retries=0)
+        with contextlib.redirect_stderr(io.StringIO()):  # [ERR] 下载失败 提示
+            results = asyncio.run(self._fetch(["/stall"], budget))
+        self.assertEqual(list(results.values()), [None])
+        self.assertEqual(len(budget.failed), 1)
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    def test_mode_new_and_preserved(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "out.txt"
+            self.assertTrue(write_if_changed(path, "a\n"))
+            self.assertEqual(path.stat().st_mode & 0o777, 0o644)
+            path.chmod(0o600)
+            self.assertTrue(write_if_changed(path, "b\n"))
+            self.assertEqual(path.stat().st_mode & 0o777, 0o600)
+            self.assertFalse(write_if_changed(path, "b\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
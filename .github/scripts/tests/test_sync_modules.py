@@ -0,0 +1,120 @@
+"""
+sync-modules.py 回归测试（仅标准库；合成模块均为英文名，不触发 pypinyin）
+
+运行：python3 -m unittest discover -s .github/scripts/tests
+"""
+
+import contextlib
+import io
+import re
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from _common import FetchBudget  # noqa: E402
+from bench import _load_script, _module_alias_cases, synth_sgmodules  # noqa: E402
+
+sm = _load_script("sync-modules")
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  _ModuleRewriter：域名别名 + {{{key}}} 改名
+# ═══════════════════════════════════════════════════════════════════════
+
+class ModuleRewriterTest(unittest.TestCase):
+
+    def test_alias_targets_domain_labels_only(self):
+        rw = sm._ModuleRewriter("ithome", "IT之家")
+        self.assertEqual(rw.alias("napi.ithome.com"), "napi.{{{IT之家}}}.com")
+        self.assertEqual(rw.rewrite_lines([r"^https?:\/\/api\.ithome\.com", r"\.(ithome|other)\.",
+                                           "script-path=https://x.example/ithome/ithome_ad.js",
+                                           "(ithomeapp|foo)"]),
+                         [r"^https?:\/\/api\.{{{IT之家}}}\.com", r"\.({{{IT之家}}}|other)\.",
+                          "script-path=https://x.example/ithome/ithome_ad.js", "(ithomeapp|foo)"])
+
+    def test_alias_output_goes_through_renames(self):
+        rw = sm._ModuleRewriter("ithome", "IT之家", {"IT之家": "IT之家-host", "opt": "IT之家-opt"})
+        self.assertEqual(rw.rewrite_lines(["a.ithome.com {{{opt}}} {{{IT之家}}} {{{other}}}"]),
+                         ["a.{{{IT之家-host}}}.com {{{IT之家-opt}}} {{{IT之家-host}}} {{{other}}}"])
+
+    def test_rename_result_not_realiased(self):
+        # 改名结果含关键字也不再做别名替换（与先别名、后改名的旧顺序一致）
+        rw = sm._ModuleRewriter("ithome", "IT之家", {"opt": "ithome.opt"})
+        self.assertEqual(rw.rewrite_lines(["{{{opt}}}"]), ["{{{ithome.opt}}}"])
+
+    def test_display_with_backslash_is_literal(self):
+        rw = sm._ModuleRewriter("kw", r"a\1b")
+        self.assertEqual(rw.alias("x.kw.com"), r"x.{{{a\1b}}}.com")
+
+    def test_matches_legacy_on_synthetic_modules(self):
+        for name, legacy, engine in _module_alias_cases(sm, synth_sgmodules(24, seed=1)):
+            with self.subTest(name):
+                self.assertEqual(legacy(), engine())
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  aggregate：模块缓存与瞬时失败
+# ═══════════════════════════════════════════════════════════════════════
+
+class AggregateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        self.output = root / "BlockAds.sgmodule"
+        self.modules = [m for i, m in enumerate(synth_sgmodules(9, seed=2)) if i % 3]  # 英文名
+        self.texts = {url: text for url, _, text in self.modules}
+        self.budget = FetchBudget()
+        patcher = mock.patch.multiple(
+            sm, OUTPUT_FILE=self.output, REPO_ROOT=root, FETCH_BUDGET=self.budget,
+            SORT_KEY_CACHE=root / ".sort-key-cache.json", MODULE_CACHE=root / ".module-cache.json",
+            load_urls=lambda: [(url, alias) for url, alias, _ in self.modules])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_aggregate(self, down: set[str] = frozenset()) -> str:
+        results = {url: (None if url in down else text) for url, text in self.texts.items()}
+        buf = io.StringIO()
+        with mock.patch.object(sm, "prefetch_urls", lambda urls, ua, encode=False: results), \
+                contextlib.redirect_stdout(buf):
+            sm.aggregate()
+        return buf.getvalue()
+
+    def body(self) -> str:
+        return re.sub(r"#!date=.*", "", self.output.read_text(encoding="utf-8"))
+
+    def test_cache_hit_is_identical(self):
+        self.assertIn(f"解析 {len(self.modules)} 个模块", self.run_aggregate())
+        cold = self.body()
+        self.assertIn("解析 0 个模块", self.run_aggregate())
+        self.assertEqual(self.body(), cold)
+
+    def test_transient_failure_reuses_cached_record(self):
+        self.run_aggregate()
+        full = self.body()
+        url = self.modules[1][0]
+        self.budget.failed[url] = "HTTP Error 503"
+        self.assertIn("沿用上次的记录", self.run_aggregate(down={url}))
+        self.assertEqual(self.body(), full)
+
+    def test_transient_failure_without_record_keeps_output(self):
+        self.output.write_text("existing\n", encoding="utf-8")
+        url = self.modules[1][0]
+        self.budget.failed[url] = "timed out"
+        self.run_aggregate(down={url})
+        self.assertEqual(self.output.read_text(encoding="utf-8"), "existing\n")
+
+    def test_permanent_failure_drops_module(self):
+        self.run_aggregate()
+        url, alias, _ = self.modules[1]
+        self.budget.errors[url] = "HTTP Error 403"
+        self.run_aggregate(down={url})
+        self.assertNotIn(alias, self.body())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+sync-rules.py 回归测试（仅标准库；.mrs 对照需 zstd 模块，缺失时跳过）
+
+运行：python3 -m unittest discover -s .github/scripts/tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench import _load_script  # noqa: E402  （同时关闭真实下载缓存）
+
+sr = _load_script("sync-rules")
+
+
+def _collapse(lines: list[str]) -> list[str]:
+    """经 _tokenize_surge → _CidrRunCollapser，返回聚合后的规则行（canonical）与原样的非规则行。"""
+    tokens = sr._CidrRunCollapser().apply(sr._tokenize_surge(lines))
+    return [tok[1].canonical if tok[0] == "rule" else tok[1] for tok in tokens]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  .srs / .mrs 与仓库已提交产物逐字节一致
+# ═══════════════════════════════════════════════════════════════════════
+
+class BinaryPayloadTest(unittest.TestCase):
+
+    def test_srs_matches_committed(self):
+        checked = 0
+        for src in sorted(sr.SINGBOX_DIR.glob("*.json")):
+            srs = sr.SINGBOX_SRS_DIR / f"{src.stem}.srs"
+            if not srs.exists():
+                continue
+            with self.subTest(src.stem):
+                ref = srs.read_bytes()
+                self.assertEqual(ref[:4], b"SRS\x02")
+                rules = json.loads(src.read_text(encoding="utf-8"))["rules"]
+                self.assertEqual(sr.encode_srs_payload(rules), zlib.decompress(ref[4:]))
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    @unittest.skipUnless(sr._zstd(), "无 zstd 模块（compression.zstd / zstandard）")
+    def test_mrs_matches_committed(self):
+        decompress = sr._zstd()[1]
+        checked = 0
+        for path in sorted(sr.CLASH_DIR.glob("*.mrs")):
+            src = next((p for p in (path.with_suffix(".yaml"), path.with_suffix(".txt")) if p.exists()), None)
+            if src is None:
+                continue
+            with self.subTest(path.stem):
+                ref = decompress(path.read_bytes())
+                behavior = "ipcidr" if ref[4] == sr.MRS_BEHAVIORS["ipcidr"] else "domain"
+                rules = list(sr._iter_clash_payload_rules(src.read_text(encoding="utf-8")))
+                self.assertEqual(sr.encode_mrs_payload(behavior, rules), ref)
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_srs_rejects_unencodable_field(self):
+        with self.assertRaises(ValueError):
+            sr.encode_srs_payload([{"process_name_regex": ["^foo$"]}])
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  IP-CIDR 聚合
+# ═══════════════════════════════════════════════════════════════════════
+
+class CidrCollapseTest(unittest.TestCase):
+
+    def test_telegram_adjacent_22s(self):
+        lines = [
+            "IP-CIDR,91.108.56.0/22,no-resolve",
+            "IP-CIDR,91.108.4.0/22,no-resolve",
+            "IP-CIDR,91.108.8.0/22,no-resolve",
+            "IP-CIDR,91.108.16.0/22,no-resolve",
+            "IP-CIDR,91.108.12.0/22,no-resolve",
+            "IP-CIDR,91.108.20.0/22,no-resolve",
+            "IP-CIDR6,2001:b28:f23d::/48,no-resolve",
+            "IP-CIDR6,2001:b28:f23c::/48,no-resolve",
+        ]
+        self.assertEqual(_collapse(lines), [
+            "IP-CIDR,91.108.56.0/22,no-resolve",
+            "IP-CIDR,91.108.4.0/22,no-resolve",
+            "IP-CIDR,91.108.8.0/21,no-resolve",
+            "IP-CIDR,91.108.16.0/21,no-resolve",
+            "IP-CIDR6,2001:b28:f23c::/47,no-resolve",
+        ])
+
+    def test_flags_and_case(self):
+        lines = ["ip-cidr,10.0.0.0/9", "IP-CIDR,10.128.0.0/9", "IP-CIDR,10.0.0.0/9,no-resolve"]
+        self.assertEqual(_collapse(lines), ["ip-cidr,10.0.0.0/8", "IP-CIDR,10.0.0.0/9,no-resolve"])
+
+    def test_annotations_split_runs(self):
+        # LAN.list 的写法：每条前有注释，聚合不得跨注释把条目并入别处
+        lines = ["# 组播", "IP-CIDR,224.0.0.0/4,no-resolve",
+                 "# 保留地址", "IP-CIDR,240.0.0.0/4,no-resolve"]
+        self.assertEqual(_collapse(lines), lines)
+
+    def test_inline_comment_not_merged(self):
+        lines = ["IP-CIDR,10.0.0.0/9 // keep", "IP-CIDR,10.128.0.0/9"]
+        self.assertEqual(len(_collapse(lines)), 2)
+
+    def test_lancidr_payload(self):
+        # lancidr.txt 为无注释的扁平 payload，跨注释的重叠 / 相邻段照常合并
+        lan = ["0.0.0.0/8", "10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8", "169.254.0.0/16",
+               "172.16.0.0/12", "192.168.0.0/16", "198.18.0.0/15", "224.0.0.0/4", "240.0.0.0/4",
+               "::/128", "::1/128", "::ffff:0:0/96", "fc00::/7", "fe80::/10", "ff00::/8"]
+        collapsed = sr.collapse_cidrs(lan)
+        self.assertEqual(len(collapsed), 14)
+        self.assertIn("224.0.0.0/3", collapsed)
+        self.assertIn("::/127", collapsed)
+        self.assertNotIn("224.0.0.0/4", collapsed)
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  Step 4 转换清单：跳过 / 重转 / --force
+# ═══════════════════════════════════════════════════════════════════════
+
+class ConvertManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        surge = root / "Surge" / "RULE-SET"
+        surge.mkdir(parents=True)
+        self.source = surge / "Example.list"
+        self.source.write_text("# > Example\nDOMAIN-SUFFIX,example.com\nIP-CIDR,10.0.0.0/8,no-resolve\n",
+                               encoding="utf-8")
+        self.qx = root / "Quantumult" / "X" / "Filter" / "Example.list"
+        patcher = mock.patch.multiple(
+            sr, REPO_ROOT=root, SURGE_DIR=surge, QX_DIR=self.qx.parent,
+            CLASH_DIR=root / "Clash" / "RuleSet", SINGBOX_DIR=root / "sing-box" / "source",
+            SINGBOX_SRS_DIR=root / "sing-box" / "rule-set",
+            CONVERT_MANIFEST=root / ".convert-manifest.json", RULE_INDEX=sr.RuleSetIndex(surge))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rules_txt = sr.SyncRulesManifest([], [], [], [])
+
+    def convert(self, force: bool = False) -> str:
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            sr.convert_all(force=force, manifest=self.rules_txt)
+        return buf.getvalue()
+
+    def test_skip_reconvert_force(self):
+        self.assertNotIn("跳过", self.convert())
+        expected = self.qx.read_text(encoding="utf-8")
+        entry = json.loads(sr.CONVERT_MANIFEST.read_text(encoding="utf-8"))["files"]["Example.list"]
+        self.assertIn("Quantumult/X/Filter/Example.list", entry["outputs"])
+
+        self.assertIn("跳过 1 个未变化文件", self.convert())
+
+        # 产物被手改：清单不再新鲜，重转并恢复
+        self.qx.write_text("tampered\n", encoding="utf-8")
+        self.assertNotIn("跳过", self.convert())
+        self.assertEqual(self.qx.read_text(encoding="utf-8"), expected)
+
+        # 源变动：重转
+        with self.source.open("a", encoding="utf-8") as f:
+            f.write("DOMAIN,www.example.org\n")
+        self.assertNotIn("跳过", self.convert())
+        self.assertIn("www.example.org", self.qx.read_text(encoding="utf-8"))
+
+        self.assertIn("跳过", self.convert())
+        self.assertNotIn("跳过", self.convert(force=True))
+
+    def test_converter_version_covers_common(self):
+        version = sr._converter_version()
+        self.assertEqual(version.count("+"), 1)
+        self.assertTrue(all(version.split("+")))
+
+
+# ═══════════════════════════════════════════════════════════════════════
+#  sync-rules.txt 解析
+# ═══════════════════════════════════════════════════════════════════════
+
+class SyncRulesParseTest(unittest.TestCase):
+
+    def parse(self, text: str):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "sync-rules.txt"
+            path.write_text(text, encoding="utf-8")
+            return sr.parse_sync_rules(path)
+
+    def test_duplicate_is_noop(self):
+        m = self.parse("# >> Surge\nhttps://a.example/x.list,Foo\nhttps://a.example/x.list,Foo\n")
+        self.assertEqual([e.name for e in m.surge], ["Foo"])
+        self.assertEqual(m.problems, [])
+
+    def test_rejected_names_kept(self):
+        m = self.parse("# >> Surge\nftp://a.example/x.list,Apple/Foo\nhttps://b.example/y.list,Bar\n")
+        self.assertEqual([e.name for e in m.surge], ["Bar"])
+        self.assertEqual(len(m.problems), 1)
+        self.assertEqual(m.rejected, {"Apple/Foo"})
+
+
+if __name__ == "__main__":
+    unittest.main()